@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from pathlib import Path
+from filelock import FileLock
+from storage import link_or_copy
+
+# --- CONTENT-ADDRESSED ARTIFACT STORE ---
+# Finished artifacts (fp16 and quantized GGUFs) are stored once under blobs/<sha256> and indexed by a
+# build key that describes everything that went into them. A hit is linked into the job directory
+# instead of being rebuilt.
+
+_digest_cache = {}
+
+def file_sha256(path: str, chunk_size: int = 16 << 20) -> str:
+    # Streams a file through sha256 without loading it into memory.
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+def tool_version(path: str) -> str:
+    # Identifies a converter script or llama.cpp binary by content, memoized on size and mtime.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    cache_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if cache_key not in _digest_cache:
+        _digest_cache[cache_key] = file_sha256(path)
+    return _digest_cache[cache_key]
+
+def source_fingerprint(local_dir: str) -> list:
+    # Describes a downloaded model folder by relative path, size and mtime of every file in it.
+    fingerprint = []
+    for root, _, files in os.walk(local_dir):
+        for name in files:
+            if name.startswith("."):
+                continue
+            full_path = os.path.join(root, name)
+            st = os.stat(full_path)
+            fingerprint.append([os.path.relpath(full_path, local_dir).replace(os.sep, "/"), st.st_size, st.st_mtime_ns])
+    return sorted(fingerprint)
+
+def make_key(**fields) -> str:
+    # Builds a stable key from the fields that determine an artifact's content.
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+class ArtifactStore:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root)
+        self.blobs_dir = self.root / "blobs"
+        self.index_path = self.root / "index.json"
+        self.lock_path = self.root / "index.lock"
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _blob_path(self, sha256: str) -> Path:
+        return self.blobs_dir / sha256[:2] / sha256
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: dict):
+        # Writes the index to a temporary file and atomically replaces the old one.
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def lookup(self, key: str) -> dict | None:
+        # Returns the index entry for a key if its blob is still intact, refreshing its LRU timestamp.
+        if not self.enabled or not self.index_path.exists():
+            return None
+        with FileLock(str(self.lock_path)):
+            index = self._read_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            blob_path = self._blob_path(entry["sha256"])
+            if not blob_path.exists() or blob_path.stat().st_size != entry["size"]:
+                print(f"Artifact store entry {key[:12]} is missing or damaged; dropping it.")
+                del index[key]
+                self._write_index(index)
+                return None
+            entry["last_used"] = time.time()
+            self._write_index(index)
+            return entry
+
+    def fetch(self, key: str, dest: str) -> dict | None:
+        # Links a stored artifact to dest and returns its entry, or None on a miss.
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        method = link_or_copy(str(self._blob_path(entry["sha256"])), dest)
+        print(f"Reused {entry['name']} from artifact store ({entry['sha256'][:12]}, {method}).")
+        return entry
+
+    def publish(self, key: str, src: str, **fields) -> dict | None:
+        # Adds a finished artifact to the store. A failure here never fails the job that built it.
+        if not self.enabled:
+            return None
+        try:
+            return self._publish(key, src, fields)
+        except OSError as e:
+            print(f"Could not publish {os.path.basename(src)} to artifact store: {e}")
+            return None
+
+    def _publish(self, key: str, src: str, fields: dict) -> dict | None:
+        # The blob is staged under a temporary name and renamed into place, so readers never see a partial file.
+        size = os.path.getsize(src)
+        if size > self.max_bytes:
+            print(f"Not storing {os.path.basename(src)}: larger than the artifact store budget.")
+            return None
+        sha256 = file_sha256(src)
+        blob_path = self._blob_path(sha256)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        if not blob_path.exists():
+            tmp_path = blob_path.with_name(f"{sha256}.{os.getpid()}.partial")
+            link_or_copy(src, str(tmp_path))
+            os.replace(tmp_path, blob_path)
+
+        entry = {"sha256": sha256, "size": size, "name": os.path.basename(src), "fields": fields, "created": time.time(), "last_used": time.time()}
+        with FileLock(str(self.lock_path)):
+            index = self._read_index()
+            index[key] = entry
+            self._evict(index)
+            self._write_index(index)
+        print(f"Published {entry['name']} to artifact store ({sha256[:12]}).")
+        return entry
+
+    def _evict(self, index: dict):
+        # Drops least-recently-used entries until the unique blobs fit in the size budget.
+        blob_sizes = {e["sha256"]: e["size"] for e in index.values()}
+        total = sum(blob_sizes.values())
+        for key, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            del index[key]
+            if any(e["sha256"] == entry["sha256"] for e in index.values()):
+                continue
+            blob_path = self._blob_path(entry["sha256"])
+            if blob_path.exists():
+                blob_path.unlink()
+            total -= entry["size"]
+            print(f"Evicted {entry['name']} from artifact store ({entry['sha256'][:12]}).")
@@ -0,0 +1,579 @@
+import os
+import re
+import sys
+import json
+import time
+import struct
+import shutil
+import fnmatch
+import hashlib
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+
+# --- END-TO-END PIPELINE BENCHMARK ---
+# Drives run_job and upload_job from gguf_pipeline.py against stand-in llama.cpp tools
+# and a local stand-in for the Hub, so every stage can be timed without real models or an account.
+# The stand-in tools are this script re-invoked with --fake-tool: they read and write realistically
+# sized (filled with a fixed pattern, but structurally valid) GGUF files at a configurable throughput and print the
+# same progress lines as the real tools. Per stage, the harness reports wall time, bytes read and
+# written, and peak RSS; it also reports upload throughput, and can compare a run against a baseline.
+#
+#   python benchmark_pipeline.py --model-size-mb 512 --quants Q4_K_M Q8_0 --json run.json
+#   python benchmark_pipeline.py --baseline run.json
+#
+# POSIX only: the stand-in tools are executable scripts, not .exe files.
+
+BENCH_PATH = os.path.abspath(__file__)
+REPO_DIR = os.path.dirname(BENCH_PATH)
+MODEL_ID = "bench-org/bench-model"
+BENCH_USER = "bench-user"
+TENSOR_ROW = 4096
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# Which stage a progress message belongs to, matched in order against the progress description.
+STAGE_PATTERNS = [
+    ("queue", r"^Waiting for resources"),
+    ("estimate", r"^Estimating"),
+    ("download", r"^Checking model cache"),
+    ("convert", r"^(Converting|Writing GGUF)"),
+    ("imatrix", r"^Computing imatrix"),
+    ("quantize", r"^Quantizing"),
+    ("evaluate", r"^(Evaluating|Benchmarking)"),
+    ("split", r"^Splitting"),
+    ("upload", r"^(Uploaded|Creating commit)"),
+]
+TOOL_STAGES = {"convert": "convert", "imatrix": "imatrix", "quantize": "quantize", "gguf-split": "split", "perplexity": "evaluate", "bench": "evaluate"}
+FAKE_TOOLS = {"convert_hf_to_gguf.py": "convert", "llama-imatrix": "imatrix", "llama-quantize": "quantize", "llama-gguf-split": "gguf-split", "llama-perplexity": "perplexity", "llama-bench": "bench"}
+
+# --- Process statistics ---
+
+def _self_io() -> tuple[int, int]:
+    # Bytes read and written by this process so far (Linux only; zeros elsewhere).
+    try:
+        with open("/proc/self/io", "r") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def _self_rss() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return _peak_rss()
+
+def _peak_rss() -> int:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# --- Stand-in llama.cpp tools ---
+
+class _Throttle:
+    # Paces a tool so that processing n bytes takes n / BENCH_TOOL_MBPS seconds.
+    def __init__(self, env_name: str, default_mbps: float):
+        self.rate = float(os.environ.get(env_name, default_mbps)) * 1e6
+        self.start = time.perf_counter()
+        self.bytes = 0
+
+    def advance(self, n: int):
+        self.bytes += n
+        if self.rate > 0:
+            delay = self.start + self.bytes / self.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+def _read_file(path: str, throttle: _Throttle, on_chunk=None) -> int:
+    total = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_BYTES):
+            total += len(chunk)
+            throttle.advance(len(chunk))
+            if on_chunk:
+                on_chunk(total)
+    return total
+
+def _gguf_string(s: str) -> bytes:
+    data = s.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+def write_fake_gguf(path: str, n_tensors: int, total_bytes: int, throttle: _Throttle | None = None, on_tensor=None) -> int:
+    # Writes a valid GGUF with n_tensors F16 tensors adding up to about total_bytes. The data is a fixed
+    # nonzero pattern, so damage to a file (e.g. zeroed ranges) shows up in its checksum.
+    rows = max(1, total_bytes // (n_tensors * TENSOR_ROW * 2))
+    nbytes = TENSOR_ROW * rows * 2
+    padded = (nbytes + 31) // 32 * 32
+    kv = _gguf_string("general.architecture") + struct.pack("<I", 8) + _gguf_string("llama")
+    infos = b"".join(_gguf_string(f"blk.{i}.weight") + struct.pack("<IQQIQ", 2, TENSOR_ROW, rows, 1, i * padded) for i in range(n_tensors))
+    header = b"GGUF" + struct.pack("<IQQ", 3, n_tensors, 1) + kv + infos
+    header += b"\0" * ((len(header) + 31) // 32 * 32 - len(header))
+    pattern = (bytes(range(1, 256)) * (min(padded, CHUNK_BYTES) // 255 + 1))[:min(padded, CHUNK_BYTES)]
+    with open(path, "wb") as f:
+        f.write(header)
+        for i in range(n_tensors):
+            remaining = padded
+            while remaining:
+                n = min(remaining, len(pattern))
+                f.write(pattern[:n])
+                remaining -= n
+                if throttle:
+                    throttle.advance(n)
+            if on_tensor:
+                on_tensor(i, n_tensors)
+    return len(header) + n_tensors * padded
+
+def _write_fake_imatrix(path: str, n_tensors: int, chunks: int):
+    # Legacy imatrix.dat layout: entries of (name, ncall, values), then the chunk count and dataset name.
+    # Values are sums over calls, so every value equals the chunk count and merged files stay checkable.
+    with open(path, "wb") as f:
+        f.write(struct.pack("<i", n_tensors))
+        for i in range(n_tensors):
+            name = f"blk.{i}.weight".encode("utf-8")
+            f.write(struct.pack("<i", len(name)) + name + struct.pack("<ii", chunks, TENSOR_ROW))
+            f.write(struct.pack(f"<{TENSOR_ROW}f", *([float(chunks)] * TENSOR_ROW)))
+        dataset = b"groups_merged.txt"
+        f.write(struct.pack("<ii", chunks, len(dataset)) + dataset)
+
+def _gguf_tensor_count(path: str) -> int:
+    with open(path, "rb") as f:
+        return struct.unpack("<4sIQ", f.read(16))[2]
+
+def run_fake_tool(tool: str, argv: list[str]) -> int:
+    # Entry point of the stand-in tools; logs what the tool did to BENCH_TOOL_LOG.
+    sys.path.insert(0, REPO_DIR)
+    started = time.time()
+    read = written = 0
+    n_tensors = int(os.environ.get("BENCH_TENSORS", "64"))
+    throttle = _Throttle("BENCH_TOOL_MBPS", 500)
+
+    if tool == "convert":
+        local_dir, out = argv[0], argv[argv.index("--outfile") + 1]
+        for name in sorted(os.listdir(local_dir)):
+            if name.endswith(".safetensors"):
+                read += _read_file(os.path.join(local_dir, name), throttle)
+        for i in range(n_tensors):
+            print(f"INFO:hf-to-gguf:blk.{i}.weight,                torch.float16 --> F16, shape = {{{TENSOR_ROW}, ...}}", flush=True)
+        written = write_fake_gguf(out, n_tensors, read, throttle, lambda i, n: print(f"\rWriting: {100 * (i + 1) // n:3d}%|", end="", flush=True))
+        print()
+
+    elif tool == "quantize":
+        args = argv[2:] if argv[0] == "--imatrix" else argv
+        if argv[0] == "--imatrix":
+            read += _read_file(argv[1], throttle)
+        fp16, out, method = args[0], args[1], args[2]
+        from resource_estimator import BITS_PER_WEIGHT
+        n = _gguf_tensor_count(fp16)
+        per_tensor = max(1, os.path.getsize(fp16) // n)
+        fp16_bytes = _read_file(fp16, throttle, lambda done: print(f"[{min(n, done // per_tensor):4d}/{n:4d}] blk.{min(n, done // per_tensor) - 1}.weight - [ {TENSOR_ROW}, ...], type = f16, converting to {method.lower()}", flush=True))
+        read += fp16_bytes
+        written = write_fake_gguf(out, n, int(fp16_bytes * BITS_PER_WEIGHT.get(method.upper(), 8.5) / 16), throttle)
+
+    elif tool == "imatrix":
+        model, out = argv[argv.index("-m") + 1], argv[argv.index("-o") + 1]
+        # A worker given part of the corpus evaluates a proportional share of the chunks; every chunk
+        # is a pass over the weights, modelled as reading 1/BENCH_IMATRIX_CHUNKS of the model.
+        full_chunks = int(os.environ.get("BENCH_IMATRIX_CHUNKS", "20"))
+        corpus = os.path.getsize(argv[argv.index("-f") + 1])
+        chunks = max(1, round(full_chunks * corpus / int(os.environ.get("BENCH_CORPUS_BYTES", corpus))))
+        print(f"compute_imatrix: computing over {chunks} chunks with batch_size 512", flush=True)
+        size = os.path.getsize(model)
+        with open(model, "rb") as f:
+            for chunk in range(chunks):
+                f.seek((chunk % full_chunks) * (size // full_chunks))
+                data = f.read(size // full_chunks) or b""
+                read += len(data)
+                throttle.advance(len(data))
+                print(f"[{chunk + 1}]5.{chunk % 100:02d},", end="", flush=True)
+        print()
+        _write_fake_imatrix(out, _gguf_tensor_count(model), chunks)
+        written = os.path.getsize(out)
+
+    elif tool == "perplexity":
+        # The fp16 run writes the base logits; each quant run reads them back and scores against them.
+        model, base = argv[argv.index("-m") + 1], argv[argv.index("--kl-divergence-base") + 1]
+        chunks = int(argv[argv.index("--chunks") + 1]) if "--chunks" in argv else 8
+        kld_mode = "--kl-divergence" in argv
+        if kld_mode:
+            read += _read_file(base, throttle)
+            chunks = int(os.path.getsize(base) // (1 << 20)) or 1
+        print(f"{'kl_divergence: computing' if kld_mode else 'perplexity: calculating perplexity'} over {chunks} chunks, n_ctx=512", flush=True)
+        size = os.path.getsize(model)
+        with open(model, "rb") as f:
+            for chunk in range(chunks):
+                f.seek((chunk * size // chunks))
+                data = f.read(size // chunks) or b""
+                read += len(data)
+                throttle.advance(len(data))
+                print(f"{chunk + 1:4d}      6.{chunk % 100:02d} ±   0.05" if kld_mode else f"[{chunk + 1}]6.{chunk % 100:02d},", flush=True)
+        # Smaller quants of the same fp16 score worse, as real ones do.
+        loss = _gguf_tensor_count(model) * TENSOR_ROW * 16 / max(size, 1) if kld_mode else 0.0
+        if kld_mode:
+            print(f"Mean PPL(Q)                   :   {6.0 * (1 + loss / 100):.4f} ±   0.0500")
+            print(f"Mean    KLD:   {loss / 1000:.6f} ±   0.000100")
+            print(f"Same top p: {100 - loss:.3f} ± 0.100 %")
+        else:
+            with open(base, "wb") as f:
+                f.write(b"\0" * (chunks << 20))
+            written = chunks << 20
+            print("Final estimate: PPL = 6.0000 +/- 0.0500")
+
+    elif tool == "bench":
+        model = argv[argv.index("-m") + 1]
+        started_read = time.time()
+        read += _read_file(model, throttle)
+        seconds = max(time.time() - started_read, 1e-3)
+        print(json.dumps({"model_filename": model, "n_prompt": 64, "n_gen": 0, "avg_ts": 64 / seconds}))
+        print(json.dumps({"model_filename": model, "n_prompt": 0, "n_gen": 16, "avg_ts": 16 / seconds}))
+
+    elif tool == "gguf-split":
+        import mmap
+        from gguf_split import GGUFReader, parse_split_size, plan_splits, split_gguf
+        max_size = argv[argv.index("--split-max-size") + 1] if "--split-max-size" in argv else None
+        max_tensors = int(argv[argv.index("--split-max-tensors") + 1]) if "--split-max-tensors" in argv else 256
+        src, prefix = argv[-2], argv[-1]
+        with open(src, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            n_split = len(plan_splits(GGUFReader(mm).tensors, max_tensors, parse_split_size(max_size) if max_size else None))
+        print(f"n_split: {n_split}", flush=True)
+        for path in split_gguf(src, prefix, max_tensors, max_size):
+            written += os.path.getsize(path)
+            throttle.advance(os.path.getsize(path))
+            print(f"Writing file {path} ... done", flush=True)
+        read = os.path.getsize(src)
+
+    else:
+        print(f"Unknown fake tool {tool}", file=sys.stderr)
+        return 2
+
+    log_path = os.environ.get("BENCH_TOOL_LOG")
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"tool": tool, "start": started, "end": time.time(), "read": read, "written": written, "peak_rss": _peak_rss()}) + "\n")
+    return 0
+
+# --- Stand-in Hub ---
+
+class FakeHub:
+    # Implements the HfApi methods the pipeline uses, backed by a local folder. Downloads and uploads
+    # move real bytes and are paced at the configured bandwidth.
+    def __init__(self, root: str, model_size: int, n_tensors: int, download_mbps: float, upload_mbps: float):
+        self.root = root
+        self.revision = hashlib.sha1(f"{model_size}-{n_tensors}".encode()).hexdigest()
+        self.download_rate = download_mbps * 1e6
+        self.upload_rate = upload_mbps * 1e6
+        self.n_tensors = n_tensors
+        self.repo_dir = os.path.join(root, "repos", MODEL_ID)
+        self.uploaded_bytes = 0
+        self.upload_window = [None, None]
+        self.commits = []
+        self._lock = threading.Lock()
+        os.makedirs(self.repo_dir, exist_ok=True)
+        with open(os.path.join(self.repo_dir, "config.json"), "w") as f:
+            json.dump({"hidden_size": TENSOR_ROW, "num_hidden_layers": n_tensors, "vocab_size": 32000}, f)
+        with open(os.path.join(self.repo_dir, "README.md"), "w") as f:
+            f.write("# Benchmark model\n")
+        zeros = bytes(CHUNK_BYTES)
+        with open(os.path.join(self.repo_dir, "model.safetensors"), "wb") as f:
+            remaining = model_size
+            while remaining:
+                f.write(zeros[:min(remaining, CHUNK_BYTES)])
+                remaining -= min(remaining, CHUNK_BYTES)
+        self.files = {}
+        for name in os.listdir(self.repo_dir):
+            path = os.path.join(self.repo_dir, name)
+            self.files[name] = {"size": os.path.getsize(path), "sha256": _sha256(path)}
+
+    def _pace(self, rate: float, n: int, started: float):
+        if rate > 0:
+            delay = started + n / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def whoami(self, token=None):
+        return {"name": BENCH_USER}
+
+    def model_info(self, repo_id, **kwargs):
+        return SimpleNamespace(sha=self.revision)
+
+    def list_repo_tree(self, repo_id, recursive=True, revision=None, **kwargs):
+        return [SimpleNamespace(path=name, size=info["size"], lfs={"size": info["size"], "sha256": info["sha256"]} if name.endswith(".safetensors") else None) for name, info in self.files.items()]
+
+    def get_safetensors_metadata(self, repo_id, **kwargs):
+        params = self.files["model.safetensors"]["size"] // 2
+        tensors = {f"blk.{i}.weight": SimpleNamespace(parameter_count=params // self.n_tensors) for i in range(self.n_tensors)}
+        return SimpleNamespace(parameter_count={"F16": params}, files_metadata={"model.safetensors": SimpleNamespace(tensors=tensors)})
+
+    def hf_hub_download(self, repo_id, filename, **kwargs):
+        return os.path.join(self.repo_dir, filename)
+
+    def snapshot_download(self, repo_id, revision=None, cache_dir=None, allow_patterns=None, **kwargs):
+        # Lays files out like the Hugging Face hub cache: blobs plus a snapshot of symlinks.
+        cache_root = os.path.join(cache_dir or os.path.join(self.root, "hf_cache"), "models--" + repo_id.replace("/", "--"))
+        snapshot = os.path.join(cache_root, "snapshots", revision or self.revision)
+        os.makedirs(snapshot, exist_ok=True)
+        os.makedirs(os.path.join(cache_root, "blobs"), exist_ok=True)
+        for name, info in self.files.items():
+            if allow_patterns and not any(fnmatch.fnmatch(name, p) for p in allow_patterns):
+                continue
+            blob = os.path.join(cache_root, "blobs", info["sha256"])
+            if not os.path.exists(blob):
+                started, copied = time.perf_counter(), 0
+                with open(os.path.join(self.repo_dir, name), "rb") as src, open(blob, "wb") as dst:
+                    while chunk := src.read(CHUNK_BYTES):
+                        dst.write(chunk)
+                        copied += len(chunk)
+                        self._pace(self.download_rate, copied, started)
+            link = os.path.join(snapshot, name)
+            if not os.path.lexists(link):
+                os.symlink(os.path.relpath(blob, snapshot), link)
+        return snapshot
+
+    def create_repo(self, repo_id, exist_ok=False, private=False, **kwargs):
+        return f"https://fake-hub.local/{repo_id}"
+
+    def preupload_lfs_files(self, repo_id, additions, **kwargs):
+        for operation in additions:
+            started, sent = time.perf_counter(), 0
+            with self._lock:
+                self.upload_window[0] = self.upload_window[0] or started
+            with open(operation.path_or_fileobj, "rb") as f:
+                while chunk := f.read(CHUNK_BYTES):
+                    sent += len(chunk)
+                    self._pace(self.upload_rate, sent, started)
+            with self._lock:
+                self.uploaded_bytes += sent
+
+    def create_commit(self, repo_id, operations, commit_message, **kwargs):
+        with self._lock:
+            self.commits.append({"repo_id": repo_id, "files": [op.path_in_repo for op in operations], "message": commit_message})
+            self.upload_window[1] = time.perf_counter()
+        return SimpleNamespace(commit_url=f"https://fake-hub.local/{repo_id}/commit/bench")
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_BYTES):
+            h.update(chunk)
+    return h.hexdigest()
+
+# --- Stage recording ---
+
+class StageRecorder:
+    # Receives the pipeline's progress reports: classifies each progress message into a stage and charges the time,
+    # this process's I/O and its peak RSS to the stage that was current.
+    def __init__(self):
+        self.stats = {}
+        self.stage = None
+        self._since = None
+        self._io = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+        self._sampler.start()
+
+    def _entry(self, stage: str) -> dict:
+        return self.stats.setdefault(stage, {"wall": 0.0, "read": 0, "written": 0, "peak_rss": 0})
+
+    def _sample_rss(self):
+        while not self._stop.wait(0.02):
+            with self._lock:
+                if self.stage:
+                    entry = self._entry(self.stage)
+                    entry["peak_rss"] = max(entry["peak_rss"], _self_rss())
+
+    def __call__(self, fraction=None, desc=None, **kwargs):
+        for stage, pattern in STAGE_PATTERNS:
+            if desc and re.search(pattern, desc):
+                self.mark(stage)
+                return
+
+    def mark(self, stage: str | None):
+        with self._lock:
+            if stage == self.stage:
+                return
+            now, io = time.perf_counter(), _self_io()
+            if self.stage:
+                entry = self._entry(self.stage)
+                entry["wall"] += now - self._since
+                entry["read"] += io[0] - self._io[0]
+                entry["written"] += io[1] - self._io[1]
+            self.stage, self._since, self._io = stage, now, io
+
+    def finish(self, tool_log: str) -> dict:
+        # Closes the current stage and adds what the stand-in tools reported.
+        self.mark(None)
+        self._stop.set()
+        self._sampler.join()
+        if os.path.exists(tool_log):
+            with open(tool_log, "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    entry = self._entry(TOOL_STAGES[record["tool"]])
+                    entry["read"] += record["read"]
+                    entry["written"] += record["written"]
+                    entry["peak_rss"] = max(entry["peak_rss"], record["peak_rss"])
+            os.remove(tool_log)
+        return self.stats
+
+# --- Harness ---
+
+def _prepare_workspace(workspace: str):
+    # Installs the stand-in tools where get_platform_executable() and CONVERSION_SCRIPT look for them.
+    tools_dir = os.path.join(workspace, "llama.cpp")
+    os.makedirs(tools_dir, exist_ok=True)
+    for filename, tool in FAKE_TOOLS.items():
+        path = os.path.join(tools_dir, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"#!{sys.executable}\nimport sys, runpy\nsys.argv = [{BENCH_PATH!r}, '--fake-tool', {tool!r}] + sys.argv[1:]\nrunpy.run_path({BENCH_PATH!r}, run_name='__main__')\n")
+        os.chmod(path, 0o755)
+    shutil.copy(os.path.join(REPO_DIR, "groups_merged.txt"), os.path.join(tools_dir, "groups_merged.txt"))
+
+def _clear_caches(workspace: str, hub: FakeHub):
+    for name in ("model_cache", "artifact_store", "imatrix_cache", "hub_cache"):
+        shutil.rmtree(os.path.join(workspace, name), ignore_errors=True)
+    shutil.rmtree(os.path.join(hub.root, "hf_cache"), ignore_errors=True)
+
+def check_artifact_store(workspace: str) -> list[str]:
+    # Blobs whose content no longer matches their sha256 name, e.g. a stored quant that a job modified in
+    # place through a hardlink (such as the splitter releasing its data). Later jobs would reuse them.
+    damaged = []
+    blobs_dir = os.path.join(workspace, "artifact_store", "blobs")
+    for root, _, names in os.walk(blobs_dir):
+        for name in names:
+            if not name.endswith(".partial") and _sha256(os.path.join(root, name)) != name:
+                damaged.append(name)
+    return damaged
+
+def run_once(pipeline, hub: FakeHub, args) -> dict:
+    tool_log = os.path.abspath("bench_tools.jsonl")
+    os.environ["BENCH_TOOL_LOG"] = tool_log
+    hub.uploaded_bytes, hub.upload_window = 0, [None, None]
+    recorder = StageRecorder()
+    started = time.perf_counter()
+    recorder.mark("setup")
+    result = pipeline.run_job(MODEL_ID, args.quants, args.imatrix, "bench-token", split_model=args.split, split_max_tensors=args.split_max_tensors, split_max_size=args.split_max_size, evaluate=args.evaluate, on_progress=recorder)
+    recorder.mark("upload")
+    pipeline.upload_job(result["outdir"], "bench-token", on_progress=recorder)
+    total = time.perf_counter() - started
+    stages = recorder.finish(tool_log)
+    upload_seconds = hub.upload_window[1] - hub.upload_window[0] if all(hub.upload_window) else 0
+    return {
+        "total_wall": total,
+        "stages": stages,
+        "upload_bytes": hub.uploaded_bytes,
+        "upload_mbps": hub.uploaded_bytes / upload_seconds / 1e6 if upload_seconds else 0.0,
+    }
+
+def run_benchmark(args) -> dict:
+    workspace = os.path.abspath(args.workspace or tempfile.mkdtemp(prefix="gguf-bench-"))
+    os.makedirs(workspace, exist_ok=True)
+    _prepare_workspace(workspace)
+    # Module-level configuration in gguf_pipeline is read on import, relative to the working directory.
+    os.environ.update({
+        "BENCH_TENSORS": str(args.tensors),
+        "BENCH_TOOL_MBPS": str(args.tool_mbps),
+        "BENCH_IMATRIX_CHUNKS": str(args.imatrix_chunks),
+        "BENCH_CORPUS_BYTES": str(os.path.getsize(os.path.join(REPO_DIR, "groups_merged.txt"))),
+        "GGUF_SPLIT_BACKEND": args.split_backend,
+        "UPLOAD_WORKERS": str(args.upload_workers),
+        "PREFLIGHT_STRICT": "0",
+    })
+    os.chdir(workspace)
+    sys.path.insert(0, REPO_DIR)
+    import gguf_pipeline as pipeline
+
+    hub = FakeHub(os.path.join(workspace, "fake_hub"), args.model_size_mb * 1000**2, args.tensors, args.download_mbps, args.upload_mbps)
+    pipeline.HfApi = lambda token=None, **kwargs: hub
+    pipeline.HUB_CACHE.whoami_fn = hub.whoami
+    runs = []
+    try:
+        for i in range(args.runs):
+            if args.cold and i:
+                _clear_caches(workspace, hub)
+            runs.append(run_once(pipeline, hub, args))
+            runs[-1]["damaged_blobs"] = check_artifact_store(workspace)
+            print(format_run(i, runs[-1]))
+    finally:
+        os.chdir(REPO_DIR)
+        if not args.keep and not args.workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+    config = {k: v for k, v in vars(args).items() if k not in ("json", "baseline", "workspace", "keep", "threshold")}
+    return {"config": config, "runs": runs}
+
+# --- Reporting ---
+
+def format_run(index: int, run: dict) -> str:
+    lines = [f"Run {index + 1}: {run['total_wall']:.2f}s total, upload {run['upload_bytes'] / 1e6:.0f} MB at {run['upload_mbps']:.1f} MB/s",
+             f"  {'stage':<10}{'wall s':>9}{'read MB':>10}{'written MB':>12}{'peak RSS MB':>13}"]
+    for stage, s in run["stages"].items():
+        lines.append(f"  {stage:<10}{s['wall']:>9.2f}{s['read'] / 1e6:>10.1f}{s['written'] / 1e6:>12.1f}{s['peak_rss'] / 1e6:>13.1f}")
+    return "\n".join(lines)
+
+def compare(current: dict, baseline: dict, threshold: float, min_seconds: float = 0.05) -> list[str]:
+    # Compares run i with baseline run i and lists stages that got slower than threshold (e.g. 0.1 = 10%).
+    if current["config"] != baseline["config"]:
+        print("Warning: the baseline was recorded with a different configuration.")
+    regressions = []
+    for i, (run, base) in enumerate(zip(current["runs"], baseline["runs"])):
+        for stage, base_stats in base["stages"].items():
+            now = run["stages"].get(stage, {}).get("wall", 0.0)
+            if base_stats["wall"] >= min_seconds and now > base_stats["wall"] * (1 + threshold):
+                regressions.append(f"run {i + 1} {stage}: {base_stats['wall']:.2f}s -> {now:.2f}s (+{(now / base_stats['wall'] - 1) * 100:.0f}%)")
+        if base["upload_mbps"] and run["upload_mbps"] < base["upload_mbps"] * (1 - threshold):
+            regressions.append(f"run {i + 1} upload throughput: {base['upload_mbps']:.1f} -> {run['upload_mbps']:.1f} MB/s")
+    return regressions
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    # The stand-in tools take llama.cpp's flags, some of which clash with the harness's own.
+    if argv[:1] == ["--fake-tool"]:
+        return run_fake_tool(argv[1], argv[2:])
+    parser = argparse.ArgumentParser(description="Benchmark the GGUF pipeline with stand-in tools and a local Hub.")
+    parser.add_argument("--model-size-mb", type=int, default=256, help="Size of the source safetensors (MB).")
+    parser.add_argument("--tensors", type=int, default=64, help="Number of tensors in the model.")
+    parser.add_argument("--quants", nargs="+", default=["Q4_K_M"], help="Quant types to produce.")
+    parser.add_argument("--imatrix", action="store_true", help="Compute and use an importance matrix.")
+    parser.add_argument("--imatrix-chunks", type=int, default=20)
+    parser.add_argument("--evaluate", action="store_true", help="Evaluate the quants (perplexity, KLD, llama-bench) before uploading.")
+    parser.add_argument("--split", action="store_true", help="Split the outputs before uploading.")
+    parser.add_argument("--split-max-tensors", type=int, default=16)
+    parser.add_argument("--split-max-size", default="")
+    parser.add_argument("--split-backend", choices=["native", "llama"], default="native")
+    parser.add_argument("--tool-mbps", type=float, default=500, help="Throughput of the stand-in tools (MB/s, 0 = unlimited).")
+    parser.add_argument("--download-mbps", type=float, default=200, help="Download bandwidth of the stand-in Hub (MB/s, 0 = unlimited).")
+    parser.add_argument("--upload-mbps", type=float, default=100, help="Upload bandwidth per transfer (MB/s, 0 = unlimited).")
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=2, help="Runs in one process; later runs hit the warm caches unless --cold.")
+    parser.add_argument("--cold", action="store_true", help="Clear all caches between runs.")
+    parser.add_argument("--workspace", help="Directory to run in (default: a temporary directory).")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary workspace.")
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--baseline", help="Compare against results previously written with --json.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown that counts as a regression (default 10%%).")
+    args = parser.parse_args(argv)
+
+    if sys.platform == "win32":
+        print("The benchmark's stand-in tools need a POSIX system.")
+        return 2
+
+    results = run_benchmark(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    damaged = sorted({blob for run in results["runs"] for blob in run["damaged_blobs"]})
+    if damaged:
+        print("Artifact store blobs no longer match their checksum:\n" + "\n".join(f"  {blob}" for blob in damaged))
+        return 1
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions against the baseline:\n" + "\n".join(f"  {r}" for r in regressions))
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
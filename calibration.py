@@ -0,0 +1,156 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+
+# --- CALIBRATION CORPORA ---
+# imatrix calibration text is ingested once: decoded, normalised (NFC, \n line endings, no trailing
+# whitespace), cut into documents at blank lines, deduplicated, and stored under the hash of the result.
+# Jobs then ask for a sample sized to a token budget, or to a time budget converted to tokens with the
+# imatrix throughput measured on this machine. Samples are deterministic for a given corpus, budget and
+# seed, so the imatrix cache (keyed by the sample's content) keeps hitting across jobs.
+#
+# Token counts are estimated from text length (about four bytes per token for English text); the
+# model's tokenizer is not loaded for this.
+
+BYTES_PER_TOKEN = 4
+# Model parameters times tokens evaluated per thread-second by llama-imatrix on CPU, used until a run
+# on this machine has been measured.
+DEFAULT_PARAM_TOKENS_PER_THREAD_SECOND = 4e10
+DOCUMENT_BREAK = re.compile(r"\n\s*\n")
+
+def estimate_tokens(text_bytes: int) -> int:
+    return text_bytes // BYTES_PER_TOKEN
+
+def normalize_corpus(raw: bytes) -> list[str]:
+    # Returns the unique, non-empty documents of a corpus in their original order.
+    text = unicodedata.normalize("NFC", raw.decode("utf-8", errors="replace"))
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    documents, seen = [], set()
+    for document in DOCUMENT_BREAK.split(text):
+        document = document.strip("\n")
+        # Documents that differ only in spacing are duplicates.
+        key = hashlib.sha256(" ".join(document.split()).encode("utf-8")).digest()
+        if document.strip() and key not in seen:
+            seen.add(key)
+            documents.append(document)
+    return documents
+
+class CalibrationStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    def _read_json(self, path: str, default):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def _write_json(self, path: str, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def _write_text(self, path: str, text: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    # --- Corpora ---
+
+    def ingest(self, path: str, name: str | None = None) -> str:
+        # Adds a corpus file and returns its id. Re-ingesting the same bytes costs one hash of the file.
+        with open(path, "rb") as f:
+            raw = f.read()
+        raw_sha256 = hashlib.sha256(raw).hexdigest()
+        index_path = self._path("index.json")
+        with self._lock:
+            index = self._read_json(index_path, {})
+            corpus_id = index.get(raw_sha256)
+            if corpus_id and os.path.exists(self.corpus_path(corpus_id)):
+                return corpus_id
+            documents = normalize_corpus(raw)
+            text = "\n\n".join(documents) + "\n"
+            corpus_id = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+            if not os.path.exists(self.corpus_path(corpus_id)):
+                self._write_text(self.corpus_path(corpus_id), text)
+                self._write_json(self._path("corpora", f"{corpus_id}.json"), {
+                    "name": name or os.path.basename(path),
+                    "documents": len(documents),
+                    "bytes": len(text.encode("utf-8")),
+                    "tokens": estimate_tokens(len(text.encode("utf-8"))),
+                    "duplicates_removed": len(DOCUMENT_BREAK.split(raw.decode("utf-8", errors="replace"))) - len(documents),
+                    "ingested": time.time(),
+                })
+                print(f"Ingested calibration corpus '{name or os.path.basename(path)}' as {corpus_id[:12]} ({len(documents)} documents).")
+            index[raw_sha256] = corpus_id
+            self._write_json(index_path, index)
+        return corpus_id
+
+    def corpus_path(self, corpus_id: str) -> str:
+        return self._path("corpora", f"{corpus_id}.txt")
+
+    def corpus_info(self, corpus_id: str) -> dict:
+        return self._read_json(self._path("corpora", f"{corpus_id}.json"), {})
+
+    def list_corpora(self) -> dict:
+        corpora_dir = self._path("corpora")
+        if not os.path.isdir(corpora_dir):
+            return {}
+        return {f[:-len(".json")]: self.corpus_info(f[:-len(".json")]) for f in sorted(os.listdir(corpora_dir)) if f.endswith(".json")}
+
+    # --- Sampling ---
+
+    def sample(self, corpus_id: str, token_budget: int, seed: int = 0) -> str:
+        # Returns the path of a sample of about token_budget tokens, or the whole corpus if it is smaller.
+        # Documents are picked in an order fixed by the seed and written in their original order.
+        info = self.corpus_info(corpus_id)
+        if token_budget <= 0 or token_budget >= info.get("tokens", 0):
+            return self.corpus_path(corpus_id)
+        sample_path = self._path("samples", f"{corpus_id}-{token_budget}-{seed}.txt")
+        if os.path.exists(sample_path):
+            return sample_path
+        with open(self.corpus_path(corpus_id), "r", encoding="utf-8") as f:
+            documents = f.read().rstrip("\n").split("\n\n")
+        rank = lambda i: hashlib.sha256(f"{seed}:{documents[i]}".encode("utf-8")).digest()
+        chosen, budget_bytes = [], token_budget * BYTES_PER_TOKEN
+        for i in sorted(range(len(documents)), key=rank):
+            if budget_bytes <= 0:
+                break
+            chosen.append(i)
+            budget_bytes -= len(documents[i].encode("utf-8")) + 2
+        self._write_text(sample_path, "\n\n".join(documents[i] for i in sorted(chosen)) + "\n")
+        return sample_path
+
+    # --- Time budgets ---
+
+    def tokens_for_seconds(self, seconds: float, params: int, threads: int) -> int:
+        # Converts a time budget into tokens for a model of `params` parameters run with `threads` threads.
+        rate = self._read_json(self._path("throughput.json"), {}).get("param_tokens_per_thread_second", DEFAULT_PARAM_TOKENS_PER_THREAD_SECOND)
+        return int(seconds * threads * rate / max(params, 1))
+
+    def record_throughput(self, tokens: int, seconds: float, params: int, threads: int):
+        # Folds a measured imatrix run into the machine's throughput (exponential moving average).
+        if tokens <= 0 or seconds <= 0 or params <= 0 or threads <= 0:
+            return
+        measured = tokens * params / (seconds * threads)
+        path = self._path("throughput.json")
+        with self._lock:
+            state = self._read_json(path, {})
+            previous = state.get("param_tokens_per_thread_second")
+            state["param_tokens_per_thread_second"] = measured if previous is None else 0.7 * previous + 0.3 * measured
+            state["runs"] = state.get("runs", 0) + 1
+            self._write_json(path, state)
@@ -0,0 +1,244 @@
+import os
+import ast
+import sys
+import json
+import time
+import runpy
+import importlib
+import threading
+import traceback
+import subprocess
+from collections import deque
+from process_runner import LOG_TAIL_LINES, MAX_PENDING_BYTES, _LINE_BREAK
+from pipeline_metrics import record_child_usage
+
+# --- WARM CONVERTER POOL ---
+# Every fresh `python convert_hf_to_gguf.py` pays for importing torch, numpy, gguf and friends, often
+# more than ten seconds, which dominates small models and batch runs. The pool keeps a few long-lived
+# worker processes (this file run as a script) that import the converter's dependencies once and then
+# run one conversion after another, each as a fresh `__main__` run of the converter script, so no
+# converter state carries over between jobs; only the imported libraries stay warm.
+#
+# Jobs are sent to a worker as one JSON line on its stdin. The worker's stdout and stderr are one pipe,
+# streamed back like a subprocess's output (same progress lines, same error tail), and every job ends
+# with a SENTINEL line carrying the exit code, CPU time and RSS. A worker is retired after max_jobs
+# conversions or once its RSS passes max_rss; one that dies mid-job fails only that job. A conversion
+# never waits for a worker: when all of them are busy, run() raises ConverterPoolBusy and the caller
+# converts in a fresh process instead.
+#
+# Workers see the environment and working directory of the moment they were started.
+
+SENTINEL = "@@converter-pool@@"
+
+class ConverterPoolUnavailable(Exception):
+    pass
+
+class ConverterPoolBusy(ConverterPoolUnavailable):
+    pass
+
+class _Worker:
+    def __init__(self, script: str):
+        self.script = script
+        self.jobs = 0
+        self.rss = 0
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__), script],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+        self._pending = b""
+        tail = deque(maxlen=50)
+        ready = self.read_until_sentinel(None, None, tail)
+        if ready is None:
+            raise ConverterPoolUnavailable("The converter worker failed to start:\n" + "\n".join(tail))
+
+    def read_until_sentinel(self, progress_parser, on_progress, tail: deque) -> dict | None:
+        # Streams the worker's output into tail and the progress parser until the end-of-job line;
+        # returns that line's payload, or None if the worker exited first.
+        last_progress = None
+
+        def feed(segment: bytes, complete: bool):
+            nonlocal last_progress
+            text = segment.decode("utf-8", errors="replace")
+            if complete and text.strip():
+                tail.append(text)
+            if progress_parser and on_progress:
+                progress = progress_parser(text, complete)
+                if progress and progress != last_progress:
+                    last_progress = progress
+                    on_progress(*progress)
+
+        while True:
+            *segments, self._pending = _LINE_BREAK.split(self._pending)
+            for i, segment in enumerate(segments):
+                if segment.startswith(SENTINEL.encode()):
+                    # Whatever follows the sentinel belongs to the next job.
+                    self._pending = b"\n".join(segments[i + 1:] + [self._pending])
+                    return json.loads(segment[len(SENTINEL):].decode("utf-8"))
+                feed(segment, True)
+            if len(self._pending) > MAX_PENDING_BYTES:
+                feed(self._pending, True)
+                self._pending = b""
+            elif self._pending:
+                feed(self._pending, False)
+            chunk = self.process.stdout.read1(65536)
+            if not chunk:
+                if self._pending:
+                    feed(self._pending, True)
+                    self._pending = b""
+                return None
+            self._pending += chunk
+
+    def run(self, args: list[str], progress_parser=None, on_progress=None, tail_lines: int = LOG_TAIL_LINES) -> tuple[int, str, dict | None]:
+        tail = deque(maxlen=tail_lines)
+        try:
+            self.process.stdin.write((json.dumps({"argv": args}) + "\n").encode("utf-8"))
+            self.process.stdin.flush()
+        except OSError:
+            pass  # the worker is gone; reading below reports how it ended
+        result = self.read_until_sentinel(progress_parser, on_progress, tail)
+        self.jobs += 1
+        if result is None:
+            # The worker ended without finishing the job; even a clean exit (e.g. os._exit(0) in the
+            # converter) means no end-of-job record, so it counts as a failure.
+            returncode = self.process.wait()
+            tail.append(f"The converter worker exited (code {returncode}) before finishing the job.")
+            return returncode or 1, "\n".join(tail), None
+        self.rss = result.get("rss") or 0
+        return result["returncode"], "\n".join(tail), result
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+class ConverterPool:
+    def __init__(self, script: str, size: int = 1, max_jobs: int = 20, max_rss: int = 0):
+        self.script = script
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.idle = []
+        self.busy = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Warms one worker in the background so the first conversion does not pay for the imports.
+        def warm():
+            try:
+                worker = _Worker(self.script)
+            except (OSError, ConverterPoolUnavailable) as e:
+                print(f"Could not warm the converter pool: {e}")
+                return
+            with self._lock:
+                if len(self.idle) + self.busy < self.size:
+                    self.idle.append(worker)
+                    return
+            worker.close()
+        threading.Thread(target=warm, name="converter-pool-warm", daemon=True).start()
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            while self.idle:
+                worker = self.idle.pop()
+                if worker.alive():
+                    self.busy += 1
+                    return worker
+            if self.busy >= self.size:
+                raise ConverterPoolBusy(f"all {self.size} converter worker(s) are busy")
+            self.busy += 1
+        try:
+            return _Worker(self.script)
+        except BaseException:
+            with self._lock:
+                self.busy -= 1
+            raise
+
+    def _release(self, worker: _Worker):
+        retire = not worker.alive() or (self.max_jobs > 0 and worker.jobs >= self.max_jobs) or (self.max_rss > 0 and worker.rss > self.max_rss)
+        with self._lock:
+            self.busy -= 1
+            if not retire:
+                self.idle.append(worker)
+        if retire:
+            print(f"Retiring converter worker after {worker.jobs} job(s) ({worker.rss / 1024**3:.1f} GB RSS).")
+            worker.close()
+            if worker.jobs and self.size > 0:
+                self.start()  # keep a warm replacement ready
+
+    def run(self, args: list[str], progress_parser=None, on_progress=None) -> tuple[int, str]:
+        # Runs the converter with args and returns (returncode, last lines of output), like run_streaming().
+        # Raises ConverterPoolBusy instead of waiting when every worker is in use.
+        worker = self._acquire()
+        try:
+            returncode, output, result = worker.run(args, progress_parser, on_progress)
+        finally:
+            self._release(worker)
+        if result is not None:
+            # Charge the conversion's CPU time and the worker's size to the current pipeline stage.
+            record_child_usage(result.get("cpu_seconds", 0.0), result.get("rss") or 0)
+        return returncode, output
+
+    def close(self):
+        with self._lock:
+            workers, self.idle = self.idle, []
+        for worker in workers:
+            worker.close()
+
+# --- Worker process ---
+
+def _preload(script: str):
+    # Imports every module the converter imports at top level, plus the lazily imported tokenizer
+    # libraries, so each job only pays for running the script.
+    script_dir = os.path.dirname(os.path.abspath(script))
+    sys.path.insert(0, script_dir)
+    gguf_py = os.path.join(script_dir, "gguf-py")
+    if os.path.isdir(gguf_py) and "NO_LOCAL_GGUF" not in os.environ:
+        sys.path.insert(1, gguf_py)
+    with open(script, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), script)
+    names = ["transformers", "sentencepiece", "tokenizers"]
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    for name in dict.fromkeys(names):
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+def serve(script: str) -> int:
+    # Worker main loop: one JSON job per stdin line, output on stdout, SENTINEL line after each job.
+    from system_info import get_process_rss_bytes
+    _preload(script)
+    print(f"{SENTINEL} {json.dumps({'ready': True, 'rss': get_process_rss_bytes()})}", flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        cpu_started = time.process_time()
+        sys.argv = [script, *job["argv"]]
+        try:
+            runpy.run_path(script, run_name="__main__")
+            returncode = 0
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            if e.code is not None and not isinstance(e.code, int):
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+        sys.stderr.flush()
+        print(f"\n{SENTINEL} {json.dumps({'returncode': returncode, 'cpu_seconds': time.process_time() - cpu_started, 'rss': get_process_rss_bytes()})}", flush=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(serve(sys.argv[1]))
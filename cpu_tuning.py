@@ -0,0 +1,148 @@
+import os
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from artifact_store import tool_version
+from system_info import get_available_cpus, get_effective_cpu_count, get_numa_nodes, get_physical_core_ids, get_cpu_model
+
+# --- CPU ALLOCATION & THREAD TUNING ---
+# llama-quantize and llama-imatrix size their thread pools from the host's core count. In a container
+# with a CPU quota, or next to other jobs, they oversubscribe the cores they actually get. The tuner
+# hands every tool run a concrete set of CPUs instead:
+#
+#   * The usable CPUs are the process's affinity mask, cut down to what the cgroup CPU quota pays for.
+#   * Each run gets the least loaded CPUs, taken from a single NUMA node when one has enough, so that
+#     concurrent runs get disjoint sets. On Linux the tool is pinned to its set.
+#   * How many threads to start on a set is tuned per machine, per tool build and per workload (the
+#     quant type for llama-quantize, the model size bucket for llama-imatrix), since their speeds are
+#     not comparable across workloads. The thread count is either one per logical CPU or one per
+#     physical core (it differs only when the set holds SMT siblings). The first runs of a workload
+#     measure each choice MIN_SAMPLES times on real work, normalised per CPU of the set. Later runs use
+#     the best one, but every RESAMPLE_EVERY-th run still measures the other, so a decision made on
+#     unlucky runs is revisited. The results are kept in a JSON file.
+
+PINNING = hasattr(os, "sched_setaffinity")
+MIN_SAMPLES = 2
+RESAMPLE_EVERY = 8
+
+def size_bucket(nbytes: int) -> str:
+    # Workload key for size-bound runs: the size rounded up to a power of two GB ("1GB", "2GB", "4GB", ...).
+    return f"{2 ** max(0, math.ceil(math.log2(max(nbytes, 1) / 1024**3)))}GB"
+
+class CpuSlot:
+    def __init__(self, cpus: list[int] | None, threads: int, policy: str):
+        self.cpus = cpus  # what the tool is pinned to; None where affinity cannot be set
+        self.threads = threads
+        self.policy = policy
+        # Work the run did (e.g. bytes quantized), set by the caller after a successful run so its speed is recorded.
+        self.units = 0
+
+@contextmanager
+def untuned_slot(executable: str, n_threads: int, workload: str = ""):
+    # Stand-in for CpuTuner.slot: n_threads threads, no pinning, nothing recorded.
+    yield CpuSlot(None, max(1, n_threads), "logical")
+
+class CpuTuner:
+    def __init__(self, path: str, enabled: bool = True, cpus: list[int] | None = None, nodes: list[list[int]] | None = None, cores: dict | None = None):
+        self.path = path
+        self.enabled = enabled
+        available = set(cpus or get_available_cpus())
+        nodes = [[c for c in node if c in available] for node in (nodes or get_numa_nodes())]
+        nodes = [node for node in nodes if node] or [sorted(available)]
+        # Under a CPU quota smaller than the affinity mask, runs are confined to as many CPUs as the
+        # quota covers, filled node by node.
+        limit = min(len(available), get_effective_cpu_count())
+        self.nodes, taken = [], 0
+        for node in nodes:
+            node = node[:limit - taken]
+            if node:
+                self.nodes.append(node)
+                taken += len(node)
+        self.cpus = [cpu for node in self.nodes for cpu in node]
+        self.cores = cores or get_physical_core_ids()
+        self.machine = f"{get_cpu_model()} / {len(self.cpus)} CPUs / {len(self.nodes)} NUMA node(s)"
+        self._load = {cpu: 0 for cpu in self.cpus}
+        self._lock = threading.Lock()
+        self._results = self._read()
+
+    # --- Persistence ---
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._results, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    # --- Allocation ---
+
+    def _allocate(self, n: int) -> list[int]:
+        # The n least loaded CPUs of the least loaded node that has n of them, or of all nodes if none has.
+        def cheapest(cpus):
+            return sorted(cpus, key=lambda c: (self._load[c], c))[:n]
+        candidates = [cheapest(node) for node in self.nodes if len(node) >= n] or [cheapest(self.cpus)]
+        return min(candidates, key=lambda cpus: sum(self._load[c] for c in cpus))
+
+    def _choose(self, tool: str, cpus: list[int]) -> tuple[str, int]:
+        # Thread policy for a run on cpus: the least measured choice until each has MIN_SAMPLES runs, then
+        # the fastest, except for every RESAMPLE_EVERY-th run, which measures the slower one again.
+        options = {"logical": len(cpus), "physical": len({self.cores.get(c, c) for c in cpus})}
+        if options["physical"] == options["logical"]:
+            return "logical", options["logical"]
+        with self._lock:
+            measured = self._results.get(self.machine, {}).get(tool, {})
+            runs = {p: measured.get(p, {}).get("runs", 0) for p in options}
+            if min(runs.values()) < MIN_SAMPLES:
+                policy = min(options, key=lambda p: runs[p])
+            else:
+                ranked = sorted(options, key=lambda p: measured[p]["rate"], reverse=True)
+                policy = ranked[-1] if sum(runs.values()) % RESAMPLE_EVERY == 0 else ranked[0]
+        return policy, options[policy]
+
+    def _record(self, tool: str, policy: str, n_cpus: int, units: float, seconds: float):
+        if seconds <= 0:
+            return
+        rate = units / seconds / n_cpus
+        with self._lock:
+            entry = self._results.setdefault(self.machine, {}).setdefault(tool, {}).setdefault(policy, {"rate": rate, "runs": 0})
+            # A moving average, so one unusual model does not decide for good.
+            entry["rate"] = rate if not entry["runs"] else 0.7 * entry["rate"] + 0.3 * rate
+            entry["runs"] += 1
+            try:
+                self._write()
+            except OSError as e:
+                print(f"Could not save CPU tuning results: {e}")
+
+    @contextmanager
+    def slot(self, executable: str, n_threads: int, workload: str = ""):
+        # Reserves about n_threads CPUs for one run of executable on workload and yields its CpuSlot. The
+        # run's speed is recorded if the caller sets slot.units; only runs of the same workload are compared.
+        if not self.enabled:
+            yield CpuSlot(None, max(1, n_threads), "logical")
+            return
+        tool = f"{os.path.basename(executable)}:{tool_version(executable)[:12]}:{workload}"
+        n = max(1, min(n_threads, len(self.cpus)))
+        with self._lock:
+            cpus = self._allocate(n)
+            for cpu in cpus:
+                self._load[cpu] += 1
+        try:
+            policy, threads = self._choose(tool, cpus)
+            slot = CpuSlot(cpus if PINNING else None, threads, policy)
+            started = time.monotonic()
+            yield slot
+            if slot.units:
+                self._record(tool, policy, len(cpus), slot.units, time.monotonic() - started)
+        finally:
+            with self._lock:
+                for cpu in cpus:
+                    self._load[cpu] -= 1
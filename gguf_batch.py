@@ -0,0 +1,208 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- HEADLESS BATCH RUNNER ---
+# Runs a manifest of jobs through the same pipeline as the web app (gguf_pipeline.py), without
+# importing Gradio, so it can be scheduled from cron:
+#
+#   python gguf_batch.py nightly.json --jobs 2 --report nightly-report.json
+#
+# The manifest is a JSON list of jobs, or {"defaults": {...}, "jobs": [...]}, or JSON Lines (one job
+# per line). Each job is an object:
+#
+#   {"model": "org/name", "quants": ["Q4_K_M", "Q8_0"], "imatrix": false, "train_data": "calib.txt",
+#    "calibration_tokens": 50000, "calibration_seconds": 600,
+#    "split": false, "split_max_tensors": 256, "split_max_size": "5G", "private": false, "evaluate": false}
+#
+# Only "model" is required. Jobs still go through the resource scheduler, so --jobs is an upper bound
+# on concurrency, not a promise. Jobs beyond the per-user cap (SCHEDULER_MAX_PER_USER) wait for a slot
+# instead of failing.
+#
+# Jobs cut off by a crash continue from their last completed stage with --resume JOB_ID (the id is
+# printed when the job starts) or, for every interrupted job, --resume-interrupted; no manifest needed.
+#
+# Outputs kept with --no-upload are subject to the outputs reaper (OUTPUTS_TTL_HOURS, OUTPUTS_QUOTA_GB)
+# like any other abandoned job, so copy them elsewhere if they must outlive it.
+
+JOB_DEFAULTS = {
+    "quants": ["Q4_K_M"],
+    "imatrix": False,
+    "train_data": None,
+    "calibration_tokens": None,
+    "calibration_seconds": None,
+    "split": False,
+    "split_max_tensors": 256,
+    "split_max_size": None,
+    "private": False,
+    "evaluate": False,
+}
+
+def load_manifest(path: str) -> list[dict]:
+    # Reads the manifest and fills in defaults, rejecting unknown keys so typos do not go unnoticed.
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".jsonl"):
+        data = [json.loads(line) for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    else:
+        data = json.loads(text)
+    defaults = dict(JOB_DEFAULTS)
+    if isinstance(data, dict):
+        defaults.update(data.get("defaults", {}))
+        data = data.get("jobs", [])
+    jobs = []
+    for i, entry in enumerate(data):
+        if isinstance(entry, str):
+            entry = {"model": entry}
+        unknown = set(entry) - set(JOB_DEFAULTS) - {"model"}
+        if unknown or not entry.get("model"):
+            raise ValueError(f"Manifest entry {i + 1} is invalid: " + (f"unknown keys {sorted(unknown)}" if unknown else "missing 'model'"))
+        job = {**defaults, **entry}
+        if isinstance(job["quants"], str):
+            job["quants"] = [q.strip() for q in job["quants"].split(",") if q.strip()]
+        jobs.append(job)
+    return jobs
+
+def progress_printer(label: str):
+    # Prints a line whenever a job moves to a new step; per-tensor and per-chunk counters are dropped.
+    last = None
+    lock = threading.Lock()
+    def report(fraction, desc):
+        nonlocal last
+        step = re.sub(r"\s*\([^)]*\)$", "", desc or "")
+        with lock:
+            if step and step != last:
+                last = step
+                print(f"[{label}] {step}", flush=True)
+    return report
+
+def run_entry(pipeline, job: dict, token: str, upload: bool) -> dict:
+    # Runs one manifest entry and returns its result record; failures are recorded, not raised.
+    label = job["model"]
+    report = progress_printer(label)
+    record = {"model": job["model"], "quants": job["quants"], "started": time.time()}
+    try:
+        result = pipeline.run_job(
+            job["model"], job["quants"], job["imatrix"], token,
+            private_repo=job["private"],
+            train_data_path=job["train_data"],
+            calibration_tokens=job["calibration_tokens"],
+            calibration_seconds=job["calibration_seconds"],
+            split_model=job["split"],
+            split_max_tensors=job["split_max_tensors"],
+            split_max_size=job["split_max_size"],
+            evaluate=job["evaluate"],
+            on_progress=report,
+        )
+        record["job_id"], record["outdir"] = result["job_id"], result["outdir"]
+        if upload:
+            record["repo_id"], record["repo_url"] = pipeline.upload_job(result["outdir"], token, report)
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+        print(f"[{label}] FAILED: {e}", flush=True)
+    record["seconds"] = round(time.time() - record["started"], 1)
+    return record
+
+def resume_entry(pipeline, job_id: str, token: str, upload: bool) -> dict:
+    # Continues one interrupted job and returns its result record, like run_entry().
+    report = progress_printer(job_id)
+    record = {"job_id": job_id, "started": time.time()}
+    try:
+        state = pipeline.load_job(job_id, token)
+        record["model"], record["quants"] = state.params["model_id"], state.params["quant_methods"]
+        result = pipeline.resume_job(job_id, token, report, upload=upload)
+        record["outdir"], record["repo_id"], record["repo_url"] = result["outdir"], result["repo_id"], result["repo_url"]
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+        print(f"[{job_id}] FAILED: {e}", flush=True)
+    record["seconds"] = round(time.time() - record["started"], 1)
+    return record
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Quantize and upload a manifest of models without the web UI.")
+    parser.add_argument("manifest", nargs="?", help="JSON or JSON Lines file listing the jobs.")
+    parser.add_argument("--token", help="Hugging Face token (default: HF_TOKEN or the cached login).")
+    parser.add_argument("--jobs", type=int, default=1, help="Maximum number of jobs to run at once.")
+    parser.add_argument("--no-upload", action="store_true", help="Stop after quantizing and keep the outputs locally.")
+    parser.add_argument("--dry-run", action="store_true", help="Print each job's resource estimate and exit.")
+    parser.add_argument("--fail-fast", action="store_true", help="Do not start further jobs after a failure.")
+    parser.add_argument("--report", help="Write a JSON summary of every job to this file.")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port while running.")
+    parser.add_argument("--resume", nargs="+", metavar="JOB_ID", help="Continue these jobs from their last completed stage instead of running a manifest.")
+    parser.add_argument("--resume-interrupted", action="store_true", help="Continue every job that was cut off mid-run.")
+    args = parser.parse_args(argv)
+    if not args.manifest and not args.resume and not args.resume_interrupted:
+        parser.error("a manifest, --resume or --resume-interrupted is required")
+
+    jobs = load_manifest(args.manifest) if args.manifest else []
+    import gguf_pipeline as pipeline
+    from huggingface_hub import get_token
+    token = args.token or pipeline.HF_TOKEN or get_token()
+    if not token:
+        print("No Hugging Face token: pass --token, set HF_TOKEN or run `huggingface-cli login`.", file=sys.stderr)
+        return 2
+    username = pipeline.HUB_CACHE.identity(token)["name"]
+    resume_ids = list(args.resume or [])
+    if args.resume_interrupted:
+        from job_state import interrupted_jobs
+        resume_ids += [s.job_id for s in interrupted_jobs() if s.record.get("owner") == username and s.job_id not in resume_ids]
+    if args.manifest:
+        print(f"{len(jobs)} job(s) from {args.manifest}, running as {username}.")
+    if resume_ids:
+        print(f"Resuming {len(resume_ids)} job(s): {', '.join(resume_ids)}.")
+
+    if args.dry_run:
+        for job in jobs:
+            print(f"\n## {job['model']} ({', '.join(job['quants'])})")
+            try:
+                print(pipeline.estimate_summary(job["model"], pipeline.normalize_quant_methods(job["quants"]), job["imatrix"], job["split"], token, job["evaluate"]))
+            except Exception as e:
+                print(f"Could not estimate resources: {e}")
+        return 0
+
+    # Every job here runs as the same user, so extra jobs queue up behind the per-user cap.
+    pipeline.SCHEDULER.wait_for_user_slot = True
+    pipeline.REAPER.reap()
+    pipeline.resolve_tools()
+    if pipeline.CONVERTER_POOL:
+        pipeline.CONVERTER_POOL.start()
+    if args.metrics_port:
+        from pipeline_metrics import serve_metrics
+        serve_metrics(pipeline.METRICS_HOST, args.metrics_port)
+
+    stop = threading.Event()
+    def run(job):
+        if stop.is_set():
+            return {"model": job.get("model"), "quants": job.get("quants"), "status": "skipped"}
+        if "resume" in job:
+            record = resume_entry(pipeline, job["resume"], token, not args.no_upload)
+        else:
+            record = run_entry(pipeline, job, token, not args.no_upload)
+        if record["status"] == "error" and args.fail_fast:
+            stop.set()
+        return record
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = list(pool.map(run, [{"resume": job_id} for job_id in resume_ids] + jobs))
+
+    counts = {status: sum(r["status"] == status for r in results) for status in ("ok", "error", "skipped")}
+    print(f"\nFinished: {counts['ok']} ok, {counts['error']} failed, {counts['skipped']} skipped.")
+    for r in results:
+        if r["status"] == "error":
+            print(f"  {r.get('model') or r['job_id']}: {r['error'].splitlines()[0] if r['error'] else 'error'}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    return 0 if counts["error"] == 0 and counts["skipped"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,31 @@
 import os
 import subprocess
-import signal
 os.environ["GRADIO_ANALYTICS_ENABLED"] = "False"
 import gradio as gr
 import tempfile
 
-from huggingface_hub import HfApi, ModelCard, whoami
+from huggingface_hub import HfApi, ModelCard
 from gradio_huggingfacehub_search import HuggingfaceHubSearch
 from pathlib import Path
 from textwrap import dedent
 from apscheduler.schedulers.background import BackgroundScheduler
+from job_scheduler import ResourceScheduler, estimate_job_needs, machine_capacity
+from hub_cache import HubMetadataCache
+from imatrix_parallel import compute_imatrix
+from restart_policy import RestartPolicy
 
 
 # used for restarting the space
 HF_TOKEN = os.environ.get("HF_TOKEN")
 CONVERSION_SCRIPT = "./llama.cpp/convert_hf_to_gguf.py"
+SCHEDULER = ResourceScheduler(
+    machine_capacity(),
+    max_backlog=int(os.environ.get("SCHEDULER_MAX_BACKLOG", "50")),
+    max_per_user=int(os.environ.get("SCHEDULER_MAX_PER_USER", "5")),
+    cpus_per_job=int(os.environ.get("SCHEDULER_CPUS_PER_JOB", "0")) or None,
+)
+HUB_CACHE = HubMetadataCache(os.environ.get("HUB_CACHE_DIR", "./hub_cache"))
+IMATRIX_MAX_WORKERS = int(os.environ.get("IMATRIX_MAX_WORKERS", "1"))
 
 # escape HTML for logging
 def escape(s: str) -> str:
@@ -26,32 +37,17 @@ def escape(s: str) -> str:
     return s
 
 def generate_importance_matrix(model_path: str, train_data_path: str, output_path: str):
-    imatrix_command = [
-        "./llama.cpp/llama-imatrix",
-        "-m", model_path,
-        "-f", train_data_path,
-        "-ngl", "99",
-        "--output-frequency", "10",
-        "-o", output_path,
-    ]
-
     if not os.path.isfile(model_path):
         raise Exception(f"Model file not found: {model_path}")
 
+    # Runs to completion over the whole calibration file. Every worker offloads its own copy of the
+    # model to the GPU, so the calibration data is only split across workers when IMATRIX_MAX_WORKERS > 1.
     print("Running imatrix command...")
-    process = subprocess.Popen(imatrix_command, shell=False)
-
-    try:
-        process.wait(timeout=60)  # added wait
-    except subprocess.TimeoutExpired:
-        print("Imatrix computation timed out. Sending SIGINT to allow graceful termination...")
-        process.send_signal(signal.SIGINT)
-        try:
-            process.wait(timeout=5)  # grace period
-        except subprocess.TimeoutExpired:
-            print("Imatrix proc still didn't term. Forecfully terming process...")
-            process.kill()
-
+    compute_imatrix(
+        "./llama.cpp/llama-imatrix", model_path, train_data_path, str(output_path),
+        ["-ngl", "99", "--output-frequency", "10"],
+        max_workers=IMATRIX_MAX_WORKERS,
+    )
     print("Importance matrix generation completed.")
 
 def split_upload_model(model_path: str, outdir: str, repo_id: str, oauth_token: gr.OAuthToken | None, split_max_tensors=256, split_max_size=None):
@@ -120,7 +116,7 @@ def process_model(model_id, q_method, use_imatrix, imatrix_q_method, private_rep
 
     # validate the oauth token
     try:
-        whoami(oauth_token.token)
+        username = HUB_CACHE.identity(oauth_token.token)["name"]
     except Exception as e:
         raise gr.Error("You must be logged in to use GGUF-my-repo")
 
@@ -131,15 +127,11 @@ def process_model(model_id, q_method, use_imatrix, imatrix_q_method, private_rep
 
         dl_pattern = ["*.md", "*.json", "*.model"]
 
+        revision = HUB_CACHE.revision(model_id, api)
+        repo_tree = HUB_CACHE.repo_tree(model_id, api, revision)
         pattern = (
             "*.safetensors"
-            if any(
-                file.path.endswith(".safetensors")
-                for file in api.list_repo_tree(
-                    repo_id=model_id,
-                    recursive=True,
-                )
-            )
+            if any(file.path.endswith(".safetensors") for file in repo_tree)
             else "*.bin"
         )
 
@@ -151,165 +143,165 @@ def process_model(model_id, q_method, use_imatrix, imatrix_q_method, private_rep
         if not os.path.exists("outputs"):
             os.makedirs("outputs")
 
-        with tempfile.TemporaryDirectory(dir="outputs") as outdir:
-            fp16 = str(Path(outdir)/f"{model_name}.fp16.gguf")
-
-            with tempfile.TemporaryDirectory(dir="downloads") as tmpdir:
-                # Keep the model name as the dirname so the model name metadata is populated correctly
-                local_dir = Path(tmpdir)/model_name
-                print(local_dir)
-                api.snapshot_download(repo_id=model_id, local_dir=local_dir, local_dir_use_symlinks=False, allow_patterns=dl_pattern)
-                print("Model downloaded successfully!")
-                print(f"Current working directory: {os.getcwd()}")
-                print(f"Model directory contents: {os.listdir(local_dir)}")
-
-                config_dir = local_dir/"config.json"
-                adapter_config_dir = local_dir/"adapter_config.json"
-                if os.path.exists(adapter_config_dir) and not os.path.exists(config_dir):
-                    raise Exception('adapter_config.json is present.<br/><br/>If you are converting a LoRA adapter to GGUF, please use <a href="https://huggingface.co/spaces/ggml-org/gguf-my-lora" target="_blank" style="text-decoration:underline">GGUF-my-lora</a>.')
-
-                result = subprocess.run([
-                    "python", CONVERSION_SCRIPT, local_dir, "--outtype", "f16", "--outfile", fp16
-                ], shell=False, capture_output=True)
-                print(result)
+        with SCHEDULER.admit(username, estimate_job_needs(repo_tree, 1, use_imatrix), label=model_id):
+            with tempfile.TemporaryDirectory(dir="outputs") as outdir:
+                fp16 = str(Path(outdir)/f"{model_name}.fp16.gguf")
+
+                with tempfile.TemporaryDirectory(dir="downloads") as tmpdir:
+                    # Keep the model name as the dirname so the model name metadata is populated correctly
+                    local_dir = Path(tmpdir)/model_name
+                    print(local_dir)
+                    api.snapshot_download(repo_id=model_id, revision=revision, local_dir=local_dir, local_dir_use_symlinks=False, allow_patterns=dl_pattern)
+                    print("Model downloaded successfully!")
+                    print(f"Current working directory: {os.getcwd()}")
+                    print(f"Model directory contents: {os.listdir(local_dir)}")
+
+                    config_dir = local_dir/"config.json"
+                    adapter_config_dir = local_dir/"adapter_config.json"
+                    if os.path.exists(adapter_config_dir) and not os.path.exists(config_dir):
+                        raise Exception('adapter_config.json is present.<br/><br/>If you are converting a LoRA adapter to GGUF, please use <a href="https://huggingface.co/spaces/ggml-org/gguf-my-lora" target="_blank" style="text-decoration:underline">GGUF-my-lora</a>.')
+
+                    result = subprocess.run([
+                        "python", CONVERSION_SCRIPT, local_dir, "--outtype", "f16", "--outfile", fp16
+                    ], shell=False, capture_output=True)
+                    print(result)
+                    if result.returncode != 0:
+                        stderr_str = result.stderr.decode("utf-8")
+                        raise Exception(f"Error converting to fp16: {stderr_str}")
+                    print("Model converted to fp16 successfully!")
+                    print(f"Converted model path: {fp16}")
+
+                imatrix_path = Path(outdir)/"imatrix.dat"
+
+                if use_imatrix:
+                    if train_data_file:
+                        train_data_path = train_data_file.name
+                    else:
+                        train_data_path = "llama.cpp/groups_merged.txt" #fallback calibration dataset
+
+                    print(f"Training data file path: {train_data_path}")
+
+                    if not os.path.isfile(train_data_path):
+                        raise Exception(f"Training data file not found: {train_data_path}")
+
+                    generate_importance_matrix(fp16, train_data_path, imatrix_path)
+                else:
+                    print("Not using imatrix quantization.")
+            
+                # Quantize the model
+                quantized_gguf_name = f"{model_name.lower()}-{imatrix_q_method.lower()}-imat.gguf" if use_imatrix else f"{model_name.lower()}-{q_method.lower()}.gguf"
+                quantized_gguf_path = str(Path(outdir)/quantized_gguf_name)
+                if use_imatrix:
+                    quantise_ggml = [
+                        "./llama.cpp/llama-quantize",
+                        "--imatrix", imatrix_path, fp16, quantized_gguf_path, imatrix_q_method
+                    ]
+                else:
+                    quantise_ggml = [
+                        "./llama.cpp/llama-quantize",
+                        fp16, quantized_gguf_path, q_method
+                    ]
+                result = subprocess.run(quantise_ggml, shell=False, capture_output=True)
                 if result.returncode != 0:
                     stderr_str = result.stderr.decode("utf-8")
-                    raise Exception(f"Error converting to fp16: {stderr_str}")
-                print("Model converted to fp16 successfully!")
-                print(f"Converted model path: {fp16}")
-
-            imatrix_path = Path(outdir)/"imatrix.dat"
-
-            if use_imatrix:
-                if train_data_file:
-                    train_data_path = train_data_file.name
-                else:
-                    train_data_path = "llama.cpp/groups_merged.txt" #fallback calibration dataset
-
-                print(f"Training data file path: {train_data_path}")
+                    raise Exception(f"Error quantizing: {stderr_str}")
+                print(f"Quantized successfully with {imatrix_q_method if use_imatrix else q_method} option!")
+                print(f"Quantized model path: {quantized_gguf_path}")
 
-                if not os.path.isfile(train_data_path):
-                    raise Exception(f"Training data file not found: {train_data_path}")
+                # Create empty repo
+                new_repo_url = api.create_repo(repo_id=f"{username}/{model_name}-{imatrix_q_method if use_imatrix else q_method}-GGUF", exist_ok=True, private=private_repo)
+                new_repo_id = new_repo_url.repo_id
+                print("Repo created successfully!", new_repo_url)
 
-                generate_importance_matrix(fp16, train_data_path, imatrix_path)
-            else:
-                print("Not using imatrix quantization.")
-            
-            # Quantize the model
-            quantized_gguf_name = f"{model_name.lower()}-{imatrix_q_method.lower()}-imat.gguf" if use_imatrix else f"{model_name.lower()}-{q_method.lower()}.gguf"
-            quantized_gguf_path = str(Path(outdir)/quantized_gguf_name)
-            if use_imatrix:
-                quantise_ggml = [
-                    "./llama.cpp/llama-quantize",
-                    "--imatrix", imatrix_path, fp16, quantized_gguf_path, imatrix_q_method
-                ]
-            else:
-                quantise_ggml = [
-                    "./llama.cpp/llama-quantize",
-                    fp16, quantized_gguf_path, q_method
-                ]
-            result = subprocess.run(quantise_ggml, shell=False, capture_output=True)
-            if result.returncode != 0:
-                stderr_str = result.stderr.decode("utf-8")
-                raise Exception(f"Error quantizing: {stderr_str}")
-            print(f"Quantized successfully with {imatrix_q_method if use_imatrix else q_method} option!")
-            print(f"Quantized model path: {quantized_gguf_path}")
-
-            # Create empty repo
-            username = whoami(oauth_token.token)["name"]
-            new_repo_url = api.create_repo(repo_id=f"{username}/{model_name}-{imatrix_q_method if use_imatrix else q_method}-GGUF", exist_ok=True, private=private_repo)
-            new_repo_id = new_repo_url.repo_id
-            print("Repo created successfully!", new_repo_url)
-
-            try:
-                card = ModelCard.load(model_id, token=oauth_token.token)
-            except:
-                card = ModelCard("")
-            if card.data.tags is None:
-                card.data.tags = []
-            card.data.tags.append("llama-cpp")
-            card.data.tags.append("gguf-my-repo")
-            card.data.base_model = model_id
-            card.text = dedent(
-                f"""
-                # {new_repo_id}
-                This model was converted to GGUF format from [`{model_id}`](https://huggingface.co/{model_id}) using llama.cpp via the ggml.ai's [GGUF-my-repo](https://huggingface.co/spaces/ggml-org/gguf-my-repo) space.
-                Refer to the [original model card](https://huggingface.co/{model_id}) for more details on the model.
+                try:
+                    card = ModelCard(HUB_CACHE.model_card_text(model_id, oauth_token.token, revision))
+                except:
+                    card = ModelCard("")
+                if card.data.tags is None:
+                    card.data.tags = []
+                card.data.tags.append("llama-cpp")
+                card.data.tags.append("gguf-my-repo")
+                card.data.base_model = model_id
+                card.text = dedent(
+                    f"""
+                    # {new_repo_id}
+                    This model was converted to GGUF format from [`{model_id}`](https://huggingface.co/{model_id}) using llama.cpp via the ggml.ai's [GGUF-my-repo](https://huggingface.co/spaces/ggml-org/gguf-my-repo) space.
+                    Refer to the [original model card](https://huggingface.co/{model_id}) for more details on the model.
                 
-                ## Use with llama.cpp
-                Install llama.cpp through brew (works on Mac and Linux)
+                    ## Use with llama.cpp
+                    Install llama.cpp through brew (works on Mac and Linux)
                 
-                ```bash
-                brew install llama.cpp
+                    ```bash
+                    brew install llama.cpp
                 
-                ```
-                Invoke the llama.cpp server or the CLI.
+                    ```
+                    Invoke the llama.cpp server or the CLI.
                 
-                ### CLI:
-                ```bash
-                llama-cli --hf-repo {new_repo_id} --hf-file {quantized_gguf_name} -p "The meaning to life and the universe is"
-                ```
+                    ### CLI:
+                    ```bash
+                    llama-cli --hf-repo {new_repo_id} --hf-file {quantized_gguf_name} -p "The meaning to life and the universe is"
+                    ```
                 
-                ### Server:
-                ```bash
-                llama-server --hf-repo {new_repo_id} --hf-file {quantized_gguf_name} -c 2048
-                ```
+                    ### Server:
+                    ```bash
+                    llama-server --hf-repo {new_repo_id} --hf-file {quantized_gguf_name} -c 2048
+                    ```
                 
-                Note: You can also use this checkpoint directly through the [usage steps](https://github.com/ggerganov/llama.cpp?tab=readme-ov-file#usage) listed in the Llama.cpp repo as well.
-
-                Step 1: Clone llama.cpp from GitHub.
-                ```
-                git clone https://github.com/ggerganov/llama.cpp
-                ```
-
-                Step 2: Move into the llama.cpp folder and build it with `LLAMA_CURL=1` flag along with other hardware-specific flags (for ex: LLAMA_CUDA=1 for Nvidia GPUs on Linux).
-                ```
-                cd llama.cpp && LLAMA_CURL=1 make
-                ```
-
-                Step 3: Run inference through the main binary.
-                ```
-                ./llama-cli --hf-repo {new_repo_id} --hf-file {quantized_gguf_name} -p "The meaning to life and the universe is"
-                ```
-                or 
-                ```
-                ./llama-server --hf-repo {new_repo_id} --hf-file {quantized_gguf_name} -c 2048
-                ```
-                """
-            )
-            readme_path = Path(outdir)/"README.md"
-            card.save(readme_path)
-
-            if split_model:
-                split_upload_model(str(quantized_gguf_path), outdir, new_repo_id, oauth_token, split_max_tensors, split_max_size)
-            else:
-                try:
-                    print(f"Uploading quantized model: {quantized_gguf_path}")
-                    api.upload_file(
-                        path_or_fileobj=quantized_gguf_path,
-                        path_in_repo=quantized_gguf_name,
-                        repo_id=new_repo_id,
-                    )
-                except Exception as e:
-                    raise Exception(f"Error uploading quantized model: {e}")
+                    Note: You can also use this checkpoint directly through the [usage steps](https://github.com/ggerganov/llama.cpp?tab=readme-ov-file#usage) listed in the Llama.cpp repo as well.
+
+                    Step 1: Clone llama.cpp from GitHub.
+                    ```
+                    git clone https://github.com/ggerganov/llama.cpp
+                    ```
+
+                    Step 2: Move into the llama.cpp folder and build it with `LLAMA_CURL=1` flag along with other hardware-specific flags (for ex: LLAMA_CUDA=1 for Nvidia GPUs on Linux).
+                    ```
+                    cd llama.cpp && LLAMA_CURL=1 make
+                    ```
+
+                    Step 3: Run inference through the main binary.
+                    ```
+                    ./llama-cli --hf-repo {new_repo_id} --hf-file {quantized_gguf_name} -p "The meaning to life and the universe is"
+                    ```
+                    or 
+                    ```
+                    ./llama-server --hf-repo {new_repo_id} --hf-file {quantized_gguf_name} -c 2048
+                    ```
+                    """
+                )
+                readme_path = Path(outdir)/"README.md"
+                card.save(readme_path)
+
+                if split_model:
+                    split_upload_model(str(quantized_gguf_path), outdir, new_repo_id, oauth_token, split_max_tensors, split_max_size)
+                else:
+                    try:
+                        print(f"Uploading quantized model: {quantized_gguf_path}")
+                        api.upload_file(
+                            path_or_fileobj=quantized_gguf_path,
+                            path_in_repo=quantized_gguf_name,
+                            repo_id=new_repo_id,
+                        )
+                    except Exception as e:
+                        raise Exception(f"Error uploading quantized model: {e}")
             
-            if os.path.isfile(imatrix_path):
-                try:
-                    print(f"Uploading imatrix.dat: {imatrix_path}")
-                    api.upload_file(
-                        path_or_fileobj=imatrix_path,
-                        path_in_repo="imatrix.dat",
-                        repo_id=new_repo_id,
-                    )
-                except Exception as e:
-                    raise Exception(f"Error uploading imatrix.dat: {e}")
-
-            api.upload_file(
-                path_or_fileobj=readme_path,
-                path_in_repo="README.md",
-                repo_id=new_repo_id,
-            )
-            print(f"Uploaded successfully with {imatrix_q_method if use_imatrix else q_method} option!")
+                if os.path.isfile(imatrix_path):
+                    try:
+                        print(f"Uploading imatrix.dat: {imatrix_path}")
+                        api.upload_file(
+                            path_or_fileobj=imatrix_path,
+                            path_in_repo="imatrix.dat",
+                            repo_id=new_repo_id,
+                        )
+                    except Exception as e:
+                        raise Exception(f"Error uploading imatrix.dat: {e}")
+
+                api.upload_file(
+                    path_or_fileobj=readme_path,
+                    path_in_repo="README.md",
+                    repo_id=new_repo_id,
+                )
+                print(f"Uploaded successfully with {imatrix_q_method if use_imatrix else q_method} option!")
 
         # end of the TemporaryDirectory(dir="outputs") block; temporary outputs are deleted here
 
@@ -433,11 +425,20 @@ with gr.Blocks(css=css) as demo:
     )
 
 def restart_space():
-    HfApi().restart_space(repo_id="ggml-org/gguf-my-repo", token=HF_TOKEN, factory_reboot=True)
-
+    HfApi().restart_space(repo_id="ggml-org/gguf-my-repo", token=HF_TOKEN, factory_reboot=False)
+    return True  # the Hub restarts the Space shortly; until then the app stays drained
+
+# Restart once memory or leaked temp space has grown, or after 6 hours at an idle moment, never mid-job.
+restart_policy = RestartPolicy(
+    restart_space, SCHEDULER, lambda: SCHEDULER.status()["running"] + SCHEDULER.status()["waiting"],
+    max_rss_growth=int(float(os.environ.get("RESTART_MAX_RSS_GROWTH_GB", "4")) * 1024**3),
+    max_leaked_temp=int(float(os.environ.get("RESTART_MAX_LEAKED_TEMP_GB", "10")) * 1024**3),
+    temp_dirs=[tempfile.gettempdir()],
+    max_uptime=21600,
+)
 scheduler = BackgroundScheduler()
-scheduler.add_job(restart_space, "interval", seconds=21600)
+scheduler.add_job(restart_policy.check, "interval", seconds=60)
 scheduler.start()
 
 # Launch the interface
-demo.queue(default_concurrency_limit=1, max_size=5).launch(debug=True, show_api=False)
\ No newline at end of file
+demo.queue(default_concurrency_limit=SCHEDULER.max_backlog, max_size=SCHEDULER.max_backlog).launch(debug=True, show_api=False)
\ No newline at end of file
@@ -0,0 +1,818 @@
+import os
+import re
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from huggingface_hub import HfApi, ModelCard
+from pathlib import Path
+from contextlib import nullcontext
+from artifact_store import ArtifactStore, file_sha256, make_key, source_fingerprint, tool_version
+from model_cache import ModelCache
+from storage import storage_stats, format_savings
+from system_info import get_effective_cpu_count, get_usable_memory_bytes
+from job_scheduler import ResourceScheduler, SchedulerDraining, estimate_job_needs, machine_capacity, format_needs
+from resource_estimator import AUTO_SPLIT_SIZE, estimate_job, inspect_model, is_direct, job_needs, local_dtypes, plan_outtype, preflight_problems, format_estimate
+from hub_cache import HubMetadataCache
+from hub_upload import BatchUploader, UPLOAD_STATE_NAME
+from process_runner import run_streaming, convert_progress, quantize_progress, split_progress
+from gguf_split import split_gguf
+from imatrix_parallel import compute_imatrix
+from calibration import CalibrationStore, estimate_tokens
+from quant_eval import evaluate_quants, format_eval_table
+from job_state import JobState, JobBusy, describe, interrupted_jobs, job_lock, list_jobs
+from pipeline_metrics import REGISTRY, JobMetrics
+from restart_policy import RestartPolicy
+from outputs_reaper import OutputsReaper
+from converter_pool import ConverterPool, ConverterPoolUnavailable, ConverterPoolBusy
+from cpu_tuning import CpuTuner
+from tool_variants import ToolResolver, cpu_only_executable
+
+# The download -> convert -> imatrix -> quantize -> split -> upload pipeline, shared by the Gradio app
+# (gguf_repo_suite.py) and the headless batch runner (gguf_batch.py). Nothing here imports Gradio.
+
+# --- CONFIGURATION & CONSTANTS ---
+HF_TOKEN = os.environ.get("HF_TOKEN")
+CONVERSION_SCRIPT = "./llama.cpp/convert_hf_to_gguf.py"
+# llama.cpp tools are looked up in ./llama.cpp and then next to this script. Where a tool has several builds
+# (<tool>_avx512, <tool>_avx2, <tool>_avx, ...), the fastest one this CPU runs is used; LLAMA_CPU_VARIANT
+# forces one ("plain" = the unsuffixed build). Builds next to a ggml-rpc.dll run from a private copy of their
+# directory without it, which keeps them on the CPU backend without touching the shared install.
+LLAMA_CPU_VARIANT = os.environ.get("LLAMA_CPU_VARIANT")
+TOOLS = ToolResolver(
+    [os.path.join(".", "llama.cpp"), "."],
+    variant="" if LLAMA_CPU_VARIANT == "plain" else LLAMA_CPU_VARIANT or None,
+    prepare=cpu_only_executable,
+)
+# The converter's output type: "auto" writes a lone Q8_0 target directly and otherwise converts bf16 sources
+# to a bf16 intermediate and everything else to f16; "f16" or "bf16" always converts to that intermediate.
+CONVERT_OUTTYPE = os.environ.get("CONVERT_OUTTYPE", "auto")
+# Conversions run in up to CONVERTER_POOL_SIZE warm worker processes that import the converter's dependencies
+# once (0 = a fresh python process per conversion). Conversions that find every worker busy run in a fresh
+# process rather than wait. A worker is replaced after CONVERTER_POOL_MAX_JOBS conversions or once it grows
+# past CONVERTER_POOL_MAX_RSS_GB.
+CONVERTER_POOL_SIZE = int(os.environ.get("CONVERTER_POOL_SIZE", "1"))
+CONVERTER_POOL = ConverterPool(
+    CONVERSION_SCRIPT,
+    size=CONVERTER_POOL_SIZE,
+    max_jobs=int(os.environ.get("CONVERTER_POOL_MAX_JOBS", "20")),
+    max_rss=int(float(os.environ.get("CONVERTER_POOL_MAX_RSS_GB", "4")) * 1024**3),
+) if CONVERTER_POOL_SIZE > 0 else None
+# llama-quantize and llama-imatrix runs are pinned to their own CPUs (NUMA-local where possible) within the
+# container's CPU quota, with thread counts tuned per machine and tool build (CPU_TUNING=0 = tools pick their own).
+CPU_TUNER = CpuTuner(os.path.join("outputs", "cpu_tuning.json"), enabled=os.environ.get("CPU_TUNING", "1") == "1")
+# Upper bound on concurrent llama-quantize processes per job (0 = size automatically from cores and RAM).
+MAX_PARALLEL_QUANTS = int(os.environ.get("MAX_PARALLEL_QUANTS", "0"))
+# Persistent store of finished fp16/quant artifacts, reused across jobs (budget 0 = disabled).
+ARTIFACT_STORE = ArtifactStore(os.environ.get("ARTIFACT_STORE_DIR", "./artifact_store"), int(float(os.environ.get("ARTIFACT_STORE_MAX_GB", "100")) * 1024**3))
+# imatrix results keyed by fp16 content, calibration data and llama-imatrix build; shared by every quant type.
+IMATRIX_CACHE = ArtifactStore(os.environ.get("IMATRIX_CACHE_DIR", "./imatrix_cache"), int(float(os.environ.get("IMATRIX_CACHE_MAX_GB", "5")) * 1024**3))
+IMATRIX_FLAGS = ["-ngl", "0"]
+# The calibration text is split across parallel llama-imatrix workers with this many threads each
+# (IMATRIX_MAX_WORKERS caps the worker count; 0 = as many as the job's CPUs allow).
+IMATRIX_WORKER_THREADS = int(os.environ.get("IMATRIX_WORKER_THREADS", "4"))
+IMATRIX_MAX_WORKERS = int(os.environ.get("IMATRIX_MAX_WORKERS", "0"))
+# Ingested calibration corpora and their samples. Jobs use a deterministic sample of about
+# IMATRIX_TOKEN_BUDGET tokens, or of what fits in IMATRIX_TIME_BUDGET seconds (0 = whole corpus).
+CALIBRATION = CalibrationStore(os.environ.get("CALIBRATION_DIR", "./calibration"))
+IMATRIX_TOKEN_BUDGET = int(os.environ.get("IMATRIX_TOKEN_BUDGET", "0"))
+IMATRIX_TIME_BUDGET = float(os.environ.get("IMATRIX_TIME_BUDGET", "0"))
+IMATRIX_SAMPLE_SEED = int(os.environ.get("IMATRIX_SAMPLE_SEED", "0"))
+# Optional evaluation of every produced quant: perplexity and KL-divergence against the fp16 over EVAL_CHUNKS
+# chunks of EVAL_DATA (falls back to the default calibration text), plus a llama-bench run unless EVAL_BENCH=0.
+EVAL_DATA = os.environ.get("EVAL_DATA", "llama.cpp/wikitext-2-raw/wiki.test.raw")
+EVAL_CHUNKS = int(os.environ.get("EVAL_CHUNKS", "8"))
+EVAL_BENCH = os.environ.get("EVAL_BENCH", "1") == "1"
+# Number of files transferred to the Hub at once during an upload.
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+# "native" splits in-process and hands each shard to the uploader as it is written; "llama" uses llama-gguf-split.
+GGUF_SPLIT_BACKEND = os.environ.get("GGUF_SPLIT_BACKEND", "native")
+# Downloaded source models, revalidated against the Hub and evicted LRU-first past the budget (0 = unlimited).
+MODEL_CACHE = ModelCache(
+    os.environ.get("MODEL_CACHE_DIR", "./model_cache"),
+    int(float(os.environ.get("MODEL_CACHE_MAX_GB", "0")) * 1024**3),
+    verify_hashes=os.environ.get("MODEL_CACHE_VERIFY") == "1",
+    # Downloads land in this Hugging Face hub cache (default: the standard one) and are linked into MODEL_CACHE_DIR.
+    hub_cache_dir=os.environ.get("MODEL_CACHE_HUB_DIR") or None,
+)
+# Identities, model revisions, file listings and parameter summaries; revisions are re-checked after the TTL.
+HUB_CACHE = HubMetadataCache(os.environ.get("HUB_CACHE_DIR", "./hub_cache"), revision_ttl=float(os.environ.get("HUB_CACHE_REVISION_TTL", "300")), identity_ttl=float(os.environ.get("HUB_CACHE_IDENTITY_TTL", "3600")))
+# Admits as many jobs as RAM, disk and CPUs allow; the rest wait in a bounded, per-user-fair backlog.
+SCHEDULER = ResourceScheduler(
+    machine_capacity(),
+    backlog_path=os.path.join("outputs", "scheduler_backlog.json"),
+    max_backlog=int(os.environ.get("SCHEDULER_MAX_BACKLOG", "50")),
+    max_per_user=int(os.environ.get("SCHEDULER_MAX_PER_USER", "5")),
+    cpus_per_job=int(os.environ.get("SCHEDULER_CPUS_PER_JOB", "0")) or None,
+)
+# Reject jobs up front whose estimated RAM or disk exceeds what this machine can ever provide (0 = only warn).
+PREFLIGHT_STRICT = os.environ.get("PREFLIGHT_STRICT", "1") == "1"
+# Job outputs not uploaded or deleted are removed OUTPUTS_TTL_HOURS after their browser session closed (or
+# after their last activity), and kept under OUTPUTS_QUOTA_GB by reclaiming the oldest abandoned ones first
+# (0 = no quota). Finished jobs' records are kept for OUTPUTS_RECORD_TTL_DAYS.
+REAPER = OutputsReaper(
+    "outputs",
+    ttl=float(os.environ.get("OUTPUTS_TTL_HOURS", "24")) * 3600,
+    quota=int(float(os.environ.get("OUTPUTS_QUOTA_GB", "0")) * 1024**3),
+    record_ttl=float(os.environ.get("OUTPUTS_RECORD_TTL_DAYS", "30")) * 86400,
+)
+OUTPUTS_REAP_INTERVAL = int(os.environ.get("OUTPUTS_REAP_INTERVAL_SECONDS", "600"))
+# Prometheus-style endpoint at http://METRICS_HOST:METRICS_PORT/metrics (port 0 = disabled).
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+REGISTRY.add_gauge("gguf_scheduler_running_jobs", "Jobs currently admitted by the scheduler.", lambda: SCHEDULER.status()["running"])
+REGISTRY.add_gauge("gguf_scheduler_waiting_jobs", "Jobs waiting for resources.", lambda: SCHEDULER.status()["waiting"])
+REGISTRY.add_gauge("gguf_scheduler_reserved_disk_bytes", "Scratch disk reserved by running jobs.", lambda: SCHEDULER.status()["reserved_disk"])
+REGISTRY.add_gauge("gguf_scheduler_draining", "1 while the app drains before a restart.", lambda: int(SCHEDULER.status()["draining"]))
+# Restart when memory grows past RESTART_MAX_RSS_GROWTH_GB, temporary files leak past RESTART_MAX_LEAKED_TEMP_GB,
+# or after RESTART_MAX_UPTIME_HOURS once the app has been idle for RESTART_IDLE_MINUTES (0 = never for each).
+# RESTART_MODE: "space" restarts the Hugging Face Space, "exit" exits for a supervisor to restart, "log"
+# only logs, "off" disables the policy; "auto" means "space" on a Space and "off" elsewhere.
+RESTART_MODE = os.environ.get("RESTART_MODE", "auto")
+RESTART_MAX_RSS_GROWTH = int(float(os.environ.get("RESTART_MAX_RSS_GROWTH_GB", "4")) * 1024**3)
+RESTART_MAX_LEAKED_TEMP = int(float(os.environ.get("RESTART_MAX_LEAKED_TEMP_GB", "10")) * 1024**3)
+RESTART_MAX_UPTIME = float(os.environ.get("RESTART_MAX_UPTIME_HOURS", "3")) * 3600
+RESTART_IDLE_SECONDS = float(os.environ.get("RESTART_IDLE_MINUTES", "10")) * 60
+# How long to wait for running jobs to reach a checkpoint before restarting anyway.
+RESTART_DRAIN_TIMEOUT = float(os.environ.get("RESTART_DRAIN_TIMEOUT_MINUTES", "60")) * 60
+# A factory reboot rebuilds the Space image and throws away everything on its disk, including caches.
+RESTART_FACTORY_REBOOT = os.environ.get("RESTART_FACTORY_REBOOT") == "1"
+_active_uploads = 0
+_active_uploads_lock = threading.Lock()
+
+# --- HELPER FUNCTIONS ---
+
+def get_platform_executable(base_name: str) -> str:
+    # Returns the path of the best build of the tool for this platform and CPU.
+    return TOOLS.resolve(base_name)
+
+def resolve_tools():
+    # Chooses the build of every llama.cpp tool up front, so the choice is made and logged at startup.
+    for tool in ("llama-quantize", "llama-imatrix", "llama-gguf-split", "llama-perplexity", "llama-bench"):
+        get_platform_executable(tool)
+
+def get_quantize_workers(fp16_path: str, n_quants: int, cpus: int | None = None) -> int:
+    # Sizes the llama-quantize pool to the available cores and RAM.
+    # The fp16 input is mmapped and shared through the page cache; each worker additionally
+    # needs f32 scratch for the tensor it is converting, budgeted here as a quarter of the fp16 size.
+    workers = min(n_quants, cpus or get_effective_cpu_count())
+    total_memory = get_usable_memory_bytes()
+    if total_memory:
+        per_worker = max(os.path.getsize(fp16_path) // 4, 1 << 30)
+        workers = min(workers, max(1, (total_memory - os.path.getsize(fp16_path)) // per_worker))
+    if MAX_PARALLEL_QUANTS > 0:
+        workers = min(workers, MAX_PARALLEL_QUANTS)
+    return max(1, workers)
+
+def normalize_quant_methods(methods) -> list[str]:
+    # Accepts a single quant type or a list of them and returns unique, upper-cased names in order.
+    if not methods:
+        return []
+    if isinstance(methods, str):
+        methods = [methods]
+    return list(dict.fromkeys(m.upper() for m in methods))
+
+def quantize_model(fp16_path: str, quantized_gguf_path: str, quant_method: str, imatrix_path: str | None = None, n_threads: int | None = None, on_progress=None):
+    # Runs llama-quantize for a single quant type, on CPUs and with a thread count from CPU_TUNER.
+    quantize_executable = get_platform_executable("llama-quantize")
+    quantise_ggml = [quantize_executable]
+    if imatrix_path:
+        quantise_ggml.extend(["--imatrix", imatrix_path])
+    quantise_ggml.extend([fp16_path, quantized_gguf_path, quant_method])
+
+    with CPU_TUNER.slot(quantize_executable, n_threads or get_effective_cpu_count(), quant_method) as slot:
+        quantise_ggml.append(str(slot.threads))
+        returncode, output = run_streaming(quantise_ggml, quantize_progress(quant_method), on_progress, affinity=slot.cpus)
+        if returncode == 0:
+            slot.units = os.path.getsize(fp16_path)
+    if returncode != 0:
+        raise Exception(f"Error quantizing to {quant_method}: {output}")
+    print(f"Quantized successfully: {quantized_gguf_path}")
+
+def quantize_all(fp16_path: str, outdir: str, model_name: str, quant_methods: list[str], imatrix_path: str | None = None, fp16_sha256: str | None = None, cpus: int | None = None, on_progress=None) -> list[str]:
+    # Fans out one llama-quantize process per quant type, all reading the same fp16 file.
+    # Quants already in the artifact store for this exact fp16/imatrix/quantizer are linked instead of rebuilt.
+    quantized_paths = [str(Path(outdir) / f"{model_name.lower()}-{method}.gguf") for method in quant_methods]
+    keys = {}
+    if ARTIFACT_STORE.enabled and fp16_sha256:
+        imatrix_sha256 = file_sha256(imatrix_path) if imatrix_path else None
+        quantizer = tool_version(get_platform_executable("llama-quantize"))
+        for path, method in zip(quantized_paths, quant_methods):
+            keys[path] = make_key(kind="quant", fp16=fp16_sha256, quant_type=method, imatrix=imatrix_sha256, quantizer=quantizer)
+    pending = [(path, method) for path, method in zip(quantized_paths, quant_methods) if not (keys and ARTIFACT_STORE.fetch(keys[path], path))]
+
+    if pending:
+        cpus = cpus or get_effective_cpu_count()
+        workers = get_quantize_workers(fp16_path, len(pending), cpus)
+        n_threads = max(1, cpus // workers)
+        print(f"Quantizing {len(pending)} type(s) with {workers} parallel worker(s), {n_threads} thread(s) each: {[m for _, m in pending]}")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Each worker runs in a copy of the caller's context so its tools are charged to the current stage.
+            futures = [pool.submit(contextvars.copy_context().run, quantize_model, fp16_path, path, method, imatrix_path, n_threads, on_progress) for path, method in pending]
+            errors = [str(f.exception()) for f in futures if f.exception() is not None]
+        if errors:
+            raise Exception("\n\n".join(errors))
+        for path, method in pending:
+            if keys:
+                ARTIFACT_STORE.publish(keys[path], path, kind="quant", quant_type=method)
+    return quantized_paths
+
+SHARD_SUFFIX = re.compile(r"-\d{5}-of-\d{5}\.gguf$")
+INTERMEDIATE_SUFFIX = re.compile(r"\.(fp16|bf16)\.gguf$")
+
+def convert_model(local_dir: str, outfile: str, outtype: str = "f16", on_progress=None):
+    # Converts a downloaded model to GGUF, in a warm converter worker when the pool is enabled.
+    args = [str(local_dir), "--outtype", outtype, "--outfile", outfile]
+    returncode, output = None, ""
+    if CONVERTER_POOL is not None:
+        try:
+            returncode, output = CONVERTER_POOL.run(args, convert_progress(), on_progress)
+        except ConverterPoolBusy:
+            print("All converter workers are busy, converting in a new process.")
+        except (OSError, ConverterPoolUnavailable) as e:
+            print(f"Converter pool unavailable, converting in a new process: {e}")
+    if returncode is None:
+        returncode, output = run_streaming(["python", CONVERSION_SCRIPT, *args], convert_progress(), on_progress)
+    if returncode != 0:
+        raise Exception(f"Error converting to {outtype}: {output}")
+    print(f"Model converted to {outtype} successfully: {outfile}")
+
+def get_outtype(dtypes: dict | None, quant_methods: list[str], use_imatrix: bool, evaluate: bool = False) -> str:
+    # The cheapest converter output that serves the job (see plan_outtype), unless CONVERT_OUTTYPE forces one.
+    if CONVERT_OUTTYPE in ("f16", "bf16"):
+        return CONVERT_OUTTYPE
+    return plan_outtype(dtypes, quant_methods, use_imatrix, evaluate)
+
+def intermediate_path(outdir: str, model_name: str, outtype: str) -> str:
+    return str(Path(outdir) / f"{model_name}.{'fp16' if outtype == 'f16' else outtype}.gguf")
+
+def find_quantized_ggufs(temp_dir: str) -> list[str]:
+    # Lists the quantized GGUF files in a job directory, excluding the fp16 intermediate and shards.
+    return sorted(os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.endswith('.gguf') and not INTERMEDIATE_SUFFIX.search(f) and not SHARD_SUFFIX.search(f))
+
+def find_shards(temp_dir: str) -> list[str]:
+    # Lists the shards written by gguf-split in a job directory.
+    return sorted(os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if SHARD_SUFFIX.search(f))
+
+def generate_importance_matrix(model_path: str, train_data_path: str, output_path: str, n_threads: int | None = None, on_progress=None):
+    # Generates the importance matrix using parallel llama-imatrix workers over parts of the calibration data.
+    # Concurrent runs are safe: each one only reads its build (see tool_variants.py).
+    imatrix_executable = get_platform_executable("llama-imatrix")
+    compute_imatrix(imatrix_executable, model_path, train_data_path, output_path, IMATRIX_FLAGS, n_threads, IMATRIX_WORKER_THREADS, IMATRIX_MAX_WORKERS, on_progress, CPU_TUNER.slot)
+    print("Importance matrix generation completed.")
+
+def evaluate_job_quants(fp16_path: str, quantized_paths: list[str], quant_methods: list[str], outdir: str, cpus: int | None = None, on_progress=None) -> dict:
+    # Scores the job's quants against its fp16 and saves the results next to them (eval.json), so a
+    # resumed job does not evaluate twice.
+    results_path = os.path.join(outdir, "eval.json")
+    if os.path.exists(results_path):
+        with open(results_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    eval_data = EVAL_DATA if os.path.isfile(EVAL_DATA) else DEFAULT_TRAIN_DATA
+    if eval_data != EVAL_DATA:
+        print(f"Eval text {EVAL_DATA} not found; evaluating on {eval_data}, which imatrix quants may have been calibrated on.")
+    results = evaluate_quants(
+        get_platform_executable("llama-perplexity"),
+        get_platform_executable("llama-bench") if EVAL_BENCH else None,
+        fp16_path, dict(zip(quant_methods, quantized_paths)), eval_data, outdir,
+        EVAL_CHUNKS, cpus, get_usable_memory_bytes(), on_progress,
+    )
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    return results
+
+def get_importance_matrix(fp16_path: str, fp16_sha256: str | None, train_data_path: str, output_path: str, n_threads: int | None = None, on_progress=None):
+    # Reuses a cached imatrix for the same fp16 content and calibration data, generating it only on a miss.
+    # The matrix does not depend on the target quant type, so one run serves every imatrix quant.
+    if not IMATRIX_CACHE.enabled:
+        generate_importance_matrix(fp16_path, train_data_path, output_path, n_threads, on_progress)
+        return
+    imatrix_key = make_key(
+        kind="imatrix",
+        fp16=fp16_sha256 or file_sha256(fp16_path),
+        train_data=file_sha256(train_data_path),
+        imatrix=tool_version(get_platform_executable("llama-imatrix")),
+        flags=IMATRIX_FLAGS,
+    )
+    if IMATRIX_CACHE.fetch(imatrix_key, output_path):
+        return
+    generate_importance_matrix(fp16_path, train_data_path, output_path, n_threads, on_progress)
+    IMATRIX_CACHE.publish(imatrix_key, output_path, kind="imatrix", train_data=os.path.basename(train_data_path))
+
+def get_calibration_sample(corpus_id: str, token_budget: int = 0, time_budget: float = 0, params: int | None = None, threads: int | None = None) -> str:
+    # Returns a sample of an ingested calibration corpus sized to the smaller of the two budgets.
+    if time_budget and params:
+        time_tokens = CALIBRATION.tokens_for_seconds(time_budget, params, threads or get_effective_cpu_count())
+        token_budget = min(token_budget, time_tokens) if token_budget else time_tokens
+    sample_path = CALIBRATION.sample(corpus_id, max(token_budget, 0), IMATRIX_SAMPLE_SEED)
+    print(f"Calibration data: ~{estimate_tokens(os.path.getsize(sample_path))} of ~{CALIBRATION.corpus_info(corpus_id).get('tokens', '?')} tokens of corpus {corpus_id[:12]}.")
+    return sample_path
+
+def split_model_file(model_path: str, split_max_tensors=256, split_max_size=None, on_progress=None):
+    # Splits a GGUF model into shards next to it, yielding each shard as soon as it is written, and
+    # removes the original once all shards exist. The native splitter frees the original's disk space
+    # shard by shard as it goes.
+    model_path_prefix = '.'.join(model_path.split('.')[:-1])
+
+    if GGUF_SPLIT_BACKEND == "native":
+        try:
+            yield from split_gguf(model_path, model_path_prefix, int(split_max_tensors), split_max_size, on_progress, release_input=True)
+        except ValueError as e:
+            raise Exception(f"Error splitting the model: {e}")
+        print("Model split successfully!")
+        os.remove(model_path)
+        return
+
+    split_executable = get_platform_executable("llama-gguf-split")
+    split_cmd = [split_executable, "--split"]
+    if split_max_size:
+        split_cmd.extend(["--split-max-size", split_max_size])
+    else:
+        split_cmd.extend(["--split-max-tensors", str(split_max_tensors)])
+    split_cmd.extend([model_path, model_path_prefix])
+
+    print(f"Running split command: {split_cmd}")
+    returncode, output = run_streaming(split_cmd, split_progress(), on_progress)
+    if returncode != 0:
+        raise Exception(f"Error splitting the model: {output}")
+    print("Model split successfully!")
+
+    if os.path.exists(model_path):
+        os.remove(model_path)
+
+    model_file_prefix = os.path.basename(model_path_prefix)
+    sharded_files = [f for f in find_shards(os.path.dirname(model_path)) if os.path.basename(f).startswith(f"{model_file_prefix}-")]
+    if not sharded_files:
+        raise Exception("No sharded files found after splitting.")
+    yield from sharded_files
+
+def get_preflight_problems(estimate: dict) -> list[str]:
+    # Checks an estimate against this machine; disk reserved by running jobs counts as available later.
+    available_disk = shutil.disk_usage(".").free + SCHEDULER.status()["reserved_disk"]
+    return preflight_problems(estimate, SCHEDULER.capacity["ram"], available_disk)
+
+def get_model_metadata(model_id: str, api) -> tuple[str | None, list, dict]:
+    # Returns the model's current revision, file listing and parameter summary, from HUB_CACHE when possible.
+    try:
+        revision = HUB_CACHE.revision(model_id, api)
+    except Exception as e:
+        print(f"Could not resolve the upstream revision of '{model_id}': {e}")
+        revision = None
+    repo_tree = HUB_CACHE.repo_tree(model_id, api, revision)
+
+    def summarize():
+        summary = inspect_model(model_id, api, repo_tree)
+        if summary["params"] is None:
+            raise Exception("no parameter information")  # not worth caching
+        return summary
+    try:
+        model = HUB_CACHE.per_revision("model_summary", model_id, revision, summarize)
+    except Exception:
+        model = {"params": None, "largest_tensor": None, "source": "unknown"}
+    return revision, repo_tree, model
+
+def estimate_summary(model_id: str, quant_methods: list[str], use_imatrix: bool, split_model: bool, token: str | None = None, evaluate: bool = False) -> str:
+    # Markdown pre-flight estimate for a job, before anything is downloaded.
+    api = HfApi(token=token or HF_TOKEN)
+    _, repo_tree, model_summary = get_model_metadata(model_id, api)
+    outtype = get_outtype(model_summary.get("dtypes"), quant_methods, use_imatrix, evaluate)
+    estimate = estimate_job(model_id, api, repo_tree, quant_methods, use_imatrix, split_model, MODEL_CACHE.cached_bytes(model_id), model_summary, outtype)
+    text = format_estimate(estimate)
+    problems = get_preflight_problems(estimate)
+    if problems:
+        text += "\n\n**This job does not fit on this machine:**\n" + "\n".join(f"- {p}" for p in problems)
+    return text
+
+def read_model_family(local_dir) -> str | None:
+    # The architecture name from config.json (e.g. "llama"), used to break metrics down by model family.
+    try:
+        with open(os.path.join(local_dir, "config.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return config.get("model_type") or config.get("text_config", {}).get("model_type")
+
+def record_cache_stages(metrics: JobMetrics, cache_stats: dict, failed: bool = False):
+    # Turns MODEL_CACHE.use()'s timings into the job's cache_lookup and download stages, once.
+    if "lookup_seconds" not in cache_stats or cache_stats.get("recorded"):
+        return
+    cache_stats["recorded"] = True
+    metrics.add_stage("cache_lookup", cache_stats["lookup_seconds"], "hit" if cache_stats["hit"] else "miss")
+    if not cache_stats["hit"]:
+        metrics.add_stage("download", cache_stats["download_seconds"], "error" if failed else "ok", cache_stats["download_bytes"])
+
+def busy_jobs() -> int:
+    # Jobs that a restart would interrupt: admitted, waiting for resources, or uploading.
+    status = SCHEDULER.status()
+    with _active_uploads_lock:
+        return status["running"] + status["waiting"] + _active_uploads
+
+def build_restart_policy(space_id: str | None, token: str | None) -> RestartPolicy | None:
+    # Returns the restart policy selected by RESTART_MODE, or None if it is off.
+    mode = RESTART_MODE
+    if mode == "auto":
+        mode = "space" if space_id and token else "off"
+    if mode == "off":
+        return None
+    if mode == "space":
+        if not space_id or not token:
+            raise Exception("RESTART_MODE=space needs HF_SPACE_ID and HF_TOKEN.")
+        def restart_fn():
+            HfApi().restart_space(repo_id=space_id, token=token, factory_reboot=RESTART_FACTORY_REBOOT)
+            return True  # the Hub restarts the Space shortly; until then the app stays drained
+    elif mode == "exit":
+        def restart_fn():
+            sys.stdout.flush()
+            os._exit(75)  # EX_TEMPFAIL: the supervisor (Docker, systemd) starts a fresh process
+    elif mode == "log":
+        restart_fn = lambda: print("RESTART_MODE=log: not restarting; paused jobs continue.")
+    else:
+        raise Exception(f"Unknown RESTART_MODE '{RESTART_MODE}'.")
+    temp_dirs = [tempfile.gettempdir(), os.environ.get("GRADIO_TEMP_DIR")]
+    return RestartPolicy(
+        restart_fn, SCHEDULER, busy_jobs,
+        max_rss_growth=RESTART_MAX_RSS_GROWTH,
+        max_leaked_temp=RESTART_MAX_LEAKED_TEMP,
+        temp_dirs=temp_dirs,
+        max_uptime=RESTART_MAX_UPTIME,
+        idle_seconds=RESTART_IDLE_SECONDS,
+        drain_timeout=RESTART_DRAIN_TIMEOUT,
+        on_resumed=lambda: resume_interrupted_jobs(token, paused_only=True),
+    )
+
+# --- PIPELINE ---
+
+DEFAULT_TRAIN_DATA = "llama.cpp/groups_merged.txt"
+
+def run_job(model_id: str, quant_methods: list[str], use_imatrix: bool, token: str, private_repo: bool = False, train_data_path: str | None = None, split_model: bool = False, split_max_tensors=256, split_max_size=None, calibration_tokens: int | None = None, calibration_seconds: float | None = None, evaluate: bool = False, on_progress=None) -> dict:
+    # Creates a durable job for model_id under outputs/ and runs it up to the point where it is ready
+    # for upload_job(). The calibration budgets default to IMATRIX_TOKEN_BUDGET and IMATRIX_TIME_BUDGET.
+    username = HUB_CACHE.identity(token)["name"]
+    quant_methods = normalize_quant_methods(quant_methods)
+    if not quant_methods:
+        raise ValueError("Please select at least one quantization method.")
+    corpus_id = None
+    if use_imatrix:
+        # The calibration file is ingested up front: an uploaded file may be gone by the time a job resumes.
+        train_data_path = train_data_path or DEFAULT_TRAIN_DATA
+        if not os.path.isfile(train_data_path):
+            raise Exception(f"Training data file not found: {train_data_path}")
+        corpus_id = CALIBRATION.ingest(train_data_path)
+
+    # Ensure the outputs directory exists before trying to use it
+    os.makedirs("outputs", exist_ok=True)
+
+    outdir = tempfile.mkdtemp(dir="outputs")
+    state = JobState.create(
+        outdir, username,
+        model_id=model_id, quant_methods=quant_methods, use_imatrix=bool(use_imatrix), corpus_id=corpus_id,
+        calibration_tokens=calibration_tokens, calibration_seconds=calibration_seconds, private_repo=bool(private_repo),
+        split_model=bool(split_model), split_max_tensors=split_max_tensors, split_max_size=split_max_size or None,
+        evaluate=bool(evaluate),
+    )
+    print(f"Created job {state.job_id} for {model_id}.")
+    with job_lock(state.job_id):
+        return process_job(state, token, on_progress)
+
+def job_result(state: JobState) -> dict:
+    return {
+        "job_id": state.job_id,
+        "outdir": state.job_dir,
+        "quantized_gguf_paths": find_quantized_ggufs(state.job_dir) if os.path.isdir(state.job_dir) else [],
+        "imatrix_path": state.artifacts.get("imatrix") if state.artifacts.get("imatrix") and os.path.exists(state.artifacts["imatrix"]) else None,
+        "repo_id": state.artifacts.get("repo_id"),
+        "repo_url": state.artifacts.get("repo_url"),
+    }
+
+def process_job(state: JobState, token: str | None, on_progress=None) -> dict:
+    # Runs the job's remaining stages up to "quantized", skipping every stage whose artifacts already
+    # exist. On failure the job is kept for resuming, unless nothing worth keeping was produced yet.
+    report = on_progress or (lambda fraction, desc: None)
+    params = state.params
+    model_id, quant_methods, use_imatrix = params["model_id"], params["quant_methods"], params["use_imatrix"]
+    split_model, split_max_size = params["split_model"], params["split_max_size"]
+    model_name = model_id.split('/')[-1]
+    outdir = state.job_dir
+    imatrix_path = Path(outdir) / "imatrix.dat"
+    quantized_gguf_paths = [str(Path(outdir) / f"{model_name.lower()}-{method}.gguf") for method in quant_methods]
+    # The converter writes a 16-bit intermediate (f16 or bf16) for the other tools, or, when that can be
+    # skipped, the job's only quant itself. The choice is made once the source weights are known and
+    # kept for the job's later attempts; jobs from before it was recorded used f16.
+    outtype = state.artifacts.get("outtype") or "f16"
+    if state.reached("quantized") and all(os.path.exists(p) for p in quantized_gguf_paths):
+        return job_result(state)
+
+    # Metrics continue the record of an earlier attempt of the same job.
+    metrics = JobMetrics.load(state.job_id, model_id=model_id, quant_methods=quant_methods, imatrix=use_imatrix)
+    cache_stats = {}
+    state.set_status("running")
+
+    try:
+        api = HfApi(token=token)
+        dl_pattern = ["*.md", "*.json", "*.model"]
+        try:
+            revision, repo_tree, model_summary = get_model_metadata(model_id, api)
+            pattern = "*.safetensors" if any(f.path.endswith(".safetensors") for f in repo_tree) else "*.bin"
+        except Exception:
+            print("Could not determine primary file type, downloading both .safetensors and .bin")
+            revision, repo_tree, model_summary = None, None, None
+            pattern = ["*.safetensors", "*.bin"]
+        dl_pattern.extend(pattern if isinstance(pattern, list) else [pattern])
+        # A resumed job keeps the revision it started from.
+        revision = state.artifacts.get("revision") or revision
+        # Until the download's own headers can be read, the outtype is planned from the Hub's view of them.
+        if not state.reached("converted"):
+            outtype = get_outtype((model_summary or {}).get("dtypes"), quant_methods, use_imatrix, params.get("evaluate"))
+
+        if not os.path.exists("downloads"): os.makedirs("downloads")
+
+        # Predict the job's footprint before downloading anything and re-plan or refuse it up front.
+        report(None, "Estimating resources")
+        estimate = estimate_job(model_id, api, repo_tree, quant_methods, use_imatrix, split_model, MODEL_CACHE.cached_bytes(model_id), model_summary, outtype)
+        problems = get_preflight_problems(estimate)
+        if problems:
+            if PREFLIGHT_STRICT:
+                raise Exception("This job cannot run on this machine:\n" + "\n".join(problems))
+            print("Pre-flight warnings:\n" + "\n".join(problems))
+        if estimate["auto_split"]:
+            print(f"Estimated output exceeds the Hub's file size limit; splitting into {AUTO_SPLIT_SIZE} shards.")
+            split_model, split_max_size = True, AUTO_SPLIT_SIZE
+        needs = job_needs(estimate) if estimate["params"] else estimate_job_needs(repo_tree, len(quant_methods), use_imatrix)
+        print(f"Pre-flight estimate for {model_id}: {format_needs(needs)}")
+        SCHEDULER.checkpoint()
+        # The job directory gets the fp16, the quants and any split scratch; the download goes to the model
+        # cache and does not count against the outputs quota, for this job or the running ones.
+        REAPER.ensure_space(needs["outputs"], SCHEDULER.status()["reserved_outputs"])
+        report(None, "Waiting for resources")
+        with SCHEDULER.admit(state.record["owner"], needs, label=f"{model_id} {','.join(quant_methods)}") as grant:
+            fp16_sha256 = state.artifacts.get("fp16_sha256")
+            fp16 = intermediate_path(outdir, model_name, outtype)
+            converted = quantized_gguf_paths[0] if is_direct(outtype) else fp16
+            if state.reached("converted") and os.path.exists(converted):
+                print(f"Job {state.job_id}: reusing {os.path.basename(converted)} from the previous attempt.")
+            else:
+                # The cache entry is leased while it is being read so eviction cannot remove it mid-conversion.
+                report(None, "Checking model cache / downloading")
+                with MODEL_CACHE.use(model_id, api, dl_pattern, repo_tree, revision, cache_stats) as local_dir:
+                    metrics.record["family"] = read_model_family(local_dir)
+                    record_cache_stages(metrics, cache_stats)
+                    state.advance("downloaded", revision=revision, family=metrics.record["family"])
+                    SCHEDULER.checkpoint()
+                    outtype = get_outtype(local_dtypes(str(local_dir)) or (model_summary or {}).get("dtypes"), quant_methods, use_imatrix, params.get("evaluate"))
+                    fp16 = intermediate_path(outdir, model_name, outtype)
+                    converted = quantized_gguf_paths[0] if is_direct(outtype) else fp16
+                    with metrics.stage("convert") as stage:
+                        kind = "quant" if is_direct(outtype) else "fp16"
+                        convert_key = make_key(kind=kind, source=source_fingerprint(str(local_dir)), converter=tool_version(CONVERSION_SCRIPT), outtype=outtype)
+                        convert_entry = ARTIFACT_STORE.fetch(convert_key, converted)
+                        if convert_entry is None:
+                            report(None, f"Converting to {outtype}")
+                            convert_model(str(local_dir), converted, outtype, report)
+                            convert_entry = ARTIFACT_STORE.publish(convert_key, converted, kind=kind, model_id=model_id, outtype=outtype)
+                        else:
+                            stage["outcome"] = "hit"
+                        stage["bytes"] = os.path.getsize(converted)
+                fp16_sha256 = convert_entry["sha256"] if convert_entry and not is_direct(outtype) else None
+                state.advance("converted", fp16=None if is_direct(outtype) else fp16, fp16_sha256=fp16_sha256, outtype=outtype)
+                SCHEDULER.checkpoint()
+
+            if use_imatrix and not (state.reached("imatrix") and os.path.exists(imatrix_path)):
+                calibration_tokens = IMATRIX_TOKEN_BUDGET if params["calibration_tokens"] is None else int(params["calibration_tokens"])
+                calibration_seconds = IMATRIX_TIME_BUDGET if params["calibration_seconds"] is None else float(params["calibration_seconds"])
+                sample_path = get_calibration_sample(params["corpus_id"], calibration_tokens, calibration_seconds, estimate["params"], grant["cpus"])
+                with metrics.stage("imatrix") as stage:
+                    get_importance_matrix(fp16, fp16_sha256, sample_path, str(imatrix_path), grant["cpus"], report)
+                    stage["bytes"] = os.path.getsize(fp16)
+                # Runs that actually computed the matrix (not cache hits) calibrate future time budgets.
+                if stage["children"] and estimate["params"]:
+                    CALIBRATION.record_throughput(estimate_tokens(os.path.getsize(sample_path)), stage["duration"], estimate["params"], grant["cpus"])
+                state.advance("imatrix", imatrix=str(imatrix_path))
+                SCHEDULER.checkpoint()
+
+            # A direct conversion has already written the job's only quant.
+            if not is_direct(outtype):
+                with metrics.stage("quantize") as stage:
+                    quantized_gguf_paths = quantize_all(fp16, outdir, model_name, quant_methods, str(imatrix_path) if use_imatrix else None, fp16_sha256, grant["cpus"], report)
+                    stage["bytes"] = sum(os.path.getsize(p) for p in quantized_gguf_paths)
+
+            # Evaluation only adds to the model card; a failure there does not fail the job.
+            eval_results = None
+            if params.get("evaluate"):
+                SCHEDULER.checkpoint()
+                report(None, "Evaluating quants")
+                with metrics.stage("evaluate") as stage:
+                    try:
+                        eval_results = evaluate_job_quants(fp16, quantized_gguf_paths, quant_methods, outdir, grant["cpus"], report)
+                    except Exception as e:
+                        stage["outcome"] = "error"
+                        print(f"Evaluating the quants failed: {e}")
+
+        print(f"Storage since startup: {format_savings(storage_stats())}.")
+        if params["private_repo"]: open(os.path.join(outdir, "private_repo.flag"), 'a').close()
+        if split_model:
+            open(os.path.join(outdir, "split_model.flag"), 'a').close()
+            with open(os.path.join(outdir, "split_tensors.dat"), 'w') as f: f.write(str(params["split_max_tensors"]))
+            if split_max_size:
+                with open(os.path.join(outdir, "split_size.dat"), 'w') as f: f.write(split_max_size)
+
+        # A single quant keeps the per-quant repo name; several quants share one repo.
+        repo_name = f"{model_name}-{quant_methods[0]}-GGUF" if len(quant_methods) == 1 else f"{model_name}-GGUF"
+        with open(os.path.join(outdir, "repo_name.dat"), 'w') as f: f.write(repo_name)
+
+        new_repo_id = f"{state.record['owner']}/{repo_name}"
+        space_id = os.environ.get("HF_SPACE_ID", "fentible/gguf-repo-suite")
+        space_link = f"[{space_id.split('/')[-1]}](https://huggingface.co/spaces/{space_id})"
+        card = ModelCard("")
+        card.data.base_model = model_id
+        card.text = f"# GGUF Model Card for {new_repo_id}\nConverted from [{model_id}](https://huggingface.co/{model_id}) via {space_link}."
+        if len(quantized_gguf_paths) > 1:
+            card.text += "\n\n## Files\n" + "\n".join(f"- `{os.path.basename(p)}`" for p in quantized_gguf_paths)
+        if eval_results:
+            card.text += "\n\n" + format_eval_table(eval_results)
+        card.save(os.path.join(outdir, "README.md"))
+        state.advance("quantized", "awaiting_upload", quants=quantized_gguf_paths)
+        metrics.finish("process", "ok")
+    except BaseException as e:
+        record_cache_stages(metrics, cache_stats, failed=True)
+        metrics.finish("process", "error")
+        if not isinstance(e, Exception):
+            raise  # interrupted (e.g. shutdown): the job stays "running" and resumes on the next start
+        if isinstance(e, SchedulerDraining):
+            # Stopped at a checkpoint for a restart; the job continues on its own once the app is back.
+            state.set_status("paused")
+            print(f"Job {state.job_id} paused after stage '{state.stage}' for a restart.")
+            raise SchedulerDraining(f"The app is restarting. Job {state.job_id} was paused after stage '{state.stage}' and continues automatically once the app is back; resume it with its id to follow it.") from e
+        if state.reached("converted"):
+            state.fail(str(e) or type(e).__name__)
+            print(f"Job {state.job_id} failed at stage '{state.stage}'; its files were kept for resuming.")
+            raise Exception(f"{e}\n\nThe work up to stage '{state.stage}' was kept: resume job {state.job_id} to continue from there.") from e
+        else:
+            state.delete()
+            if os.path.exists(outdir):
+                shutil.rmtree(outdir)
+        raise
+
+    return job_result(state)
+
+def load_job(job_id: str, token: str | None = None) -> JobState:
+    # Looks up a job; with a token, the caller must be the job's owner.
+    state = JobState.load((job_id or "").strip())
+    if state is None:
+        raise FileNotFoundError(f"No job with id '{job_id}'.")
+    if token is not None and HUB_CACHE.identity(token)["name"] != state.record["owner"]:
+        raise PermissionError(f"Job '{job_id}' belongs to another user.")
+    return state
+
+def resume_job(job_id: str, token: str, on_progress=None, upload: bool = False) -> dict:
+    # Continues a job from its last completed stage, optionally through the upload.
+    state = load_job(job_id, token)
+    with job_lock(state.job_id):
+        state = load_job(job_id)  # another worker may have advanced it while we waited
+        if state.reached("uploaded"):
+            return job_result(state)
+        if not os.path.isdir(state.job_dir):
+            raise FileNotFoundError(f"The files of job '{job_id}' no longer exist.")
+        print(f"Resuming job {state.job_id} ({state.params['model_id']}) after stage '{state.stage}'.")
+        if not state.reached("quantized"):
+            process_job(state, token, on_progress)
+        if upload:
+            upload_job(state.job_dir, token, on_progress)
+            state = load_job(job_id)
+        return job_result(state)
+
+def resume_interrupted_jobs(token: str | None = None, paused_only: bool = False):
+    # Restarts the processing of jobs that were cut off by a crash or restart, in the background.
+    # Uploads are left for the job's owner to resume, since they need the owner's credentials. Jobs that
+    # another live process (e.g. a batch run) is working on are left to it.
+    def resume(state: JobState):
+        try:
+            with job_lock(state.job_id):
+                state = JobState.load(state.job_id)  # skip jobs someone else resumed or finished meanwhile
+                if state is None or state.status not in ("running", "paused"):
+                    return
+                try:
+                    process_job(state, token)
+                    print(f"Job {state.job_id} is ready to upload.")
+                except Exception as e:
+                    print(f"Resuming job {state.job_id} failed: {e}")
+        except JobBusy as e:
+            print(f"Not resuming: {e}")
+    for state in interrupted_jobs():
+        if paused_only and state.status != "paused":
+            continue
+        if state.reached("quantized"):
+            try:
+                with job_lock(state.job_id):
+                    state = JobState.load(state.job_id)
+                    if state is not None and state.status in ("running", "paused", "uploading"):
+                        state.set_status("awaiting_upload")
+            except JobBusy as e:
+                print(f"Not resuming: {e}")
+            continue
+        print(f"Resuming interrupted job {state.job_id} ({state.params['model_id']}) after stage '{state.stage}'.")
+        threading.Thread(target=resume, args=(state,), daemon=True).start()
+
+def upload_job(temp_dir: str, token: str, on_progress=None) -> tuple[str, str]:
+    # Uploads a job directory written by run_job() as a single commit and removes it. Returns the repo
+    # id and URL. On failure the directory is kept, and calling this again resumes the upload.
+    if not temp_dir or not os.path.exists(temp_dir):
+        raise FileNotFoundError("No files found to upload.")
+    job_id = os.path.basename(os.path.normpath(temp_dir))
+    global _active_uploads
+    with _active_uploads_lock:
+        # Uploads already running finish before a restart; new ones wait until the app is back.
+        if SCHEDULER.status()["draining"]:
+            raise SchedulerDraining("The app is restarting. Your files were kept; upload them again in a few minutes.")
+        _active_uploads += 1
+    try:
+        with job_lock(job_id):
+            return _upload_job_dir(temp_dir, job_id, token, on_progress)
+    finally:
+        with _active_uploads_lock:
+            _active_uploads -= 1
+
+def _upload_job_dir(temp_dir: str, job_id: str, token: str, on_progress=None) -> tuple[str, str]:
+    report = on_progress or (lambda fraction, desc: None)
+    if not os.path.exists(temp_dir):
+        raise FileNotFoundError("No files found to upload.")  # uploaded by whoever held the lock before us
+    api = HfApi(token=token)
+    username = HUB_CACHE.identity(token)["name"]
+    metrics = JobMetrics.load(job_id)
+    # Job directories from before durable job state have no record; they upload all the same.
+    state = JobState.load(job_id)
+    if state is not None:
+        state.set_status("uploading")
+    try:
+        quantized_gguf_paths = find_quantized_ggufs(temp_dir)
+        # Shards left by an interrupted upload are picked up again instead of re-splitting. Shards of a
+        # model whose original is still present come from an interrupted split, which picks them up itself.
+        unsplit_prefixes = tuple(os.path.basename(p)[:-len(".gguf")] + "-" for p in quantized_gguf_paths)
+        existing_shards = [p for p in find_shards(temp_dir) if not os.path.basename(p).startswith(unsplit_prefixes)]
+        imatrix_path = os.path.join(temp_dir, "imatrix.dat")
+        readme_path = os.path.join(temp_dir, "README.md")
+        private_repo_flag_path = os.path.join(temp_dir, "private_repo.flag")
+        split_model_flag_path = os.path.join(temp_dir, "split_model.flag")
+        split_tensors_path = os.path.join(temp_dir, "split_tensors.dat")
+        split_size_path = os.path.join(temp_dir, "split_size.dat")
+        repo_name_path = os.path.join(temp_dir, "repo_name.dat")
+
+        if not quantized_gguf_paths and not existing_shards:
+            raise FileNotFoundError("Could not find the quantized GGUF file.")
+
+        if os.path.exists(repo_name_path):
+            repo_name = open(repo_name_path).read().strip()
+        else:
+            quantized_gguf_name = os.path.basename((quantized_gguf_paths or existing_shards)[0])
+            repo_name = f"{quantized_gguf_name.split('-')[0]}-{quantized_gguf_name.split('-')[1]}-GGUF"
+
+        is_private = os.path.exists(private_repo_flag_path)
+        new_repo_id = f"{username}/{repo_name}"
+        new_repo_url = api.create_repo(repo_id=new_repo_id, exist_ok=True, private=is_private)
+        print(f"Repo created/retrieved: {new_repo_url}")
+
+        # Every file goes into one commit; transfers run concurrently and are recorded for resuming.
+        # Transfers start as soon as a file is added, so the split stage overlaps with uploading; the
+        # upload stage is the time spent waiting for the remaining transfers and the commit.
+        with BatchUploader(api, new_repo_id, os.path.join(temp_dir, UPLOAD_STATE_NAME), UPLOAD_WORKERS, report) as uploader:
+            upload_paths = list(existing_shards)
+            for shard_path in existing_shards:
+                uploader.add(shard_path)
+            with metrics.stage("split") if os.path.exists(split_model_flag_path) else nullcontext({}) as stage:
+                for quantized_gguf_path in quantized_gguf_paths:
+                    if os.path.exists(split_model_flag_path):
+                        max_tensors = int(open(split_tensors_path).read()) if os.path.exists(split_tensors_path) else 256
+                        max_size = open(split_size_path).read() if os.path.exists(split_size_path) else None
+                        stage["bytes"] = stage.get("bytes", 0) + os.path.getsize(quantized_gguf_path)
+                        for shard_path in split_model_file(quantized_gguf_path, max_tensors, max_size, report):
+                            uploader.add(shard_path)
+                            upload_paths.append(shard_path)
+                    else:
+                        uploader.add(quantized_gguf_path)
+                        upload_paths.append(quantized_gguf_path)
+            if state is not None and os.path.exists(split_model_flag_path):
+                state.advance("split")
+            if os.path.exists(imatrix_path):
+                uploader.add(imatrix_path, "imatrix.dat")
+                upload_paths.append(imatrix_path)
+            if os.path.exists(readme_path):
+                uploader.add(readme_path, "README.md")
+                upload_paths.append(readme_path)
+            with metrics.stage("upload") as stage:
+                stage["bytes"] = sum(os.path.getsize(p) for p in upload_paths)
+                uploader.commit(f"Upload {repo_name}")
+        with metrics.stage("cleanup") as stage:
+            stage["bytes"] = sum(f.stat().st_size for f in Path(temp_dir).rglob("*") if f.is_file())
+            shutil.rmtree(temp_dir)
+        print(f"Cleaned up temporary directory: {temp_dir}")
+        if state is not None:
+            state.advance("uploaded", "done", repo_id=new_repo_id, repo_url=str(new_repo_url))
+    except BaseException as e:
+        metrics.finish("upload", "error")
+        if state is not None and isinstance(e, Exception):
+            state.fail(str(e) or type(e).__name__)
+        raise
+    metrics.finish("upload", "ok")
+    return new_repo_id, str(new_repo_url)
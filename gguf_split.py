@@ -0,0 +1,273 @@
+import os
+import sys
+import mmap
+import struct
+import ctypes
+
+# --- NATIVE GGUF SPLITTER ---
+# A Python port of `llama-gguf-split --split`. The input is memory-mapped and tensor data is written
+# straight from the mapping (no intermediate Python bytes objects), one shard at a time, so callers can
+# start uploading a shard as soon as it is yielded. The layout follows llama-gguf-split exactly: the first
+# shard carries all metadata, every shard carries split.no / split.count / split.tensors.count, and tensor
+# data is padded to 32 bytes. Shards are written under a temporary name and renamed when complete.
+#
+# With release_input, the input's disk space is given back as the split goes: once a shard is durably on
+# disk, the blocks holding its tensor data are punched out of the input (Linux, on filesystems that
+# support it), so a split needs room for about one shard rather than a second copy of the model. The
+# input is then only good for finishing the split: a later run reuses the shards already complete and
+# writes the rest, whose data is still in place. An input with other hardlinks (e.g. a quant fetched
+# from the artifact store) is shared, so nothing is released from it.
+
+GGUF_MAGIC = b"GGUF"
+GGUF_VERSION = 3
+GGUF_DEFAULT_ALIGNMENT = 32
+COPY_CHUNK_BYTES = 64 * 1024 * 1024
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+# GGUF metadata value types
+GGUF_TYPE_UINT16 = 2
+GGUF_TYPE_INT32 = 5
+GGUF_TYPE_STRING = 8
+GGUF_TYPE_ARRAY = 9
+GGUF_SCALAR_SIZES = {0: 1, 1: 1, 2: 2, 3: 2, 4: 4, 5: 4, 6: 4, 7: 1, 10: 8, 11: 8, 12: 8}
+
+# ggml tensor types: id -> (block size, bytes per block)
+GGML_TYPE_SIZES = {
+    0: (1, 4), 1: (1, 2), 2: (32, 18), 3: (32, 20), 6: (32, 22), 7: (32, 24), 8: (32, 34), 9: (32, 36),
+    10: (256, 84), 11: (256, 110), 12: (256, 144), 13: (256, 176), 14: (256, 210), 15: (256, 292),
+    16: (256, 66), 17: (256, 74), 18: (256, 98), 19: (256, 50), 20: (32, 18), 21: (256, 110),
+    22: (256, 82), 23: (256, 136), 24: (1, 1), 25: (1, 2), 26: (1, 4), 27: (1, 8), 28: (1, 8),
+    29: (256, 56), 30: (1, 2), 34: (256, 54), 35: (256, 66), 39: (32, 17),
+}
+
+LLM_KV_SPLIT_NO = "split.no"
+LLM_KV_SPLIT_COUNT = "split.count"
+LLM_KV_SPLIT_TENSORS_COUNT = "split.tensors.count"
+
+def _pad(n: int, alignment: int) -> int:
+    return (n + alignment - 1) // alignment * alignment
+
+def parse_split_size(value: str) -> int:
+    # Same rules as llama-gguf-split's --split-max-size: an integer followed by M or G (decimal units).
+    value = value.strip()
+    units = {"M": 1000**2, "G": 1000**3}
+    if not value or value[-1] not in units:
+        raise ValueError(f"Supported units are M (megabytes) or G (gigabytes), got: {value}")
+    n = int(value[:-1])
+    if n <= 0:
+        raise ValueError(f"Split size must be positive, got: {value}")
+    return n * units[value[-1]]
+
+class GGUFReader:
+    # Parses just enough of a GGUF file to split it: the raw bytes of each metadata entry and the
+    # name, shape, type, size and absolute data offset of each tensor.
+    def __init__(self, mm):
+        self.mm = mm
+        self.pos = 0
+        if self._read(4) != GGUF_MAGIC:
+            raise ValueError("Not a GGUF file.")
+        self.version, = self._unpack("<I")
+        if self.version < 2:
+            raise ValueError(f"Unsupported GGUF version {self.version}.")
+        n_tensors, n_kv = self._unpack("<QQ")
+
+        self.kv = []  # (key, value type, raw bytes of the whole entry)
+        self.alignment = GGUF_DEFAULT_ALIGNMENT
+        for _ in range(n_kv):
+            start = self.pos
+            key = self._read_string()
+            value_type, = self._unpack("<I")
+            value_start = self.pos
+            self._skip_value(value_type)
+            if key == "general.alignment":
+                self.alignment, = struct.unpack_from("<I", self.mm, value_start)
+            self.kv.append((key, value_type, bytes(self.mm[start:self.pos])))
+
+        self.tensors = []
+        for _ in range(n_tensors):
+            name = self._read_string()
+            n_dims, = self._unpack("<I")
+            ne = list(self._unpack(f"<{n_dims}Q"))
+            ggml_type, offset = self._unpack("<IQ")
+            self.tensors.append({"name": name, "ne": ne, "type": ggml_type, "offset": offset})
+
+        data_start = _pad(self.pos, self.alignment)
+        for tensor in self.tensors:
+            tensor["nbytes"] = tensor_nbytes(tensor["ne"], tensor["type"])
+            tensor["data_offset"] = data_start + tensor["offset"]
+
+    def _read(self, n: int) -> bytes:
+        data = self.mm[self.pos:self.pos + n]
+        self.pos += n
+        return data
+
+    def _unpack(self, fmt: str) -> tuple:
+        values = struct.unpack_from(fmt, self.mm, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def _read_string(self) -> str:
+        length, = self._unpack("<Q")
+        return self._read(length).decode("utf-8")
+
+    def _skip_value(self, value_type: int):
+        if value_type == GGUF_TYPE_STRING:
+            length, = self._unpack("<Q")
+            self.pos += length
+        elif value_type == GGUF_TYPE_ARRAY:
+            item_type, count = self._unpack("<IQ")
+            if item_type in GGUF_SCALAR_SIZES:
+                self.pos += GGUF_SCALAR_SIZES[item_type] * count
+            else:
+                for _ in range(count):
+                    self._skip_value(item_type)
+        elif value_type in GGUF_SCALAR_SIZES:
+            self.pos += GGUF_SCALAR_SIZES[value_type]
+        else:
+            raise ValueError(f"Unknown GGUF value type {value_type}.")
+
+def tensor_nbytes(ne: list[int], ggml_type: int) -> int:
+    if ggml_type not in GGML_TYPE_SIZES:
+        raise ValueError(f"Unknown ggml tensor type {ggml_type}.")
+    block_size, type_size = GGML_TYPE_SIZES[ggml_type]
+    rows = 1
+    for n in ne[1:]:
+        rows *= n
+    return ne[0] // block_size * type_size * rows
+
+def _encode_string(s: str) -> bytes:
+    data = s.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+def _encode_kv(key: str, value_type: int, fmt: str, value) -> bytes:
+    return _encode_string(key) + struct.pack("<I", value_type) + struct.pack(fmt, value)
+
+def plan_splits(tensors: list[dict], max_tensors: int = 256, max_size: int | None = None) -> list[list[dict]]:
+    # Groups tensors into shards with llama-gguf-split's rules: by size, a shard is closed before the
+    # tensor that would push its padded data past max_size; otherwise every max_tensors tensors.
+    splits = [[]]
+    current_size = 0
+    for i, tensor in enumerate(tensors):
+        n_bytes = _pad(tensor["nbytes"], GGUF_DEFAULT_ALIGNMENT)
+        next_size = current_size + n_bytes
+        if max_size:
+            should_split = next_size > max_size
+        else:
+            should_split = 0 < i < len(tensors) and i % max_tensors == 0
+        if should_split:
+            if not splits[-1]:
+                raise ValueError("One of the splits has 0 tensors. Maybe the size or tensor limit is too small.")
+            splits.append([])
+            current_size = n_bytes
+        else:
+            current_size = next_size
+        splits[-1].append(tensor)
+    return splits
+
+def _shard_header(reader: GGUFReader, shard: list[dict], i_split: int, n_split: int) -> bytes:
+    # Builds the metadata block of one shard, padded to the shard's data alignment.
+    # Like gguf.cpp, setting a key moves it to the end, so the split keys follow the copied metadata
+    # and split.count (set last, once the number of shards is known) comes after split.tensors.count.
+    kv = []
+    alignment = GGUF_DEFAULT_ALIGNMENT
+    if i_split == 0:
+        split_keys = (LLM_KV_SPLIT_NO, LLM_KV_SPLIT_COUNT, LLM_KV_SPLIT_TENSORS_COUNT)
+        kv = [raw for key, _, raw in reader.kv if key not in split_keys]
+        alignment = reader.alignment
+    kv.append(_encode_kv(LLM_KV_SPLIT_NO, GGUF_TYPE_UINT16, "<H", i_split))
+    kv.append(_encode_kv(LLM_KV_SPLIT_TENSORS_COUNT, GGUF_TYPE_INT32, "<i", len(reader.tensors)))
+    kv.append(_encode_kv(LLM_KV_SPLIT_COUNT, GGUF_TYPE_UINT16, "<H", n_split))
+
+    infos = []
+    offset = 0
+    for tensor in shard:
+        ne = tensor["ne"]
+        n_dims = max((d + 1 for d in range(len(ne)) if ne[d] != 1), default=1)
+        infos.append(_encode_string(tensor["name"]) + struct.pack(f"<I{n_dims}qIQ", n_dims, *ne[:n_dims], tensor["type"], offset))
+        offset += _pad(tensor["nbytes"], alignment)
+
+    header = GGUF_MAGIC + struct.pack("<IqQ", GGUF_VERSION, len(shard), len(kv)) + b"".join(kv) + b"".join(infos)
+    return header + b"\0" * (_pad(len(header), alignment) - len(header))
+
+def _punch_hole(fd: int, offset: int, length: int) -> bool:
+    # Frees the blocks of [offset, offset + length) of fd, keeping its size. Returns False where unsupported.
+    if not sys.platform.startswith("linux") or length <= 0:
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    return libc.fallocate(fd, FALLOC_FL_KEEP_SIZE | FALLOC_FL_PUNCH_HOLE, offset, length) == 0
+
+def _release_tensors(fd: int, shard: list[dict], block: int) -> int:
+    # Punches out the whole blocks inside each tensor's data, never touching bytes of other tensors
+    # that share a block. Returns the bytes released.
+    released = 0
+    for tensor in shard:
+        start = _pad(tensor["data_offset"], block)
+        end = (tensor["data_offset"] + tensor["nbytes"]) // block * block
+        if end > start:
+            if not _punch_hole(fd, start, end - start):
+                return released
+            released += end - start
+    return released
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def shard_path(prefix: str, i_split: int, n_split: int) -> str:
+    return f"{prefix}-{i_split + 1:05d}-of-{n_split:05d}.gguf"
+
+def split_gguf(input_path: str, output_prefix: str, max_tensors: int = 256, max_size: str | int | None = None, on_progress=None, release_input: bool = False):
+    # Splits input_path into shards named like llama-gguf-split's, yielding each shard path once it is
+    # complete on disk. Shards already complete from an earlier run with the same settings are reused.
+    if isinstance(max_size, str):
+        max_size = parse_split_size(max_size) if max_size.strip() else None
+    with open(input_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        reader = GGUFReader(mm)
+        splits = plan_splits(reader.tensors, max_tensors, max_size)
+        print(f"Splitting {os.path.basename(input_path)}: {len(reader.tensors)} tensors into {len(splits)} shards")
+        release_fd = os.open(input_path, os.O_WRONLY) if release_input and sys.platform.startswith("linux") else None
+        if release_fd is not None and os.fstat(release_fd).st_nlink > 1:
+            print(f"Not releasing {os.path.basename(input_path)} while splitting: it is hardlinked elsewhere.")
+            os.close(release_fd)
+            release_fd = None
+        block = max(os.fstat(f.fileno()).st_blksize, mmap.PAGESIZE)
+        released = 0
+        try:
+            with memoryview(mm) as view:
+                for i_split, shard in enumerate(splits):
+                    path = shard_path(output_prefix, i_split, len(splits))
+                    if os.path.exists(path):
+                        print(f"Reusing {os.path.basename(path)} from an earlier split.")
+                    else:
+                        header = _shard_header(reader, shard, i_split, len(splits))
+                        tmp_path = f"{path}.partial"
+                        with open(tmp_path, "wb") as out:
+                            out.write(header)
+                            for tensor in shard:
+                                start, n_bytes = tensor["data_offset"], tensor["nbytes"]
+                                for chunk_start in range(start, start + n_bytes, COPY_CHUNK_BYTES):
+                                    out.write(view[chunk_start:min(chunk_start + COPY_CHUNK_BYTES, start + n_bytes)])
+                                # llama-gguf-split always pads tensor data with the default alignment
+                                out.write(b"\0" * (_pad(n_bytes, GGUF_DEFAULT_ALIGNMENT) - n_bytes))
+                            if release_fd is not None:
+                                # The shard must survive a crash before its data leaves the input.
+                                out.flush()
+                                os.fsync(out.fileno())
+                        os.replace(tmp_path, path)
+                    if release_fd is not None:
+                        # The shard's name must be durable too, or a crash could lose it after its data left the input.
+                        _fsync_dir(os.path.dirname(os.path.abspath(path)))
+                        released += _release_tensors(release_fd, shard, block)
+                    if on_progress:
+                        on_progress((i_split + 1) / len(splits), f"Splitting ({i_split + 1}/{len(splits)} shards)")
+                    yield path
+        finally:
+            if release_fd is not None:
+                os.close(release_fd)
+        if released:
+            print(f"Released {released / 1024**3:.2f} GB of {os.path.basename(input_path)} while splitting.")
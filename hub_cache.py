@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from types import SimpleNamespace
+from huggingface_hub import hf_hub_download, whoami
+
+# --- HUB METADATA CACHE ---
+# Caches the Hub metadata a job needs (the caller's identity, a model's current revision, its file
+# listing, model card and parameter summary) so repeated jobs on the same model make no Hub calls.
+# The revision is the only thing that expires on a timer; everything else is stored per revision and
+# so is invalidated as soon as a new upstream commit is seen. Identities are kept in memory only, keyed
+# by a hash of the token. All Hub access goes through the `api` object passed in (an HfApi or any
+# object with the same methods), so the cache can be exercised against a local fake Hub.
+#
+# Gated and private repos are only visible to some tokens, so the revision lookup, which is also the
+# access check, is cached per token hash: a token that cannot see a repo gets the Hub's answer, never
+# another user's cached copy. Per-revision entries are shared, since only a token that passed the
+# check learns the revision they are stored under; "latest" entries are per token as well.
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _lfs_field(lfs, name: str):
+    return lfs.get(name) if isinstance(lfs, dict) else getattr(lfs, name, None)
+
+def _tree_to_json(repo_tree) -> list[dict]:
+    entries = []
+    for f in repo_tree:
+        lfs = getattr(f, "lfs", None)
+        entries.append({
+            "path": f.path,
+            "size": getattr(f, "size", None),
+            "lfs": {"size": _lfs_field(lfs, "size"), "sha256": _lfs_field(lfs, "sha256")} if lfs else None,
+        })
+    return entries
+
+def _tree_from_json(entries: list[dict]) -> list:
+    return [SimpleNamespace(**entry) for entry in entries]
+
+def _token_key(token: str | None) -> str:
+    return _digest(token or "anonymous")[:16]
+
+class HubMetadataCache:
+    def __init__(self, root: str, revision_ttl: float = 300, identity_ttl: float = 3600, clock=time.time, whoami_fn=whoami):
+        self.root = root
+        self.revision_ttl = revision_ttl
+        self.identity_ttl = identity_ttl
+        self.clock = clock
+        self.whoami_fn = whoami_fn
+        self._identities = {}
+        self._lock = threading.Lock()
+
+    # --- Storage ---
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.root, kind, f"{_digest(key)[:32]}.json")
+
+    def _read(self, kind: str, key: str) -> dict | None:
+        try:
+            with open(self._path(kind, key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry if entry.get("key") == key else None
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, kind: str, key: str, value):
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "fetched": self.clock(), "value": value}, f)
+        os.replace(tmp_path, path)
+
+    def _cached(self, kind: str, key: str, fetch, ttl: float | None = None):
+        # Returns the stored value for key, calling fetch() when it is missing or older than ttl
+        # (None = never expires). If the Hub cannot be reached, an expired value is better than none;
+        # an actual HTTP answer (e.g. access denied) is never papered over.
+        entry = self._read(kind, key)
+        if entry is not None and (ttl is None or self.clock() - entry["fetched"] < ttl):
+            return entry["value"]
+        try:
+            value = fetch()
+        except Exception as e:
+            if entry is None or getattr(e, "response", None) is not None:
+                raise
+            print(f"Hub request for {kind} '{key}' failed ({e}); using the cached copy.")
+            return entry["value"]
+        self._write(kind, key, value)
+        return value
+
+    # --- Public API ---
+
+    def identity(self, token: str) -> dict:
+        # whoami() for token, remembered in memory for identity_ttl seconds.
+        key = _digest(token)
+        with self._lock:
+            cached = self._identities.get(key)
+            if cached and self.clock() - cached[0] < self.identity_ttl:
+                return cached[1]
+        info = self.whoami_fn(token=token)
+        with self._lock:
+            self._identities[key] = (self.clock(), info)
+        return info
+
+    def revision(self, model_id: str, api) -> str | None:
+        # The model's current commit sha as seen with api's token, re-checked with the Hub at most every
+        # revision_ttl seconds.
+        return self._cached("revision", f"{model_id}#{_token_key(getattr(api, 'token', None))}", lambda: api.model_info(model_id).sha, self.revision_ttl)
+
+    def repo_tree(self, model_id: str, api, revision: str | None = None) -> list:
+        # Recursive file listing of the model at revision (entries have path, size and lfs).
+        fetch = lambda: _tree_to_json(api.list_repo_tree(repo_id=model_id, recursive=True, revision=revision))
+        if revision is None:
+            return _tree_from_json(self._cached("tree", f"{model_id}@latest#{_token_key(getattr(api, 'token', None))}", fetch, self.revision_ttl))
+        return _tree_from_json(self._cached("tree", f"{model_id}@{revision}", fetch))
+
+    def model_card_text(self, model_id: str, token: str | None = None, revision: str | None = None) -> str:
+        # Raw README.md of the model at revision.
+        def fetch():
+            with open(hf_hub_download(repo_id=model_id, filename="README.md", revision=revision, token=token), "r", encoding="utf-8") as f:
+                return f.read()
+        if revision is None:
+            return self._cached("card", f"{model_id}@latest#{_token_key(token)}", fetch, self.revision_ttl)
+        return self._cached("card", f"{model_id}@{revision}", fetch)
+
+    def per_revision(self, kind: str, model_id: str, revision: str | None, fetch):
+        # Caches any JSON-serializable derived value (e.g. a parameter summary) per model revision.
+        if revision is None:
+            return fetch()
+        return self._cached(kind, f"{model_id}@{revision}", fetch)
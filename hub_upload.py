@@ -0,0 +1,102 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from huggingface_hub import CommitOperationAdd
+
+# --- BATCHED, RESUMABLE HUB UPLOADS ---
+# All files of a job go into a single commit. Large files are pre-uploaded to LFS storage concurrently
+# as soon as they are added, and each finished transfer is recorded in a state file next to the job's
+# outputs. If the upload is interrupted, the next attempt skips the files already recorded (the Hub
+# also deduplicates LFS objects it already holds) and only the commit itself is retried.
+#
+# Use the uploader as a context manager, so its transfer threads are stopped even when preparing the
+# files fails before commit().
+
+UPLOAD_STATE_NAME = "upload_state.json"
+
+class BatchUploader:
+    def __init__(self, api, repo_id: str, state_path: str, max_workers: int = 4, on_progress=None):
+        self.api = api
+        self.repo_id = repo_id
+        self.state_path = state_path
+        self.on_progress = on_progress
+        self.operations = []
+        self._futures = []
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._done = 0
+        self._total = 0
+        self.state = self._load_state()
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("repo_id") == self.repo_id:
+                return state
+        except (OSError, ValueError):
+            pass
+        return {"repo_id": self.repo_id, "uploaded": {}}
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def _signature(self, local_path: str) -> list:
+        st = os.stat(local_path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def _report(self, desc: str):
+        if self.on_progress:
+            self.on_progress(self._done / self._total if self._total else None, desc)
+
+    def _prepare_and_upload(self, local_path: str, path_in_repo: str):
+        # Hashing happens here, in the pool, so large files are hashed and transferred in parallel.
+        operation = CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=local_path)
+        signature = self._signature(local_path)
+        with self._lock:
+            already_uploaded = self.state["uploaded"].get(path_in_repo) == signature
+        if already_uploaded:
+            # Transferred by an earlier attempt; create_commit only re-checks it with the Hub.
+            print(f"Skipping {path_in_repo}: already uploaded by a previous attempt.")
+        else:
+            self.api.preupload_lfs_files(self.repo_id, additions=[operation])
+            print(f"Uploaded {path_in_repo}")
+        with self._lock:
+            self.state["uploaded"][path_in_repo] = signature
+            self._save_state()
+            self.operations.append(operation)
+            self._done += 1
+            self._report(f"Uploaded {path_in_repo} ({self._done}/{self._total} files)")
+
+    def add(self, local_path: str, path_in_repo: str | None = None):
+        # Queues a file for the commit and starts transferring it right away.
+        with self._lock:
+            self._total += 1
+        self._futures.append(self._pool.submit(self._prepare_and_upload, local_path, path_in_repo or os.path.basename(local_path)))
+
+    def commit(self, commit_message: str):
+        # Waits for all transfers, then publishes every file in one commit.
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self.close()
+        self._report(f"Creating commit with {len(self.operations)} files")
+        commit_info = self.api.create_commit(repo_id=self.repo_id, operations=self.operations, commit_message=commit_message)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return commit_info
+
+    def close(self):
+        # Cancels transfers that have not started and waits for the running ones. Safe to call twice.
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,188 @@
+import os
+import re
+import shutil
+import struct
+import threading
+import contextvars
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from process_runner import run_streaming, imatrix_progress
+from cpu_tuning import untuned_slot, size_bucket
+from system_info import get_effective_cpu_count
+
+# --- PARALLEL IMATRIX ---
+# llama-imatrix evaluates the calibration text one context-sized chunk at a time, and the matrix is a
+# sum over chunks: for every tensor it stores the accumulated squared activations and the number of
+# calls (ncall) that contributed. The corpus can therefore be cut into parts, each part run by its own
+# llama-imatrix process with a few threads, and the partial files summed. All workers mmap the same
+# fp16 model, so they share its pages. The result equals a single-process run except at the seams:
+# each worker drops its own trailing partial chunk, which is why parts are kept large.
+#
+# Partial files in the legacy imatrix.dat layout are merged here. Anything else (e.g. GGUF imatrix
+# files from newer builds) is merged by llama-imatrix itself with --in-file.
+
+GGUF_MAGIC = b"GGUF"
+
+def read_imatrix(path: str) -> tuple[dict, int, str]:
+    # Reads a legacy imatrix.dat: {name: (ncall, values)}, the chunk count and the dataset name.
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    def unpack(fmt):
+        nonlocal offset
+        values = struct.unpack_from(fmt, data, offset)
+        offset += struct.calcsize(fmt)
+        return values
+    entries = {}
+    (n_entries,) = unpack("<i")
+    for _ in range(n_entries):
+        (name_len,) = unpack("<i")
+        name = data[offset:offset + name_len].decode("utf-8")
+        offset += name_len
+        ncall, nval = unpack("<ii")
+        values = array("f")
+        values.frombytes(data[offset:offset + 4 * nval])
+        offset += 4 * nval
+        entries[name] = (ncall, values)
+    last_chunk, dataset = 0, ""
+    if offset < len(data):
+        (last_chunk,) = unpack("<i")
+        if offset < len(data):
+            (dataset_len,) = unpack("<i")
+            dataset = data[offset:offset + dataset_len].decode("utf-8", errors="replace")
+    return entries, last_chunk, dataset
+
+def write_imatrix(path: str, entries: dict, last_chunk: int, dataset: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<i", len(entries)))
+        for name, (ncall, values) in entries.items():
+            encoded = name.encode("utf-8")
+            f.write(struct.pack("<i", len(encoded)) + encoded + struct.pack("<ii", ncall, len(values)))
+            f.write(values.tobytes())
+        encoded = dataset.encode("utf-8")
+        f.write(struct.pack("<ii", last_chunk, len(encoded)) + encoded)
+    os.replace(tmp_path, path)
+
+def merge_imatrix(paths: list[str], output_path: str, dataset: str | None = None):
+    # Sums legacy imatrix files the way llama-imatrix --in-file does: the stored values are already
+    # weighted by ncall, so values and ncall simply add up.
+    merged, total_chunks, first_dataset = {}, 0, None
+    for path in paths:
+        entries, last_chunk, part_dataset = read_imatrix(path)
+        total_chunks += last_chunk
+        first_dataset = first_dataset or part_dataset
+        for name, (ncall, values) in entries.items():
+            if name not in merged:
+                merged[name] = (ncall, values)
+                continue
+            merged_ncall, merged_values = merged[name]
+            if len(merged_values) != len(values):
+                raise ValueError(f"imatrix entry {name} has {len(values)} values in {path}, expected {len(merged_values)}")
+            merged[name] = (merged_ncall + ncall, array("f", map(float.__add__, merged_values, values)))
+    write_imatrix(output_path, merged, total_chunks, dataset or first_dataset or "")
+
+def is_legacy_imatrix(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(4) != GGUF_MAGIC
+
+def split_corpus(train_data_path: str, out_dir: str, parts: int) -> list[str]:
+    # Cuts the calibration text into parts of about equal size, on line boundaries.
+    with open(train_data_path, "rb") as f:
+        data = f.read()
+    paths, start = [], 0
+    for i in range(parts):
+        end = len(data) if i == parts - 1 else data.find(b"\n", max(start, len(data) * (i + 1) // parts))
+        end = len(data) if end < 0 else end + 1
+        if end > start:
+            path = os.path.join(out_dir, f"part-{i:03d}.txt")
+            with open(path, "wb") as f:
+                f.write(data[start:end])
+            paths.append(path)
+        start = end
+    return paths
+
+def plan_workers(n_threads: int, corpus_bytes: int, threads_per_worker: int, max_workers: int = 0, min_part_bytes: int = 64 * 1024) -> tuple[int, int]:
+    # Returns (workers, threads per worker): as many workers as the threads allow, while every part
+    # stays large enough that the chunks lost at the seams are negligible.
+    workers = max(1, n_threads // max(1, threads_per_worker))
+    workers = min(workers, max(1, corpus_bytes // min_part_bytes))
+    if max_workers > 0:
+        workers = min(workers, max_workers)
+    return workers, max(1, n_threads // workers)
+
+class _CombinedProgress:
+    # Adds up the chunk counters of all workers into one progress report (same output lines as
+    # process_runner.imatrix_progress parses for a single run).
+    def __init__(self, workers: int):
+        self.done = [0] * workers
+        self.total = [0] * workers
+        self._lock = threading.Lock()
+
+    def worker(self, index: int):
+        def parse(text: str, complete: bool):
+            with self._lock:
+                if m := re.search(r"computing over (\d+) chunks", text):
+                    self.total[index] = int(m.group(1))
+                elif self.total[index] and (chunks := re.findall(r"\[(\d+)\]", text)):
+                    self.done[index] = min(int(chunks[-1]), self.total[index])
+                else:
+                    return None
+                done, total = sum(self.done), sum(self.total)
+                # Until every worker has announced its chunk count, the total is still growing.
+                fraction = min(done / total, 1.0) if all(self.total) else None
+            return fraction, f"Computing imatrix ({done}/{total} chunks)"
+        return parse
+
+def compute_imatrix(executable: str, model_path: str, train_data_path: str, output_path: str, extra_args: list[str] | None = None, n_threads: int | None = None, threads_per_worker: int = 4, max_workers: int = 0, on_progress=None, cpu_slot=untuned_slot):
+    # Computes the importance matrix of model_path over train_data_path with parallel llama-imatrix
+    # workers and writes the merged result to output_path. cpu_slot(executable, threads, workload) places
+    # each worker on its CPUs and picks its thread count (see cpu_tuning.py); runs are compared per model
+    # size bucket.
+    extra_args = list(extra_args or [])
+    n_threads = n_threads or get_effective_cpu_count()
+    workers, threads_each = plan_workers(n_threads, os.path.getsize(train_data_path), threads_per_worker, max_workers)
+
+    def run(corpus: str, out: str, progress_parser) -> tuple[int, str]:
+        with cpu_slot(executable, threads_each, size_bucket(os.path.getsize(model_path))) as slot:
+            cmd = [executable, "-m", model_path, "-f", corpus, "-o", out, *extra_args, "-t", str(slot.threads)]
+            returncode, output = run_streaming(cmd, progress_parser, on_progress, affinity=slot.cpus)
+            if returncode == 0:
+                # Text processed per GB of model, so runs on models in the same size bucket compare.
+                slot.units = os.path.getsize(corpus) * os.path.getsize(model_path) / 1024**3
+        return returncode, output
+
+    if workers == 1:
+        print(f"Running imatrix with {threads_each} thread(s)...")
+        returncode, output = run(train_data_path, output_path, imatrix_progress())
+        if returncode != 0:
+            raise Exception(f"Imatrix generation failed:\n{output}")
+        return
+
+    parts_dir = f"{output_path}.parts"
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir)
+    try:
+        parts = split_corpus(train_data_path, parts_dir, workers)
+        print(f"Running imatrix on {len(parts)} corpus parts with {threads_each} thread(s) each...")
+        progress = _CombinedProgress(len(parts))
+        outputs = [f"{part[:-len('.txt')]}.imatrix" for part in parts]
+        with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, run, part, out, progress.worker(i)) for i, (part, out) in enumerate(zip(parts, outputs))]
+            results = [f.result() for f in futures]
+        errors = [output for returncode, output in results if returncode != 0]
+        if errors:
+            raise Exception("Imatrix generation failed:\n" + "\n\n".join(errors))
+
+        if all(is_legacy_imatrix(out) for out in outputs):
+            merge_imatrix(outputs, output_path, os.path.basename(train_data_path))
+        else:
+            merge_cmd = [executable, "-m", model_path, "-o", output_path]
+            for out in outputs:
+                merge_cmd.extend(["--in-file", out])
+            returncode, output = run_streaming(merge_cmd)
+            if returncode != 0:
+                raise Exception(f"Merging the partial imatrix files failed:\n{output}")
+        print(f"Merged {len(outputs)} partial imatrix files into {output_path}.")
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
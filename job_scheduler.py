@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from contextlib import contextmanager
+from system_info import get_effective_cpu_count, get_usable_memory_bytes
+
+# --- RESOURCE-AWARE JOB SCHEDULER ---
+# Jobs declare how much RAM, scratch disk and CPU they need. As many jobs run at once as the machine
+# can hold; the rest wait in a bounded backlog that is served fairly across users (the user with the
+# fewest running jobs goes first, then oldest first). The backlog is mirrored to disk so operators can
+# see what was waiting when the process went down. A user over the per-user cap is turned away, unless
+# the scheduler waits for user slots (the batch runner, where every job belongs to one user): then the
+# job waits, outside the backlog, until one of the user's jobs finishes.
+#
+# Before a restart the scheduler is drained (see restart_policy.py): nothing new is admitted, waiting
+# jobs are turned away with SchedulerDraining, and running jobs that call checkpoint() between stages
+# stop there.
+
+STARVATION_SECONDS = 900
+WEIGHT_EXTENSIONS = (".safetensors", ".bin", ".pt", ".pth")
+
+class SchedulerFull(Exception):
+    pass
+
+class SchedulerDraining(SchedulerFull):
+    # The app is about to restart. Jobs with durable state pause and resume after the restart.
+    pass
+
+def estimate_job_needs(repo_tree, n_quants: int = 1, use_imatrix: bool = False) -> dict:
+    # Rough per-job needs from the size of the source weights. The fp16 GGUF is about the size of
+    # 16-bit source weights, imatrix loads the whole fp16 into RAM, and each quant adds at most half
+    # the fp16 size on disk.
+    weights = sum(f.size or 0 for f in repo_tree or [] if f.path.endswith(WEIGHT_EXTENSIONS) and getattr(f, "size", None))
+    fp16 = weights
+    ram = max(fp16 if use_imatrix else fp16 // 4, 2 * 1024**3)
+    outputs = fp16 + n_quants * fp16 // 2
+    return {"ram": ram, "disk": weights + outputs, "outputs": outputs, "cpus": 1}
+
+def machine_capacity() -> dict:
+    # What the scheduler may hand out: RAM and CPUs, within the container's limits. Disk is checked live at admission.
+    return {"ram": get_usable_memory_bytes() or 16 * 1024**3, "cpus": get_effective_cpu_count()}
+
+class ResourceScheduler:
+    def __init__(self, capacity: dict, disk_root: str = ".", backlog_path: str | None = None, max_backlog: int = 50, max_per_user: int = 5, cpus_per_job: int | None = None, wait_for_user_slot: bool = False):
+        self.capacity = dict(capacity)
+        self.available = dict(capacity)
+        self.disk_root = disk_root
+        self.backlog_path = backlog_path
+        self.max_backlog = max_backlog
+        self.max_per_user = max_per_user
+        self.wait_for_user_slot = wait_for_user_slot
+        self.cpus_per_job = cpus_per_job or max(1, self.capacity["cpus"] // 4)
+        self.waiting = []
+        self.running = {}
+        self.draining = False
+        self._cond = threading.Condition()
+        self._load_backlog()
+
+    # --- Persistence ---
+
+    def _load_backlog(self):
+        # Jobs left waiting by a previous process cannot be resumed here (their session is gone); report them.
+        if not self.backlog_path or not os.path.exists(self.backlog_path):
+            return
+        try:
+            with open(self.backlog_path, "r", encoding="utf-8") as f:
+                stale = json.load(f).get("waiting", [])
+        except (OSError, ValueError):
+            stale = []
+        for job in stale:
+            print(f"Job {job['id']} ({job.get('label')}) for user {job['user']} was waiting when the app stopped and was dropped.")
+        self._save_backlog()
+
+    def _save_backlog(self):
+        if not self.backlog_path:
+            return
+        state = {
+            "waiting": [{k: job[k] for k in ("id", "user", "label", "needs", "enqueued")} for job in self.waiting],
+            "running": [{k: job[k] for k in ("id", "user", "label", "needs", "started")} for job in self.running.values()],
+        }
+        tmp_path = f"{self.backlog_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, self.backlog_path)
+
+    # --- Admission ---
+
+    def _clamp(self, needs: dict) -> dict:
+        needs = {"ram": 0, "disk": 0, **needs}
+        needs["cpus"] = max(needs.get("cpus") or 0, self.cpus_per_job)
+        for k in self.capacity:
+            needs[k] = min(needs[k], self.capacity[k])
+        return needs
+
+    def _fits(self, needs: dict) -> bool:
+        # A job that does not fit the idle machine still runs, alone, and fails on its own terms.
+        if not self.running:
+            return True
+        # Running jobs may not have written their scratch files yet, so their whole disk estimate stays reserved.
+        reserved_disk = sum(job["needs"]["disk"] for job in self.running.values())
+        if shutil.disk_usage(self.disk_root).free - reserved_disk < needs["disk"]:
+            return False
+        return all(self.available[k] >= needs[k] for k in self.capacity)
+
+    def _fair_order(self) -> list:
+        running_per_user = {}
+        for job in self.running.values():
+            running_per_user[job["user"]] = running_per_user.get(job["user"], 0) + 1
+        return sorted(self.waiting, key=lambda job: (running_per_user.get(job["user"], 0), job["enqueued"]))
+
+    def _admit_waiting(self):
+        # Admits every waiting job that fits, in fair order. A job that has waited too long reserves
+        # the machine: nothing behind it is admitted until it runs.
+        for job in [] if self.draining else self._fair_order():
+            if self._fits(job["needs"]):
+                self.waiting.remove(job)
+                for k in self.capacity:
+                    self.available[k] -= job["needs"][k]
+                job["started"] = time.time()
+                self.running[job["id"]] = job
+            elif time.time() - job["enqueued"] > STARVATION_SECONDS:
+                break
+        self._save_backlog()
+        self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, user: str, needs: dict, label: str = ""):
+        # Blocks until the job fits, then yields its grant (including the number of CPUs it may use).
+        job = {"id": uuid.uuid4().hex[:12], "user": user, "label": label, "needs": self._clamp(needs), "enqueued": time.time()}
+        with self._cond:
+            while True:
+                if self.draining:
+                    raise SchedulerDraining("The app is restarting. Please try again in a few minutes.")
+                if sum(1 for j in self.waiting + list(self.running.values()) if j["user"] == user) < self.max_per_user:
+                    break
+                if not self.wait_for_user_slot:
+                    raise SchedulerFull(f"You already have {self.max_per_user} jobs queued or running. Please wait for one to finish.")
+                self._cond.wait()
+            if len(self.waiting) >= self.max_backlog:
+                raise SchedulerFull("The job queue is full. Please try again later.")
+            self.waiting.append(job)
+            print(f"Job {job['id']} ({label}) queued for {user}: needs {format_needs(job['needs'])}.")
+            self._admit_waiting()
+            while job["id"] not in self.running:
+                if self.draining:
+                    self.waiting.remove(job)
+                    self._save_backlog()
+                    raise SchedulerDraining("The app is restarting. Please try again in a few minutes.")
+                self._cond.wait()
+        print(f"Job {job['id']} ({label}) started after {time.time() - job['enqueued']:.0f}s in queue.")
+        try:
+            yield dict(job["needs"])
+        finally:
+            with self._cond:
+                del self.running[job["id"]]
+                for k in self.capacity:
+                    self.available[k] += job["needs"][k]
+                self._admit_waiting()
+
+    # --- Draining ---
+
+    def drain(self):
+        # Stops admitting jobs and turns the waiting ones away; running jobs finish or stop at a checkpoint.
+        with self._cond:
+            self.draining = True
+            self._cond.notify_all()
+
+    def resume(self):
+        with self._cond:
+            self.draining = False
+            self._admit_waiting()
+
+    def checkpoint(self):
+        # Called by running jobs between stages: raises SchedulerDraining if they should stop here.
+        if self.draining:
+            raise SchedulerDraining("The app is restarting.")
+
+    def status(self) -> dict:
+        with self._cond:
+            reserved_disk = sum(job["needs"]["disk"] for job in self.running.values())
+            # The part of it that goes to outputs/ (the rest is model downloads).
+            reserved_outputs = sum(job["needs"].get("outputs", job["needs"]["disk"]) for job in self.running.values())
+            return {"running": len(self.running), "waiting": len(self.waiting), "available": dict(self.available), "reserved_disk": reserved_disk, "reserved_outputs": reserved_outputs, "draining": self.draining}
+
+def format_needs(needs: dict) -> str:
+    return f"{needs.get('ram', 0) / 1024**3:.1f} GB RAM, {needs.get('disk', 0) / 1024**3:.1f} GB disk, {needs.get('cpus', 0)} CPUs"
@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import time
+import threading
+from filelock import FileLock, Timeout
+
+# --- DURABLE JOB STATE ---
+# Every job is a small state machine persisted in outputs/jobs/<job id>.json next to its working
+# directory outputs/<job id>. A stage is recorded only once its artifacts are on disk, so after a crash
+# or a Space restart the job resumes from the last completed stage instead of starting over. The record
+# outlives the working directory, so a finished job still reports where it was uploaded.
+#
+#   created -> downloaded -> converted -> imatrix -> quantized -> split -> uploaded
+#
+# The status says what the job is doing within its stage: "running", "paused" (stopped at a checkpoint
+# for a restart), "failed", "awaiting_upload", "uploading", "done" or "expired" (files removed by the
+# outputs reaper, see outputs_reaper.py). A record that says "running", "paused" or "uploading" but has
+# no live worker was interrupted.
+#
+# Work on a job happens under its job_lock, which also holds an OS file lock on outputs/jobs/<id>.lock.
+# Processes sharing outputs/ (the web app and a batch run, say) therefore never work on the same job at
+# once, and a lock left by a process that died is released by the OS.
+
+STAGES = ("created", "downloaded", "converted", "imatrix", "quantized", "split", "uploaded")
+JOBS_DIR = os.path.join("outputs", "jobs")
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+_job_locks = {}
+_job_locks_lock = threading.Lock()
+
+class JobBusy(Exception):
+    pass
+
+class JobLock:
+    # Threads of this process wait for each other, re-entrantly (e.g. a user resuming a job the startup
+    # resume is already running). The outermost holder also takes the job's file lock; if another process
+    # holds it, entering raises JobBusy instead of waiting.
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(os.path.join(JOBS_DIR, f"{job_id}.lock"), timeout=0)
+        self._depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(JOBS_DIR, exist_ok=True)
+                self._file_lock.acquire()
+            except Timeout:
+                self._lock.release()
+                raise JobBusy(f"Job '{self.job_id}' is being worked on by another process.") from None
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            self._file_lock.release()
+        self._lock.release()
+
+def job_lock(job_id: str) -> JobLock:
+    with _job_locks_lock:
+        return _job_locks.setdefault(job_id, JobLock(job_id))
+
+class JobState:
+    def __init__(self, record: dict):
+        self.record = record
+
+    @property
+    def job_id(self) -> str:
+        return self.record["job_id"]
+
+    @property
+    def job_dir(self) -> str:
+        return os.path.join("outputs", self.job_id)
+
+    @property
+    def stage(self) -> str:
+        return self.record["stage"]
+
+    @property
+    def status(self) -> str:
+        return self.record["status"]
+
+    @property
+    def params(self) -> dict:
+        return self.record["params"]
+
+    @property
+    def artifacts(self) -> dict:
+        return self.record["artifacts"]
+
+    @staticmethod
+    def path_for(job_id: str) -> str:
+        return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+    @classmethod
+    def create(cls, job_dir: str, owner: str, **params) -> "JobState":
+        now = time.time()
+        state = cls({
+            "job_id": os.path.basename(os.path.normpath(job_dir)),
+            "owner": owner,
+            "params": params,
+            "stage": "created",
+            "status": "running",
+            "artifacts": {},
+            "error": None,
+            "created": now,
+            "updated": now,
+            "history": [{"stage": "created", "at": now}],
+        })
+        state.save()
+        return state
+
+    @classmethod
+    def load(cls, job_id: str) -> "JobState | None":
+        # Returns None for unknown ids; ids are checked so they cannot name paths outside JOBS_DIR.
+        if not job_id or not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(cls.path_for(job_id), "r", encoding="utf-8") as f:
+                return cls(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def save(self):
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        path = self.path_for(self.job_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.record, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def reached(self, stage: str) -> bool:
+        return STAGES.index(self.stage) >= STAGES.index(stage)
+
+    def advance(self, stage: str, status: str | None = None, **artifacts):
+        # Records a completed stage (never moving backwards) and the artifacts it produced.
+        if not self.reached(stage):
+            self.record["stage"] = stage
+            self.record["history"].append({"stage": stage, "at": time.time()})
+        self.record["artifacts"].update(artifacts)
+        self.set_status(status or self.status)
+
+    def set_status(self, status: str, error: str | None = None):
+        self.record["status"] = status
+        self.record["error"] = error
+        self.record["updated"] = time.time()
+        self.save()
+
+    def fail(self, error: str):
+        self.set_status("failed", error)
+
+    def delete(self):
+        try:
+            os.remove(self.path_for(self.job_id))
+        except FileNotFoundError:
+            pass
+
+def list_jobs() -> list[JobState]:
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    states = (JobState.load(f[:-len(".json")]) for f in sorted(os.listdir(JOBS_DIR)) if f.endswith(".json"))
+    return [s for s in states if s is not None]
+
+def interrupted_jobs() -> list[JobState]:
+    # Jobs that were mid-run when the process stopped. Call this at startup, before any job starts.
+    return [s for s in list_jobs() if s.status in ("running", "paused", "uploading") and os.path.isdir(s.job_dir)]
+
+def describe(state: JobState) -> str:
+    text = f"Job {state.job_id}: {state.params.get('model_id')} [{', '.join(state.params.get('quant_methods', []))}], stage '{state.stage}', {state.status}"
+    if state.artifacts.get("repo_url"):
+        text += f", uploaded to {state.artifacts['repo_url']}"
+    if state.record.get("error"):
+        text += f" ({state.record['error'].splitlines()[0]})"
+    return text
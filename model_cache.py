@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import fnmatch
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from filelock import FileLock
+from artifact_store import file_sha256
+from storage import link_or_copy, format_savings
+
+# --- MODEL CACHE ---
+# Each cached model lives in <root>/<org>__<name> with a manifest recording the upstream revision and
+# the size (and, for LFS files, sha256) of every file. Entries are revalidated against the Hub on use,
+# and least-recently-used entries are evicted when the cache exceeds its disk budget. Jobs hold a lease
+# on the entry they are converting so it can never be evicted from under them.
+# Files are downloaded into the Hugging Face hub cache and reflinked or hardlinked into the entry, so
+# a model that is already in the hub cache costs neither a download nor a second copy on disk. The
+# entry owns the hub cache revision it was placed from: refreshing or evicting the entry deletes that
+# revision too, and the entry's size is the disk both use together.
+
+SENTINEL_NAME = ".download_complete"
+MANIFEST_NAME = ".cache_manifest.json"
+LEASES_DIR_NAME = ".leases"
+
+def _pid_alive(pid: int) -> bool:
+    # Checks whether a process holding a lease is still running.
+    if pid == os.getpid():
+        return True
+    if sys.platform == "win32":
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _disk_usage(paths) -> int:
+    # Bytes used by the given files, counting every inode once, so a hardlinked model file and its hub
+    # cache blob are one copy. Reflinked copies share blocks without sharing an inode and count twice.
+    inodes = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        inodes[(st.st_dev, st.st_ino)] = st.st_size
+    return sum(inodes.values())
+
+def _list_files(local_dir: Path) -> list[str]:
+    # Lists model files relative to local_dir, skipping cache bookkeeping (dot files and folders).
+    files = []
+    for root, dirs, names in os.walk(local_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if not name.startswith("."):
+                files.append(os.path.relpath(os.path.join(root, name), local_dir).replace(os.sep, "/"))
+    return sorted(files)
+
+class ModelCache:
+    def __init__(self, root: str, max_bytes: int, verify_hashes: bool = False, hub_cache_dir: str | None = None):
+        self.root = Path(root)
+        self.hub_cache_dir = hub_cache_dir
+        self.max_bytes = max_bytes
+        self.verify_hashes = verify_hashes
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+
+    def entry_dir(self, model_id: str) -> Path:
+        # Sanitize the model_id to create a valid directory name (e.g., "google/gemma-2b" -> "google__gemma-2b")
+        return self.root / model_id.replace("/", "__")
+
+    def _read_manifest(self, local_dir: Path) -> dict | None:
+        try:
+            with open(local_dir / MANIFEST_NAME, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, local_dir: Path, manifest: dict):
+        tmp_path = local_dir / f"{MANIFEST_NAME}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, local_dir / MANIFEST_NAME)
+
+    # --- Leases ---
+
+    def _lease_dir(self, local_dir: Path) -> Path:
+        return self.root / LEASES_DIR_NAME / local_dir.name
+
+    def _acquire_lease(self, local_dir: Path) -> Path:
+        lease_dir = self._lease_dir(local_dir)
+        lease_dir.mkdir(parents=True, exist_ok=True)
+        lease_path = lease_dir / f"{os.getpid()}-{uuid.uuid4().hex}"
+        lease_path.touch()
+        with self._leases_lock:
+            self._leases[local_dir.name] = self._leases.get(local_dir.name, 0) + 1
+        return lease_path
+
+    def _release_lease(self, local_dir: Path, lease_path: Path):
+        with self._leases_lock:
+            self._leases[local_dir.name] -= 1
+            if self._leases[local_dir.name] <= 0:
+                del self._leases[local_dir.name]
+        lease_path.unlink(missing_ok=True)
+
+    def is_leased(self, local_dir: Path) -> bool:
+        # True if any live job, in this or another process, is using the entry. Stale leases are removed.
+        with self._leases_lock:
+            if self._leases.get(local_dir.name):
+                return True
+        lease_dir = self._lease_dir(local_dir)
+        if not lease_dir.exists():
+            return False
+        leased = False
+        for lease_path in lease_dir.iterdir():
+            try:
+                pid = int(lease_path.name.split("-")[0])
+            except ValueError:
+                continue
+            if _pid_alive(pid):
+                leased = True
+            else:
+                lease_path.unlink(missing_ok=True)
+        return leased
+
+    # --- Validation ---
+
+    def _validate(self, local_dir: Path, manifest: dict, upstream_revision: str | None) -> str | None:
+        # Returns why an entry cannot be used as-is, or None if it is current and intact.
+        if manifest.get("pinned"):
+            return None
+        if upstream_revision and manifest.get("revision") != upstream_revision:
+            return f"upstream revision changed ({str(manifest.get('revision'))[:8]} -> {upstream_revision[:8]})"
+        for rel_path, info in manifest.get("files", {}).items():
+            file_path = local_dir / rel_path
+            if not file_path.exists():
+                return f"missing file {rel_path}"
+            if file_path.stat().st_size != info["size"]:
+                return f"size mismatch for {rel_path}"
+            if self.verify_hashes and info.get("sha256") and file_sha256(str(file_path)) != info["sha256"]:
+                return f"checksum mismatch for {rel_path}"
+        return None
+
+    def _build_manifest(self, local_dir: Path, revision: str | None, repo_tree, allow_patterns: list[str]) -> dict:
+        # Records every downloaded file with its size, checking LFS files against the Hub's sha256.
+        # Files that belonged to an older revision are removed from the entry.
+        expected = None
+        if repo_tree is not None:
+            expected = {f.path: f for f in repo_tree if getattr(f, "size", None) is not None and any(fnmatch.fnmatch(f.path, p) for p in allow_patterns)}
+        files = {}
+        for rel_path in _list_files(local_dir):
+            file_path = local_dir / rel_path
+            if expected is not None and rel_path not in expected:
+                print(f"Removing {rel_path} from cache: not part of revision {str(revision)[:8]}.")
+                file_path.unlink()
+                continue
+            info = {"size": file_path.stat().st_size}
+            lfs = getattr(expected.get(rel_path), "lfs", None) if expected is not None else None
+            if lfs is not None:
+                lfs_sha256 = lfs["sha256"] if isinstance(lfs, dict) else lfs.sha256
+                if info["size"] != expected[rel_path].size or file_sha256(str(file_path)) != lfs_sha256:
+                    raise Exception(f"Downloaded file {rel_path} does not match the Hub checksum. Please retry.")
+                info["sha256"] = lfs_sha256
+            files[rel_path] = info
+        return {"revision": revision, "files": files, "downloaded": time.time(), "last_used": time.time()}
+
+    def _entry_size(self, local_dir: Path, manifest: dict) -> int:
+        # Disk used by the entry and the hub cache snapshot it was placed from.
+        paths = [f for f in local_dir.rglob("*") if f.is_file()]
+        snapshot = manifest.get("snapshot")
+        if snapshot and os.path.isdir(snapshot):
+            paths += [os.path.realpath(os.path.join(snapshot, p)) for p in _list_files(Path(snapshot))]
+        return _disk_usage(paths)
+
+    def _delete_hub_revision(self, model_id: str, snapshot: str | None):
+        # Deletes the hub cache revision behind snapshot, with the blobs no other revision uses. The
+        # entry's hardlinks keep its own files alive until it is removed as well.
+        if not snapshot or not os.path.isdir(snapshot):
+            return
+        from huggingface_hub import scan_cache_dir
+        try:
+            strategy = scan_cache_dir(self.hub_cache_dir).delete_revisions(os.path.basename(snapshot))
+            strategy.execute()
+            print(f"Removed revision {os.path.basename(snapshot)[:8]} of '{model_id}' from the hub cache ({strategy.expected_freed_size_str}).")
+        except Exception as e:
+            print(f"Could not remove revision {os.path.basename(snapshot)[:8]} of '{model_id}' from the hub cache: {e}")
+
+    def _place_snapshot(self, snapshot_dir: Path, local_dir: Path, manifest: dict | None) -> dict:
+        # Links every file of a hub cache snapshot into the entry and returns the bytes placed per
+        # method. Files already in place (same inode, or the same LFS blob as last time) are skipped.
+        placed = {"reflink": 0, "hardlink": 0, "copy": 0}
+        old_files = (manifest or {}).get("files", {})
+        for rel_path in _list_files(snapshot_dir):
+            src = os.path.realpath(snapshot_dir / rel_path)
+            dst = local_dir / rel_path
+            if dst.exists() and (os.path.samefile(src, dst) or old_files.get(rel_path, {}).get("sha256") == os.path.basename(src)):
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            method = link_or_copy(src, str(dst))
+            placed[method] += dst.stat().st_size
+        return placed
+
+    # --- Public API ---
+
+    def cached_bytes(self, model_id: str) -> int:
+        # Bytes of model_id already in the cache (possibly for an older revision).
+        manifest = self._read_manifest(self.entry_dir(model_id)) or {}
+        return sum(info["size"] for info in manifest.get("files", {}).values())
+
+    @contextmanager
+    def use(self, model_id: str, api, allow_patterns: list[str], repo_tree=None, revision: str | None = None, stats: dict | None = None):
+        # Yields a verified local copy of model_id at its current upstream revision, downloading or
+        # refreshing it if needed. The entry is leased for the duration of the block. If the caller
+        # already knows the upstream revision, passing it saves a Hub round trip. If stats is given, it
+        # receives the time spent checking the cache and downloading and the bytes downloaded.
+        local_dir = self.entry_dir(model_id)
+        local_dir.mkdir(parents=True, exist_ok=True)
+        lease_path = self._acquire_lease(local_dir)
+        try:
+            with FileLock(str(self.root / LEASES_DIR_NAME / f"{local_dir.name}.lock")):
+                self._ensure(model_id, local_dir, api, allow_patterns, repo_tree, revision, stats)
+            self.evict(keep=local_dir)
+            yield local_dir
+        finally:
+            self._release_lease(local_dir, lease_path)
+
+    def _ensure(self, model_id: str, local_dir: Path, api, allow_patterns: list[str], repo_tree, revision: str | None = None, stats: dict | None = None):
+        stats = stats if stats is not None else {}
+        started = time.perf_counter()
+        manifest = self._read_manifest(local_dir)
+        if manifest is None and (local_dir / SENTINEL_NAME).exists():
+            # Entries from before the manifest existed, or files placed here by hand, are kept as they are.
+            print(f"Model '{model_id}' found in cache without a manifest; pinning it as a local copy.")
+            manifest = {"revision": None, "pinned": True, "files": {p: {"size": (local_dir / p).stat().st_size} for p in _list_files(local_dir)}, "downloaded": time.time()}
+
+        try:
+            upstream_revision = None if manifest and manifest.get("pinned") else revision or api.model_info(model_id).sha
+        except Exception as e:
+            # The Hub answered (e.g. gated, private or gone for this token): the cached copy is not served.
+            if getattr(e, "response", None) is not None:
+                raise
+            print(f"Could not resolve the upstream revision of '{model_id}': {e}")
+            upstream_revision = None
+
+        reason = self._validate(local_dir, manifest, upstream_revision) if manifest else "not in cache"
+        stats.update(lookup_seconds=time.perf_counter() - started, hit=reason is None, download_seconds=0.0, download_bytes=0)
+        if reason is None:
+            print(f"Model '{model_id}' found in cache at revision {str(manifest.get('revision'))[:8]}. Skipping download.")
+        else:
+            print(f"Model '{model_id}' needs downloading: {reason}.")
+            (local_dir / SENTINEL_NAME).unlink(missing_ok=True)
+            started = time.perf_counter()
+            try:
+                snapshot_dir = api.snapshot_download(repo_id=model_id, revision=upstream_revision, cache_dir=self.hub_cache_dir, allow_patterns=allow_patterns)
+                placed = self._place_snapshot(Path(snapshot_dir), local_dir, manifest)
+                print(f"Placed '{model_id}' in the model cache: {format_savings(placed)}.")
+                old_snapshot = (manifest or {}).get("snapshot")
+                manifest = self._build_manifest(local_dir, upstream_revision, repo_tree, allow_patterns)
+                manifest.update(model_id=model_id, snapshot=os.path.abspath(snapshot_dir))
+                if old_snapshot and os.path.abspath(old_snapshot) != manifest["snapshot"]:
+                    self._delete_hub_revision(model_id, old_snapshot)
+            finally:
+                stats["download_seconds"] = time.perf_counter() - started
+            (local_dir / SENTINEL_NAME).touch()
+            stats["download_bytes"] = sum(f.get("size") or 0 for f in manifest["files"].values())
+            print("Download complete and cached.")
+        manifest["last_used"] = time.time()
+        self._write_manifest(local_dir, manifest)
+
+    def evict(self, keep: Path | None = None):
+        # Removes least-recently-used, unleased, non-pinned entries until the cache fits its budget.
+        if self.max_bytes <= 0 or not self.root.exists():
+            return
+        entries = []
+        for entry in self.root.iterdir():
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            manifest = self._read_manifest(entry) or {}
+            entries.append((manifest.get("last_used", entry.stat().st_mtime), entry, manifest, self._entry_size(entry, manifest)))
+        total = sum(size for *_, size in entries)
+        for _, entry, manifest, size in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if entry == keep or manifest.get("pinned") or self.is_leased(entry):
+                continue
+            print(f"Evicting '{entry.name}' from model cache to stay within the disk budget.")
+            shutil.rmtree(entry, ignore_errors=True)
+            self._delete_hub_revision(manifest.get("model_id") or entry.name.replace("__", "/", 1), manifest.get("snapshot"))
+            total -= size
+        if total > self.max_bytes:
+            print(f"Model cache is {total / 1024**3:.1f} GB, over its budget, but the remaining entries are in use or pinned.")
@@ -0,0 +1,186 @@
+import os
+import time
+import shutil
+import threading
+from job_state import JobState, JobBusy, job_lock
+from job_scheduler import SchedulerFull
+
+# --- OUTPUTS REAPER ---
+# Every job works in outputs/<job id> (fp16, quants, imatrix), often twice the model's size, and keeps it
+# until it is uploaded or deleted. Users who close the tab never do either. The reaper:
+#
+#   * remembers which browser sessions own which jobs; a job's files are kept while its session is open,
+#   * expires abandoned outputs (no open session, not running, untouched for `ttl` seconds),
+#   * keeps the outputs under a scratch `quota`: when a job needs room, the oldest abandoned outputs
+#     are reclaimed first, even before their TTL, and if that is not enough the job is refused,
+#   * prunes the small job and metrics records of finished jobs after `record_ttl` seconds.
+#
+# Jobs that are running, paused for a restart or uploading are never touched. Files hardlinked from the
+# artifact store are not counted: deleting them frees nothing.
+
+ACTIVE_STATUSES = ("running", "paused", "uploading")
+RECORD_DIRS = ("jobs", "metrics")
+# Outputs touched more recently than this are never reclaimed for the quota (e.g. a job that has just
+# created its directory, or just finished and is being shown to its session).
+RECLAIM_GRACE_SECONDS = 600
+
+class ScratchQuotaExceeded(SchedulerFull):
+    pass
+
+def _private_size(path: str) -> int:
+    # Bytes that deleting path would free.
+    total = 0
+    for root, dirs, files in os.walk(path, onerror=lambda e: None):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if st.st_nlink <= 1:
+                total += st.st_size
+    return total
+
+class OutputsReaper:
+    def __init__(self, root: str = "outputs", ttl: float = 86400, quota: int = 0, record_ttl: float = 30 * 86400):
+        self.root = root
+        self.ttl = ttl
+        self.quota = quota
+        self.record_ttl = record_ttl
+        self._sessions = {}  # session -> set of job ids
+        self._released = {}  # job id -> when its last session closed
+        self._lock = threading.Lock()
+
+    # --- Sessions ---
+
+    def attach(self, session: str, job_id: str):
+        # Keeps job_id's files while `session` is open.
+        if not session or not job_id:
+            return
+        with self._lock:
+            self._sessions.setdefault(session, set()).add(job_id)
+            self._released.pop(job_id, None)
+
+    def release(self, session: str):
+        # Called when a browser session ends; its jobs start their TTL now.
+        with self._lock:
+            now = time.time()
+            for job_id in self._sessions.pop(session, set()):
+                if not any(job_id in jobs for jobs in self._sessions.values()):
+                    self._released[job_id] = now
+
+    def _held(self) -> set:
+        with self._lock:
+            return set().union(*self._sessions.values())
+
+    # --- Scanning ---
+
+    def scan(self) -> list[dict]:
+        # Lists the job directories under root: id, bytes, last activity and whether they may be reclaimed.
+        if not os.path.isdir(self.root):
+            return []
+        held = self._held()
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name in RECORD_DIRS or not os.path.isdir(path):
+                continue
+            state = JobState.load(name)
+            # Directories without a record predate durable jobs or were left by a crash before one was written.
+            touched = state.record["updated"] if state else os.path.getmtime(path)
+            with self._lock:
+                touched = max(touched, self._released.get(name, 0))
+            active = state is not None and state.status in ACTIVE_STATUSES
+            entries.append({
+                "job_id": name,
+                "path": path,
+                "state": state,
+                "bytes": _private_size(path),
+                "touched": touched,
+                "reclaimable": not active and name not in held,
+            })
+        return sorted(entries, key=lambda e: e["touched"])
+
+    def usage(self) -> int:
+        return sum(e["bytes"] for e in self.scan())
+
+    def _remove(self, entry: dict, reason: str) -> int:
+        # Deletes an entry's files unless its job was resumed or uploaded meanwhile, here or in another
+        # process; returns bytes freed.
+        try:
+            with job_lock(entry["job_id"]):
+                state = JobState.load(entry["job_id"])
+                if (state is not None and state.status in ACTIVE_STATUSES) or entry["job_id"] in self._held() or not os.path.isdir(entry["path"]):
+                    return 0
+                shutil.rmtree(entry["path"], ignore_errors=True)
+                if state is not None:
+                    state.set_status("expired", reason)
+        except JobBusy:
+            return 0
+        with self._lock:
+            self._released.pop(entry["job_id"], None)
+        print(f"Reaped {entry['path']} ({entry['bytes'] / 1024**3:.2f} GB): {reason}.")
+        return entry["bytes"]
+
+    # --- Reaping ---
+
+    def reap(self) -> int:
+        # Expires abandoned outputs past the TTL, enforces the quota and prunes old records. Returns bytes freed.
+        freed = 0
+        entries = self.scan()
+        now = time.time()
+        for entry in entries:
+            if entry["reclaimable"] and self.ttl > 0 and now - entry["touched"] > self.ttl:
+                freed += self._remove(entry, f"abandoned for more than {self.ttl / 3600:.0f} h")
+        if self.quota > 0:
+            freed += self._reclaim(self.usage() - self.quota)
+        self._prune_records(now)
+        return freed
+
+    def _reclaim(self, needed: int) -> int:
+        # Removes the oldest abandoned outputs until `needed` bytes are freed (or nothing is left to remove).
+        freed, now = 0, time.time()
+        for entry in self.scan():
+            if freed >= needed:
+                break
+            if entry["reclaimable"] and now - entry["touched"] > RECLAIM_GRACE_SECONDS:
+                freed += self._remove(entry, "reclaimed for the scratch quota")
+        return freed
+
+    def ensure_space(self, needed: int, reserved: int = 0):
+        # Makes room under the quota for a job that will write `needed` bytes, on top of `reserved` bytes
+        # promised to running jobs; raises ScratchQuotaExceeded if abandoned outputs cannot cover it.
+        if self.quota <= 0:
+            return
+        entries = self.scan()
+        # Running jobs are charged their reservation rather than what they have written so far.
+        used = sum(e["bytes"] for e in entries if not (e["state"] and e["state"].status == "running")) + reserved
+        if used + needed <= self.quota:
+            return
+        # Nothing is deleted for a job that would be refused anyway.
+        now = time.time()
+        reclaimable = sum(e["bytes"] for e in entries if e["reclaimable"] and now - e["touched"] > RECLAIM_GRACE_SECONDS)
+        if used - reclaimable + needed > self.quota or used + needed - self._reclaim(used + needed - self.quota) > self.quota:
+            raise ScratchQuotaExceeded(
+                f"Not enough scratch space: this job needs {needed / 1024**3:.1f} GB, but only "
+                f"{max(self.quota - used + reclaimable, 0) / 1024**3:.1f} GB of the {self.quota / 1024**3:.1f} GB quota can be freed. "
+                "Please upload or delete your finished jobs, or try again later."
+            )
+
+    def _prune_records(self, now: float):
+        # Records (and lock files) of jobs whose files are gone (uploaded, deleted or expired) are kept for record_ttl.
+        if self.record_ttl <= 0:
+            return
+        for kind in RECORD_DIRS:
+            directory = os.path.join(self.root, kind)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                job_id, ext = os.path.splitext(name)
+                path = os.path.join(directory, name)
+                if ext not in (".json", ".lock") or os.path.isdir(os.path.join(self.root, job_id)):
+                    continue
+                try:
+                    if now - os.path.getmtime(path) > self.record_ttl:
+                        os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- PIPELINE METRICS ---
+# Every pipeline stage of a job is recorded with its duration, outcome, bytes processed and the CPU
+# time and peak RSS of the tools it ran. Each job's record is written to outputs/metrics/<job id>.json,
+# and aggregates are served in the Prometheus text format by a small HTTP endpoint next to the app.
+# Child usage is attributed to the stage that is current in the calling context; code that runs
+# tools on worker threads must submit them with contextvars.copy_context().run.
+
+METRICS_DIR = os.path.join("outputs", "metrics")
+DURATION_BUCKETS = (1, 5, 15, 60, 300, 900, 1800, 3600, 7200, 14400)
+
+_current_stage = contextvars.ContextVar("pipeline_stage", default=None)
+_stage_lock = threading.Lock()
+
+def record_child_usage(cpu_seconds: float, peak_rss: int):
+    # Called by the process runner when a tool exits; charges it to the current stage, if any.
+    entry = _current_stage.get()
+    if entry is None:
+        return
+    with _stage_lock:
+        entry["children"] += 1
+        entry["child_cpu_seconds"] += cpu_seconds
+        entry["child_peak_rss"] = max(entry["child_peak_rss"], peak_rss)
+
+def add_stage_bytes(n: int):
+    # Adds to the bytes processed by the current stage.
+    entry = _current_stage.get()
+    if entry is not None:
+        with _stage_lock:
+            entry["bytes"] += n
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class MetricsRegistry:
+    # Aggregates stage and job records in memory and renders them for Prometheus.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}  # (stage, outcome, family) -> [bucket counts..., sum, count]
+        self._counters = {}   # (name, labels) -> value
+        self._peaks = {}      # stage -> largest child peak RSS seen
+        self._gauges = []     # (name, help, fn)
+
+    def observe_stage(self, entry: dict, family: str):
+        key = (entry["stage"], entry["outcome"], family)
+        with self._lock:
+            hist = self._durations.setdefault(key, [0] * (len(DURATION_BUCKETS) + 2))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if entry["duration"] <= bound:
+                    hist[i] += 1
+            hist[-2] += entry["duration"]
+            hist[-1] += 1
+            for name, value in (("gguf_stage_bytes_total", entry["bytes"]), ("gguf_stage_child_cpu_seconds_total", entry["child_cpu_seconds"])):
+                self._counters[(name, (("stage", entry["stage"]),))] = self._counters.get((name, (("stage", entry["stage"]),)), 0) + value
+            self._peaks[entry["stage"]] = max(self._peaks.get(entry["stage"], 0), entry["child_peak_rss"])
+
+    def count_job(self, phase: str, outcome: str):
+        key = ("gguf_jobs_total", (("phase", phase), ("outcome", outcome)))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def add_gauge(self, name: str, help_text: str, fn):
+        # fn() is called at scrape time and returns the current value.
+        self._gauges.append((name, help_text, fn))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines += ["# HELP gguf_stage_duration_seconds Wall time of pipeline stages.", "# TYPE gguf_stage_duration_seconds histogram"]
+            for (stage, outcome, family), hist in sorted(self._durations.items()):
+                labels = f'stage="{_escape_label(stage)}",outcome="{_escape_label(outcome)}",family="{_escape_label(family)}"'
+                for bound, count in zip(DURATION_BUCKETS, hist):
+                    lines.append(f'gguf_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'gguf_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {hist[-1]}')
+                lines.append(f"gguf_stage_duration_seconds_sum{{{labels}}} {hist[-2]:.3f}")
+                lines.append(f"gguf_stage_duration_seconds_count{{{labels}}} {hist[-1]}")
+            helps = {
+                "gguf_stage_bytes_total": "Bytes processed by pipeline stages.",
+                "gguf_stage_child_cpu_seconds_total": "CPU time (user + system) of the tools run by pipeline stages.",
+                "gguf_jobs_total": "Finished job phases by outcome.",
+            }
+            for name, help_text in helps.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+                        lines.append(f"{name}{{{label_text}}} {value}")
+            lines += ["# HELP gguf_stage_child_peak_rss_bytes Largest peak RSS of any tool run by a stage.", "# TYPE gguf_stage_child_peak_rss_bytes gauge"]
+            lines += [f'gguf_stage_child_peak_rss_bytes{{stage="{_escape_label(stage)}"}} {peak}' for stage, peak in sorted(self._peaks.items())]
+        for name, help_text, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+class JobMetrics:
+    # The record of one job, shared by its processing and upload phases through the job id.
+    def __init__(self, job_id: str, **info):
+        self.job_id = job_id
+        self.path = os.path.join(METRICS_DIR, f"{job_id}.json")
+        self.record = {"job_id": job_id, "started": time.time(), "stages": [], **info}
+
+    @classmethod
+    def load(cls, job_id: str, **info) -> "JobMetrics":
+        # Continues the record written by an earlier phase of the same job, if there is one.
+        metrics = cls(job_id, **info)
+        try:
+            with open(metrics.path, "r", encoding="utf-8") as f:
+                metrics.record = {**json.load(f), **info}
+        except (OSError, ValueError):
+            pass
+        return metrics
+
+    def save(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.record, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def _new_entry(self, name: str) -> dict:
+        return {"stage": name, "started": time.time(), "duration": 0.0, "outcome": "ok", "bytes": 0, "children": 0, "child_cpu_seconds": 0.0, "child_peak_rss": 0}
+
+    def _add(self, entry: dict):
+        self.record["stages"].append(entry)
+        REGISTRY.observe_stage(entry, self.record.get("family") or "unknown")
+        self.save()
+
+    @contextmanager
+    def stage(self, name: str):
+        # Times a stage; the yielded entry can be given "bytes" and an "outcome" (e.g. "hit"/"miss").
+        entry = self._new_entry(name)
+        token = _current_stage.set(entry)
+        started = time.perf_counter()
+        try:
+            yield entry
+        except BaseException:
+            entry["outcome"] = "error"
+            raise
+        finally:
+            _current_stage.reset(token)
+            entry["duration"] = time.perf_counter() - started
+            self._add(entry)
+
+    def add_stage(self, name: str, duration: float, outcome: str = "ok", n_bytes: int = 0):
+        # Records a stage that was timed elsewhere (e.g. by the model cache).
+        entry = self._new_entry(name)
+        entry.update(started=time.time() - duration, duration=duration, outcome=outcome, bytes=n_bytes)
+        self._add(entry)
+
+    def finish(self, phase: str, outcome: str):
+        self.record[f"{phase}_outcome"] = outcome
+        self.record[f"{phase}_finished"] = time.time()
+        REGISTRY.count_job(phase, outcome)
+        self.save()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(host: str, port: int) -> ThreadingHTTPServer:
+    # Serves REGISTRY at http://host:port/metrics from a background thread.
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics at http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,146 @@
+import os
+import re
+import sys
+import subprocess
+from collections import deque
+from pipeline_metrics import record_child_usage
+
+# --- STREAMING SUBPROCESS RUNNER ---
+# Runs llama.cpp tools and the converter with stdout and stderr merged, reading the output as it is
+# produced. Only the last LOG_TAIL_LINES lines are kept (for error messages), so memory stays flat no
+# matter how chatty the child is, and progress is parsed from the stream and reported as it happens.
+
+LOG_TAIL_LINES = 200
+MAX_PENDING_BYTES = 64 * 1024
+_LINE_BREAK = re.compile(rb"[\r\n]")
+
+def run_streaming(cmd: list[str], progress_parser=None, on_progress=None, tail_lines: int = LOG_TAIL_LINES, affinity: list[int] | None = None, **popen_kwargs) -> tuple[int, str]:
+    # Runs cmd to completion and returns (returncode, last lines of output).
+    # progress_parser(text, complete) returns (fraction or None, description) or None; matches are passed to
+    # on_progress. complete is False while a line is still being written. affinity pins the child to those CPUs.
+    tail = deque(maxlen=tail_lines)
+    last_progress = None
+
+    def feed(segment: bytes, complete: bool):
+        nonlocal last_progress
+        text = segment.decode("utf-8", errors="replace")
+        if complete and text.strip():
+            tail.append(text)
+        if progress_parser and on_progress:
+            progress = progress_parser(text, complete)
+            if progress and progress != last_progress:
+                last_progress = progress
+                on_progress(*progress)
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **popen_kwargs)
+    if affinity:
+        # Set right after the start, before the tool creates its thread pool; its threads inherit the mask.
+        try:
+            os.sched_setaffinity(process.pid, affinity)
+        except (AttributeError, OSError):
+            pass
+    pending = b""
+    while chunk := process.stdout.read1(65536):
+        pending += chunk
+        *segments, pending = _LINE_BREAK.split(pending)
+        for segment in segments:
+            feed(segment, True)
+        # Some tools print progress without line breaks (e.g. imatrix's "[1]5.41,[2]6.02,"), so the
+        # unfinished line is parsed too, and flushed once it grows large.
+        if len(pending) > MAX_PENDING_BYTES:
+            feed(pending, True)
+            pending = b""
+        elif pending:
+            feed(pending, False)
+    if pending:
+        feed(pending, True)
+    process.stdout.close()
+    return _reap(process), "\n".join(tail)
+
+def _reap(process: subprocess.Popen) -> int:
+    # Waits for the child and charges its CPU time and peak RSS to the current pipeline stage.
+    # wait4 is POSIX-only; elsewhere the child is reaped without usage figures.
+    if not hasattr(os, "wait4"):
+        return process.wait()
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    record_child_usage(usage.ru_utime + usage.ru_stime, peak_rss)
+    return process.returncode
+
+# --- Progress parsers ---
+# Each factory returns a stateful parser for one run of the named tool.
+
+def convert_progress():
+    # convert_hf_to_gguf.py logs every tensor, then writes the file behind a tqdm bar ("Writing:  45%|...").
+    tensors = 0
+    def parse(text: str, complete: bool):
+        nonlocal tensors
+        if m := re.search(r"Writing:\s+(\d+)%", text):
+            return int(m.group(1)) / 100, "Writing GGUF"
+        if complete and re.match(r"INFO:hf-to-gguf:\S+,\s+torch\.", text):
+            tensors += 1
+            return None, f"Converting tensors ({tensors} done)"
+        return None
+    return parse
+
+def imatrix_progress():
+    # llama-imatrix announces "computing over N chunks" and then prints "[k]ppl," after each chunk.
+    total = 0
+    def parse(text: str, complete: bool):
+        nonlocal total
+        if m := re.search(r"computing over (\d+) chunks", text):
+            total = int(m.group(1))
+            return 0.0, f"Computing imatrix (0/{total} chunks)"
+        if total and (chunks := re.findall(r"\[(\d+)\]", text)):
+            done = int(chunks[-1])
+            return min(done / total, 1.0), f"Computing imatrix ({done}/{total} chunks)"
+        return None
+    return parse
+
+def quantize_progress(quant_method: str = ""):
+    # llama-quantize prints "[ 12/ 291] blk.0.attn_k.weight - ..." for every tensor.
+    def parse(text: str, complete: bool):
+        if m := re.match(r"\[\s*(\d+)/\s*(\d+)\]", text):
+            done, total = int(m.group(1)), int(m.group(2))
+            return done / total, f"Quantizing {quant_method} ({done}/{total} tensors)"
+        return None
+    return parse
+
+def split_progress():
+    # llama-gguf-split prints "n_split: N" and then "Writing file <name> ..." for each shard.
+    total, written = 0, 0
+    def parse(text: str, complete: bool):
+        nonlocal total, written
+        if complete and (m := re.match(r"n_split: (\d+)", text)):
+            total = int(m.group(1))
+            return 0.0, f"Splitting (0/{total} shards)"
+        if complete and text.startswith("Writing file") and text.rstrip().endswith("done"):
+            written += 1
+            return (written / total if total else None), f"Splitting ({written}/{total or '?'} shards)"
+        return None
+    return parse
+
+def perplexity_progress(label: str = ""):
+    # llama-perplexity announces "calculating perplexity over N chunks" and prints "[k]ppl," after each
+    # chunk; with --kl-divergence it announces "computing over N chunks" and prints a table row per chunk.
+    total = 0
+    def parse(text: str, complete: bool):
+        nonlocal total
+        if m := re.search(r"(?:calculating perplexity|computing) over (\d+) chunks", text):
+            total = int(m.group(1))
+            return 0.0, f"Evaluating {label} (0/{total} chunks)"
+        if not total:
+            return None
+        if chunks := re.findall(r"\[(\d+)\]", text):
+            done = int(chunks[-1])
+        elif complete and (m := re.match(r"\s*(\d+)\s+\d+\.\d+\s+±", text)):
+            done = int(m.group(1))
+        else:
+            return None
+        return min(done / total, 1.0), f"Evaluating {label} ({done}/{total} chunks)"
+    return parse
@@ -0,0 +1,132 @@
+import os
+import re
+import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from process_runner import run_streaming, perplexity_progress
+from system_info import get_effective_cpu_count
+
+# --- QUANT EVALUATION ---
+# Measures what each produced quant costs and what it gives up, so quants that are not worth their disk
+# and bandwidth can be dropped:
+#
+#   * quality: llama-perplexity runs the fp16 model once over a small eval text and saves its logits
+#     (--kl-divergence-base); every quant is then scored against those logits for perplexity, mean
+#     KL-divergence from the fp16 and how often it picks the same top token. These runs are independent
+#     and go in parallel, bounded by cores and RAM.
+#   * speed: llama-bench measures prompt processing and generation tokens per second. Benchmarks run one
+#     at a time with all of the job's threads, since concurrent runs would skew each other's numbers.
+#
+# The eval text is kept small (a few chunks of 512 tokens): the fp16 logits file holds n_vocab values per
+# scored token, which is about 0.6 GB for 8 chunks of a model with a 150k vocabulary.
+
+EVAL_CTX = 512
+
+def parse_perplexity(output: str) -> dict:
+    # Extracts the summary figures from llama-perplexity's output (plain or --kl-divergence mode).
+    result = {}
+    if m := re.search(r"Final estimate: PPL = ([\d.]+) \+/- ([\d.]+)", output):
+        result["ppl"], result["ppl_err"] = float(m.group(1)), float(m.group(2))
+    if m := re.search(r"Mean PPL\(Q\)\s*:\s*([\d.]+)\s*±\s*([\d.]+)", output):
+        result["ppl"], result["ppl_err"] = float(m.group(1)), float(m.group(2))
+    if m := re.search(r"Mean\s+KLD:\s*([\d.]+)\s*±\s*([\d.]+)", output):
+        result["kld"], result["kld_err"] = float(m.group(1)), float(m.group(2))
+    if m := re.search(r"Same top p:\s*([\d.]+)\s*±\s*([\d.]+)\s*%", output):
+        result["same_top"] = float(m.group(1))
+    return result
+
+def parse_bench(output: str) -> dict:
+    # Extracts tokens per second from llama-bench's JSON Lines output: one record per test.
+    result = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("n_gen"):
+            result["tg_tps"] = record.get("avg_ts")
+        elif record.get("n_prompt"):
+            result["pp_tps"] = record.get("avg_ts")
+    return result
+
+def plan_eval_workers(model_paths: list[str], cpus: int, total_memory: int | None, threads_per_worker: int = 4) -> int:
+    # As many parallel perplexity runs as the cores allow, while the largest models loaded at once fit in RAM.
+    workers = max(1, min(len(model_paths), cpus // max(1, threads_per_worker)))
+    if total_memory:
+        sizes = sorted((os.path.getsize(p) for p in model_paths), reverse=True)
+        while workers > 1 and sum(sizes[:workers]) > total_memory * 0.8:
+            workers -= 1
+    return workers
+
+def evaluate_quants(perplexity_executable: str, bench_executable: str | None, fp16_path: str, quant_paths: dict, eval_data_path: str, work_dir: str, chunks: int = 8, cpus: int | None = None, total_memory: int | None = None, on_progress=None) -> dict:
+    # Scores every quant in quant_paths ({quant type: path}) against fp16_path and returns the results;
+    # a quant that fails to evaluate gets an "error" entry instead of failing the whole evaluation.
+    cpus = cpus or get_effective_cpu_count()
+    base_logits = os.path.join(work_dir, "fp16.kld")
+    results = {"eval_data": os.path.basename(eval_data_path), "chunks": chunks, "ctx": EVAL_CTX, "fp16": {"bytes": os.path.getsize(fp16_path)}, "quants": {}}
+    try:
+        cmd = [perplexity_executable, "-m", fp16_path, "-f", eval_data_path, "-c", str(EVAL_CTX), "--chunks", str(chunks), "-t", str(cpus), "--kl-divergence-base", base_logits]
+        returncode, output = run_streaming(cmd, perplexity_progress("fp16"), on_progress)
+        if returncode != 0:
+            raise Exception(f"Evaluating the fp16 model failed:\n{output}")
+        results["fp16"].update(parse_perplexity(output))
+
+        def score(method: str, path: str, n_threads: int) -> dict:
+            cmd = [perplexity_executable, "-m", path, "--kl-divergence-base", base_logits, "--kl-divergence", "-t", str(n_threads)]
+            returncode, output = run_streaming(cmd, perplexity_progress(method), on_progress)
+            if returncode != 0:
+                return {"bytes": os.path.getsize(path), "error": output.strip().splitlines()[-1] if output.strip() else f"exit code {returncode}"}
+            return {"bytes": os.path.getsize(path), **parse_perplexity(output)}
+
+        workers = plan_eval_workers(list(quant_paths.values()), cpus, total_memory)
+        n_threads = max(1, cpus // workers)
+        print(f"Evaluating {len(quant_paths)} quant(s) with {workers} parallel worker(s), {n_threads} thread(s) each.")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {method: pool.submit(contextvars.copy_context().run, score, method, path, n_threads) for method, path in quant_paths.items()}
+            results["quants"] = {method: future.result() for method, future in futures.items()}
+    finally:
+        if os.path.exists(base_logits):
+            os.remove(base_logits)
+
+    if bench_executable:
+        for method, path in [("fp16", fp16_path), *quant_paths.items()]:
+            if on_progress:
+                on_progress(None, f"Benchmarking {method}")
+            returncode, output = run_streaming([bench_executable, "-m", path, "-p", "64", "-n", "16", "-r", "2", "-t", str(cpus), "-o", "jsonl"])
+            entry = results["fp16"] if method == "fp16" else results["quants"][method]
+            if returncode == 0:
+                entry.update(parse_bench(output))
+            else:
+                print(f"Benchmarking {method} failed:\n{output}")
+    return results
+
+def format_eval_table(results: dict) -> str:
+    # Renders the results as a Markdown section for the model card.
+    def cell(value, fmt):
+        return format(value, fmt) if isinstance(value, (int, float)) else "–"
+    base_ppl = results["fp16"].get("ppl")
+    lines = [
+        "## Quantization quality and speed",
+        f"Measured on {results['chunks']} chunks of {results['ctx']} tokens of `{results['eval_data']}`. "
+        "KLD is the mean KL-divergence of each quant's token distribution from the fp16 model's; "
+        "\"Same top\" is how often both pick the same most likely token. Speeds are CPU tokens per second "
+        "for prompt processing (pp) and generation (tg).",
+        "",
+        "| Quant | Size (GB) | PPL | ΔPPL | KLD | Same top | pp t/s | tg t/s |",
+        "|---|---:|---:|---:|---:|---:|---:|---:|",
+    ]
+    rows = [("fp16", results["fp16"]), *results["quants"].items()]
+    for name, entry in rows:
+        if entry.get("error"):
+            lines.append(f"| {name} | {entry['bytes'] / 1024**3:.2f} | evaluation failed | | | | | |")
+            continue
+        delta = entry["ppl"] - base_ppl if name != "fp16" and base_ppl and entry.get("ppl") else None
+        lines.append(
+            f"| {name} | {entry['bytes'] / 1024**3:.2f} | {cell(entry.get('ppl'), '.4f')} | {cell(delta, '+.4f')} | "
+            f"{cell(entry.get('kld'), '.5f')} | {cell(entry.get('same_top'), '.1f') + ' %' if entry.get('same_top') is not None else '–'} | "
+            f"{cell(entry.get('pp_tps'), '.1f')} | {cell(entry.get('tg_tps'), '.1f')} |"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,191 @@
+import os
+import json
+import struct
+
+# --- PRE-FLIGHT RESOURCE ESTIMATOR ---
+# Predicts what a job needs before anything is downloaded, using the repo file listing, the safetensors
+# headers (served by the Hub without downloading the weights) and config.json. Quant sizes use
+# llama.cpp's nominal bits per weight, so every figure here is an estimate, not a guarantee.
+
+WEIGHT_EXTENSIONS = (".safetensors", ".bin", ".pt", ".pth")
+# The Hub rejects single files above 50 GB; larger outputs are split automatically.
+HUB_MAX_FILE_BYTES = 50 * 1000**3
+AUTO_SPLIT_SIZE = "45G"
+# Fixed allowance per stage for the runtime, compute buffers and context.
+STAGE_OVERHEAD_BYTES = 1024**3
+
+# Approximate bits per weight of each quant type, from llama-quantize's own size tables.
+BITS_PER_WEIGHT = {
+    "TQ1_0": 1.69, "TQ2_0": 2.06, "IQ1_S": 1.56, "IQ1_M": 1.75, "IQ2_XXS": 2.06, "IQ2_XS": 2.31, "IQ2_S": 2.5,
+    "IQ2_M": 2.7, "IQ3_XXS": 3.06, "IQ3_XS": 3.3, "IQ3_S": 3.44, "IQ3_M": 3.66, "IQ4_NL": 4.5, "IQ4_XS": 4.25,
+    "Q2_K": 3.17, "Q3_K_S": 3.65, "Q3_K_M": 4.0, "Q3_K_L": 4.31, "Q4_0": 4.64, "Q4_K_S": 4.67, "Q4_K_M": 4.9,
+    "Q5_0": 5.57, "Q5_K_S": 5.57, "Q5_K_M": 5.7, "Q6_K": 6.57, "Q8_0": 8.51, "F16": 16.0, "BF16": 16.0,
+}
+
+# Quant types the converter writes itself (--outtype), without a 16-bit intermediate and llama-quantize.
+CONVERTER_QUANTS = {"Q8_0": "q8_0"}
+# config.json's torch_dtype in the safetensors dtype names used everywhere else.
+CONFIG_DTYPES = {"bfloat16": "BF16", "float16": "F16", "float32": "F32"}
+
+def weight_bytes(repo_tree) -> int:
+    return sum(f.size or 0 for f in repo_tree or [] if f.path.endswith(WEIGHT_EXTENSIONS) and getattr(f, "size", None))
+
+def _read_config(model_id: str, api) -> dict:
+    # Multimodal configs keep the language model's shape under text_config.
+    try:
+        with open(api.hf_hub_download(repo_id=model_id, filename="config.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except Exception:
+        return {}
+    return config.get("text_config", config)
+
+def _shape_from_config(config: dict) -> tuple[int | None, int | None]:
+    # Rough (parameter count, largest tensor) of a decoder-only transformer described by config.json.
+    hidden = config.get("hidden_size")
+    layers = config.get("num_hidden_layers")
+    if not hidden or not layers:
+        return None, None
+    vocab = config.get("vocab_size", 32000)
+    intermediate = config.get("intermediate_size", 4 * hidden)
+    embeddings = vocab * hidden * (1 if config.get("tie_word_embeddings") else 2)
+    params = layers * (4 * hidden * hidden + 3 * hidden * intermediate) + embeddings
+    return params, max(vocab * hidden, hidden * intermediate)
+
+def _config_dtypes(config: dict, params: int | None) -> dict:
+    dtype = CONFIG_DTYPES.get(config.get("torch_dtype") or config.get("dtype"))
+    return {dtype: params or 0} if dtype else {}
+
+def inspect_model(model_id: str, api, repo_tree) -> dict:
+    # Returns the parameter count, the largest tensor's element count, the parameters per source dtype
+    # and where the figures came from.
+    try:
+        metadata = api.get_safetensors_metadata(model_id)
+        largest = max((t.parameter_count for f in metadata.files_metadata.values() for t in f.tensors.values()), default=None)
+        return {"params": sum(metadata.parameter_count.values()), "largest_tensor": largest, "dtypes": dict(metadata.parameter_count), "source": "safetensors headers"}
+    except Exception as e:
+        print(f"Safetensors metadata unavailable for {model_id}: {e}")
+    config = _read_config(model_id, api)
+    params, largest = _shape_from_config(config)
+    if params:
+        return {"params": params, "largest_tensor": largest, "dtypes": _config_dtypes(config, params), "source": "config.json"}
+    weights = weight_bytes(repo_tree)
+    # Without headers or config, assume 16-bit weights.
+    return {"params": weights // 2 if weights else None, "largest_tensor": None, "dtypes": {}, "source": "file sizes" if weights else "unknown"}
+
+def local_dtypes(local_dir: str) -> dict:
+    # Parameters per dtype of a downloaded model, from the JSON headers at the start of its safetensors
+    # files (nothing else is read), or from config.json for .bin checkpoints.
+    dtypes = {}
+    for name in sorted(os.listdir(local_dir)):
+        if not name.endswith(".safetensors"):
+            continue
+        try:
+            with open(os.path.join(local_dir, name), "rb") as f:
+                header = json.loads(f.read(struct.unpack("<Q", f.read(8))[0]))
+        except (OSError, ValueError, struct.error):
+            continue
+        for tensor_name, info in header.items():
+            if tensor_name == "__metadata__":
+                continue
+            count = 1
+            for dim in info.get("shape", []):
+                count *= dim
+            dtypes[info["dtype"]] = dtypes.get(info["dtype"], 0) + count
+    if dtypes:
+        return dtypes
+    try:
+        with open(os.path.join(local_dir, "config.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return _config_dtypes(config.get("text_config", config), None)
+
+def plan_outtype(dtypes: dict | None, quant_methods: list[str], use_imatrix: bool = False, evaluate: bool = False) -> str:
+    # Picks the converter's --outtype. A converter-native quant is written directly when it is the only
+    # target and nothing needs a 16-bit model (imatrix, evaluation). Otherwise the intermediate keeps the
+    # source's 16-bit format: bf16 for bf16 weights, which f16 would clip, and f16 for everything else.
+    if len(quant_methods) == 1 and quant_methods[0] in CONVERTER_QUANTS and not use_imatrix and not evaluate:
+        return CONVERTER_QUANTS[quant_methods[0]]
+    floats = {dtype: n for dtype, n in (dtypes or {}).items() if dtype in ("BF16", "F16", "F32")}
+    return "bf16" if floats and max(floats, key=floats.get) == "BF16" else "f16"
+
+def is_direct(outtype: str) -> bool:
+    return outtype in CONVERTER_QUANTS.values()
+
+def estimate_job(model_id: str, api, repo_tree, quant_methods: list[str], use_imatrix: bool, split_model: bool = False, cached_bytes: int = 0, model: dict | None = None, outtype: str = "f16") -> dict:
+    # Predicts download size, intermediate size, per-quant output size, per-stage peak RAM and total scratch disk.
+    # model is inspect_model()'s result, if the caller already has it; outtype is the converter's output type.
+    model = model or inspect_model(model_id, api, repo_tree)
+    params = model["params"] or 0
+    download = weight_bytes(repo_tree) or params * 2
+    # A direct conversion writes the quant itself and no intermediate.
+    fp16 = 0 if is_direct(outtype) else params * 2
+    quants = {m: int(params * BITS_PER_WEIGHT.get(m, 8.5) / 8) for m in quant_methods}
+    # The converter and llama-quantize hold roughly one tensor at a time, in f32 plus its output;
+    # llama-imatrix keeps the whole fp16 model resident.
+    largest_tensor = model["largest_tensor"] or params // 16
+    ram = {
+        "convert": largest_tensor * 4 * 2 + STAGE_OVERHEAD_BYTES,
+        "imatrix": fp16 + STAGE_OVERHEAD_BYTES if use_imatrix else 0,
+        "quantize": largest_tensor * 4 * 2 + STAGE_OVERHEAD_BYTES,
+    }
+    auto_split = not split_model and any(size > HUB_MAX_FILE_BYTES for size in quants.values())
+    # While a quant is being split, it and its shards exist side by side.
+    split_scratch = max(quants.values(), default=0) if split_model or auto_split else 0
+    # Everything but the download is written to the job's outputs/ directory.
+    outputs = fp16 + sum(quants.values()) + split_scratch
+    disk = max(download - cached_bytes, 0) + outputs
+    return {
+        **model,
+        "download": download,
+        "download_needed": max(download - cached_bytes, 0),
+        "fp16": fp16,
+        "outtype": outtype,
+        "quants": quants,
+        "ram": ram,
+        "disk": disk,
+        "outputs": outputs,
+        "auto_split": auto_split,
+    }
+
+def job_needs(estimate: dict) -> dict:
+    # The scheduler's view of a job: its highest stage RAM peak, all of its scratch disk and the part of
+    # it that lands in outputs/.
+    return {"ram": max(estimate["ram"].values()), "disk": estimate["disk"], "outputs": estimate["outputs"], "cpus": 1}
+
+def preflight_problems(estimate: dict, total_ram: int, available_disk: int) -> list[str]:
+    # Lists the reasons a job cannot run on this machine at all (as opposed to having to wait).
+    problems = []
+    if not estimate["params"]:
+        return problems
+    for stage, peak in estimate["ram"].items():
+        if peak > total_ram:
+            problems.append(f"{stage} needs about {_gb(peak)} RAM, but this machine has {_gb(total_ram)}.")
+    if estimate["disk"] > available_disk:
+        problems.append(f"The job needs about {_gb(estimate['disk'])} of scratch disk, but only {_gb(available_disk)} can be made available.")
+    return problems
+
+def _gb(n: int) -> str:
+    return f"{n / 1024**3:.1f} GB"
+
+def format_estimate(estimate: dict) -> str:
+    # Markdown summary for the UI.
+    if not estimate["params"]:
+        return "Could not estimate the resources for this model."
+    lines = [
+        f"**Estimated resources** ({estimate['params'] / 1e9:.2f}B parameters, from {estimate['source']})",
+        "",
+        "| | Size |",
+        "|---|---|",
+        f"| Download | {_gb(estimate['download'])}" + (" (already cached)" if not estimate["download_needed"] else "") + " |",
+    ]
+    if estimate["fp16"]:
+        lines.append(f"| {estimate['outtype'].upper()} intermediate GGUF | {_gb(estimate['fp16'])} |")
+    lines += [f"| {method} | {_gb(size)} |" for method, size in estimate["quants"].items()]
+    lines += [f"| Peak RAM ({stage}) | {_gb(peak)} |" for stage, peak in estimate["ram"].items() if peak]
+    lines.append(f"| Scratch disk | {_gb(estimate['disk'])} |")
+    if is_direct(estimate["outtype"]):
+        lines += ["", f"Converted directly to {estimate['outtype'].upper()}, without a 16-bit intermediate."]
+    if estimate["auto_split"]:
+        lines += ["", f"Outputs above the Hub's 50 GB file limit will be split into {AUTO_SPLIT_SIZE} shards."]
+    return "\n".join(lines)
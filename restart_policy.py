@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+from system_info import get_process_rss_bytes
+
+# --- JOB-AWARE RESTART POLICY ---
+# The app restarts itself when it has a reason to, instead of on a fixed timer:
+#
+#   * the process has grown by more than max_rss_growth bytes since it started,
+#   * more than max_leaked_temp bytes have piled up in temp_dirs since it started, counted only while
+#     no job is running (so the files of live jobs are not mistaken for leaks),
+#   * it has been up for more than max_uptime seconds and has been idle for idle_seconds.
+#
+# A restart is never immediate. The scheduler is drained first: nothing new is admitted, waiting jobs
+# are turned away, and running jobs stop at their next checkpoint (a completed stage, see job_state.py)
+# or finish. Only when busy_fn() reports no work left, or after drain_timeout, is restart_fn called.
+# restart_fn is injectable: on a Space it calls the Hub, elsewhere it can exit for a supervisor to
+# restart the process, or just log, which is how the policy is exercised locally. A restart_fn that
+# only requests the restart (the Hub kills the container a little later) returns True: the app then
+# stays drained until it goes down, and asks again if it is still up after drain_timeout. When any
+# other restart_fn returns (a stand-in), the scheduler is reopened and on_resumed is called in place
+# of a fresh start.
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, dirs, files in os.walk(path, onerror=lambda e: None):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+class RestartPolicy:
+    def __init__(self, restart_fn, scheduler, busy_fn, max_rss_growth: int = 0, max_leaked_temp: int = 0, temp_dirs=(), max_uptime: float = 0, idle_seconds: float = 600, drain_timeout: float = 3600, on_resumed=None, rss_fn=get_process_rss_bytes, clock=time.monotonic):
+        self.restart_fn = restart_fn
+        self.scheduler = scheduler
+        self.busy_fn = busy_fn
+        self.max_rss_growth = max_rss_growth
+        self.max_leaked_temp = max_leaked_temp
+        self.temp_dirs = [d for d in temp_dirs if d]
+        self.max_uptime = max_uptime
+        self.idle_seconds = idle_seconds
+        self.drain_timeout = drain_timeout
+        self.on_resumed = on_resumed
+        self.rss_fn = rss_fn
+        self.clock = clock
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.started = self.clock()
+        self.baseline_rss = self.rss_fn() or 0
+        self.baseline_temp = self.temp_bytes()
+        self.idle_since = None
+        self.drain_started = None
+        self.restart_requested = None
+        self.reason = None
+
+    def temp_bytes(self) -> int:
+        return sum(_tree_size(d) for d in self.temp_dirs if os.path.isdir(d))
+
+    def reasons(self) -> list[str]:
+        # Why the app should restart now; empty if it should not.
+        now = self.clock()
+        reasons = []
+        rss = self.rss_fn()
+        if self.max_rss_growth > 0 and rss and rss - self.baseline_rss > self.max_rss_growth:
+            reasons.append(f"memory grew by {(rss - self.baseline_rss) / 1024**3:.1f} GB since startup")
+        if self.idle_since is not None:
+            if self.max_leaked_temp > 0:
+                leaked = self.temp_bytes() - self.baseline_temp
+                if leaked > self.max_leaked_temp:
+                    reasons.append(f"{leaked / 1024**3:.1f} GB left behind in temporary directories")
+            if self.max_uptime > 0 and now - self.started > self.max_uptime and now - self.idle_since >= self.idle_seconds:
+                reasons.append(f"up for {(now - self.started) / 3600:.1f} h and idle for {(now - self.idle_since) / 60:.0f} min")
+        return reasons
+
+    def check(self) -> str:
+        # Run periodically (e.g. every minute from a BackgroundScheduler). Returns "ok", "draining",
+        # "restarting" (requested, waiting to be shut down) or "restarted".
+        with self._lock:
+            now = self.clock()
+            busy = self.busy_fn()
+            if busy:
+                self.idle_since = None
+            elif self.idle_since is None:
+                self.idle_since = now
+
+            if self.restart_requested is not None:
+                if now - self.restart_requested < self.drain_timeout:
+                    return "restarting"
+                print(f"Still running {self.drain_timeout:.0f}s after requesting a restart; requesting it again.")
+
+            if self.drain_started is None:
+                reasons = self.reasons()
+                if not reasons:
+                    return "ok"
+                self.reason = "; ".join(reasons)
+                self.drain_started = now
+                print(f"Restart needed ({self.reason}). Draining: no new jobs, running jobs stop at their next checkpoint.")
+                self.scheduler.drain()
+                busy = self.busy_fn()
+
+            if busy:
+                if now - self.drain_started < self.drain_timeout:
+                    return "draining"
+                print(f"Still {busy} job(s) busy after {self.drain_timeout:.0f}s of draining; restarting anyway. They resume from their last checkpoint.")
+
+            print(f"Restarting ({self.reason}).")
+            try:
+                pending = self.restart_fn()
+            except Exception as e:
+                # Keep serving; the next check starts over.
+                print(f"Restart failed: {e}")
+                self.drain_started = None
+                self.restart_requested = None
+                self.scheduler.resume()
+                return "ok"
+            if pending:
+                # The restart happens shortly and elsewhere; stay drained so nothing starts in a doomed process.
+                self.restart_requested = now
+                print("Restart requested; staying drained until the app is shut down.")
+                return "restarting"
+            # A stand-in gets here, and the app carries on as if restarted.
+            self.restarts += 1
+            self._reset()
+            self.scheduler.resume()
+            if self.on_resumed:
+                self.on_resumed()
+            return "restarted"
@@ -0,0 +1,176 @@
+import os
+import sys
+
+# --- SYSTEM INFORMATION ---
+
+def get_total_memory_bytes() -> int | None:
+    # Returns the physical memory size in bytes, or None if it cannot be determined.
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+    return None
+
+def get_process_rss_bytes() -> int | None:
+    # Returns the resident memory of this process in bytes, or None if it cannot be determined.
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS)
+        GetProcessMemoryInfo = ctypes.windll.psapi.GetProcessMemoryInfo
+        GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        if GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    try:
+        # Peak rather than current RSS, but still a usable growth signal (KB on Linux, bytes on macOS).
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+# --- Containers and topology (Linux; elsewhere these fall back to the whole machine) ---
+
+def _read_first_line(path: str) -> str | None:
+    try:
+        with open(path, "r") as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+def parse_cpu_list(text: str) -> list[int]:
+    # Parses the kernel's CPU list format ("0-3,8,10-11").
+    cpus = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+def get_available_cpus() -> list[int]:
+    # CPUs this process may run on (its affinity mask, e.g. set by `docker --cpuset-cpus` or taskset).
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def get_cgroup_cpu_quota() -> float | None:
+    # CPUs' worth of time the container may use per period (`docker --cpus`), or None if unlimited.
+    line = _read_first_line("/sys/fs/cgroup/cpu.max")  # cgroup v2: "<quota> <period>" or "max <period>"
+    if line:
+        quota, _, period = line.partition(" ")
+        return int(quota) / int(period or 100000) if quota != "max" else None
+    quota, period = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+def get_cgroup_memory_limit() -> int | None:
+    # The container's memory limit in bytes, or None if unlimited.
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        line = _read_first_line(path)
+        if line and line != "max":
+            limit = int(line)
+            # cgroup v1 reports "unlimited" as a huge page-aligned number.
+            return limit if limit < 2**60 else None
+    return None
+
+def get_effective_cpu_count() -> int:
+    # CPUs the process can actually keep busy: its affinity mask, capped by the cgroup CPU quota.
+    cpus = len(get_available_cpus())
+    quota = get_cgroup_cpu_quota()
+    return max(1, min(cpus, int(quota))) if quota else cpus
+
+def get_usable_memory_bytes() -> int | None:
+    # Physical memory, capped by the container's memory limit.
+    limits = [m for m in (get_total_memory_bytes(), get_cgroup_memory_limit()) if m]
+    return min(limits) if limits else None
+
+def get_numa_nodes() -> list[list[int]]:
+    # The CPUs of each NUMA node, as listed by the kernel; one node with every CPU if there is no NUMA information.
+    nodes = []
+    root = "/sys/devices/system/node"
+    if os.path.isdir(root):
+        for name in sorted(os.listdir(root)):
+            if name.startswith("node") and name[4:].isdigit():
+                cpus = parse_cpu_list(_read_first_line(os.path.join(root, name, "cpulist")) or "")
+                if cpus:
+                    nodes.append(cpus)
+    return nodes or [list(range(os.cpu_count() or 1))]
+
+def get_physical_core_ids() -> dict[int, int]:
+    # Maps each CPU to its physical core (the lowest-numbered of its SMT siblings); every CPU is its own
+    # core if the topology is unknown.
+    cores = {}
+    for cpu in range(os.cpu_count() or 1):
+        siblings = parse_cpu_list(_read_first_line(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") or "")
+        cores[cpu] = min(siblings) if siblings else cpu
+    return cores
+
+def get_cpu_model() -> str:
+    # A short description of the CPU, used to tell tuning results of different machines apart.
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    import platform
+    return platform.processor() or platform.machine()
+
+def get_cpu_features() -> set[str]:
+    # x86 instruction set extensions of this CPU, in /proc/cpuinfo's lower-case names (avx, avx2, fma,
+    # f16c, avx512f, avx512bw, ...); empty if they cannot be determined.
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        # PF_* constants of IsProcessorFeaturePresent; older Windows versions report False for ones they do not know.
+        present = ctypes.windll.kernel32.IsProcessorFeaturePresent
+        flags = {"sse3": 13, "ssse3": 36, "sse4_1": 37, "sse4_2": 38, "avx": 39, "avx2": 40, "avx512f": 41}
+        features = {name for name, feature in flags.items() if present(feature)}
+        # Windows has no flags for these: every AVX2 CPU also has FMA and F16C, and every AVX-512 CPU outside Xeon Phi has BW.
+        if "avx2" in features:
+            features |= {"fma", "f16c"}
+        if "avx512f" in features:
+            features.add("avx512bw")
+        return features
+    if sys.platform == "darwin":
+        import subprocess
+        try:
+            output = subprocess.run(["sysctl", "-n", "machdep.cpu.features", "machdep.cpu.leaf7_features"], capture_output=True, text=True).stdout
+        except OSError:
+            return set()
+        return {flag.lower().replace("avx1.0", "avx") for flag in output.split()}
+    return set()
@@ -0,0 +1,147 @@
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from system_info import get_cpu_features
+
+# --- LLAMA.CPP BUILD VARIANTS ---
+# A tool may come in several builds side by side, named <tool>_<variant>[.exe] (like the shipped
+# llama-imatrix_avx512.exe and llama-imatrix_avx.exe), next to the plain <tool>[.exe]. For each tool
+# the resolver picks the fastest build this CPU can run, in this order:
+#
+#   * suffixed builds whose instruction sets the CPU has, most capable first (avx512, avx2, avx),
+#   * the plain build (compiled on this machine by start.sh, or an official release),
+#   * builds without SIMD requirements (generic, noavx).
+#
+# A candidate is only used once it passes a self-check: it must start and print its usage. A build that
+# crashes instead (an illegal instruction, a DLL that fails to load, the silent ggml-rpc.dll crash) is
+# skipped in favour of the next one. The choice is made once per tool and logged.
+#
+# Official Windows builds load every ggml backend DLL found next to the executable. Loading
+# ggml-rpc.dll makes them crash silently, so they are given a private CPU-only copy of their directory
+# (see cpu_only_executable below). Every run of every tool, concurrent or not, uses that copy, and the
+# shared install is never modified.
+
+VARIANT_FEATURES = {
+    "avx512": {"avx512f", "avx512bw"},
+    "avx2": {"avx2", "fma", "f16c"},
+    "avx": {"avx"},
+    "generic": set(),
+    "noavx": set(),
+}
+# "" is the plain build.
+VARIANT_ORDER = ["avx512", "avx2", "avx", "", "generic", "noavx"]
+SELF_CHECK_TIMEOUT = 60
+
+def crashed(returncode: int, output: str) -> bool:
+    # Killed by a signal (SIGILL, SIGSEGV), ended with a Windows NTSTATUS error (0xC000001D illegal
+    # instruction, 0xC0000135 missing DLL, ...), or exited without printing anything.
+    return returncode < 0 or returncode >= 0xC0000000 or not output.strip()
+
+class ToolResolver:
+    def __init__(self, dirs: list[str], variant: str | None = None, prepare=lambda path: path, features: set[str] | None = None):
+        self.dirs = dirs
+        # Only this variant is considered ("" = the plain build); None = choose automatically.
+        self.variant = variant
+        # Maps a build to the path it is actually run from (e.g. cpu_only_executable); self-checks use it too.
+        self.prepare = prepare
+        self.features = get_cpu_features() if features is None else features
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    def candidates(self, tool: str) -> list[tuple[str, str]]:
+        # (variant, path) of every build of tool that exists and that this CPU can run, best first.
+        suffix = ".exe" if sys.platform == "win32" else ""
+        found = []
+        for variant in VARIANT_ORDER:
+            if self.variant is not None and variant != self.variant:
+                continue
+            if variant and not VARIANT_FEATURES[variant] <= self.features:
+                continue
+            name = f"{tool}_{variant}{suffix}" if variant else f"{tool}{suffix}"
+            for directory in self.dirs:
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    found.append((variant, path))
+                    break
+        return found
+
+    def self_check(self, path: str) -> bool:
+        try:
+            result = subprocess.run([path, "--help"], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=SELF_CHECK_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"{path} failed its self-check: {e}")
+            return False
+        if crashed(result.returncode, result.stdout.decode("utf-8", errors="replace")):
+            print(f"{path} failed its self-check (exit code {result.returncode}).")
+            return False
+        return True
+
+    def resolve(self, tool: str) -> str:
+        # Path of the build of tool to run. Without any working build, the plain path is returned so
+        # that running it fails with the tool's own error.
+        with self._lock:
+            if tool not in self._resolved:
+                candidates = self.candidates(tool)
+                candidates = [(variant, self.prepare(path)) for variant, path in candidates]
+                chosen = next(((variant, path) for variant, path in candidates if self.self_check(path)), None)
+                if chosen:
+                    if len(candidates) > 1 or chosen[0]:
+                        print(f"Using the {chosen[0] or 'plain'} build of {tool}: {chosen[1]}")
+                    self._resolved[tool] = chosen[1]
+                else:
+                    self._resolved[tool] = os.path.join(self.dirs[0], f"{tool}.exe" if sys.platform == "win32" else tool)
+            return self._resolved[tool]
+
+# --- CPU-only copies ---
+
+RPC_DLL = "ggml-rpc.dll"
+CPU_ONLY_PREFIX = ".cpu_only-"
+_cpu_only_lock = threading.Lock()
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def cpu_only_executable(path: str) -> str:
+    # Returns path run from a copy of its directory without ggml-rpc.dll: hardlinks (copies across
+    # volumes) of its executables and DLLs in <dir>/.cpu_only-<fingerprint>. The fingerprint covers the
+    # name, size and mtime of every linked file, so an updated install gets a fresh copy and the stale
+    # ones are removed once nothing runs from them. Returns path unchanged if there is no ggml-rpc.dll.
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(os.path.join(directory, RPC_DLL)):
+        return path
+    with _cpu_only_lock:
+        files = sorted(
+            name for name in os.listdir(directory)
+            if name.lower().endswith((".exe", ".dll")) and name.lower() != RPC_DLL and os.path.isfile(os.path.join(directory, name))
+        )
+        fingerprint = hashlib.sha256()
+        for name in files:
+            st = os.stat(os.path.join(directory, name))
+            fingerprint.update(f"{name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+        private_dir = os.path.join(directory, CPU_ONLY_PREFIX + fingerprint.hexdigest()[:12])
+        if not os.path.isdir(private_dir):
+            # Built under a temporary name and renamed, so no run ever sees a half-built copy; if another
+            # process wins the rename, its copy is used.
+            tmp_dir = tempfile.mkdtemp(prefix=".tmp-cpu_only-", dir=directory)
+            try:
+                for name in files:
+                    _link_or_copy(os.path.join(directory, name), os.path.join(tmp_dir, name))
+                os.rename(tmp_dir, private_dir)
+                print(f"Running llama.cpp tools from a CPU-only copy without {RPC_DLL}: {private_dir}")
+            except OSError:
+                if not os.path.isdir(private_dir):
+                    raise
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            for name in os.listdir(directory):
+                stale = os.path.join(directory, name)
+                if name.startswith(CPU_ONLY_PREFIX) and stale != private_dir:
+                    shutil.rmtree(stale, ignore_errors=True)  # fails harmlessly while a tool still runs from it
+    return os.path.join(private_dir, os.path.basename(path))